@@ -0,0 +1,136 @@
+"""Benchmarks: measures RabbitHole's commands against a local fake of the RabbitMQ management API.
+
+    $ python -m Benchmarks --scenarios snag replay --counts 1000 10000 --sizes 256 4096 --latency 0.001
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+
+from Benchmarks.scenarios import SCENARIOS
+from Benchmarks.scenarios import run_scenario
+from RabbitHole.json_codec import BACKENDS
+from RabbitHole.json_codec import JsonCodec
+
+
+def main():
+    """The benchmark entry point."""
+
+    arguments = _parse_command_line_arguments()
+
+    # Nothing from the commands should end up in a log file
+    logging.getLogger('Benchmarks').addHandler(logging.NullHandler())
+
+    results = []
+
+    print('JSON codec: {0}'.format(JsonCodec(arguments.json_backends).name))
+    print('{0:<14}{1:>8}{2:>9}{3:>10}{4:>12}{5:>10}{6:>10}{7:>10}  {8}'.format(
+        'Scenario', 'Size', 'Count', 'Moved', 'Msgs/sec', 'p50 ms', 'p99 ms', 'Peak MB', 'Error'))
+    print('-' * 100)
+
+    for scenario in arguments.scenarios:
+        for message_size in arguments.sizes:
+            for message_count in arguments.counts:
+                result = _run_scenario_in_child_process(scenario, message_count, message_size, arguments)
+                results.append(result)
+                print('{scenario:<14}{message_size:>8}{message_count:>9}{moved_count:>10}{messages_per_second:>12.1f}'
+                      '{p50_ms:>10.2f}{p99_ms:>10.2f}{peak_rss:>10}  {error}'.format(
+                          peak_rss='n/a' if result['peak_rss_mb'] is None else '{0:.1f}'.format(result['peak_rss_mb']),
+                          **dict(result, error=result['error'] or '')))
+
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump({'settings': {'latency': arguments.latency,
+                                    'error_rate': arguments.error_rate,
+                                    'queue_depth': arguments.queue_depth,
+                                    'json_backends': arguments.json_backends},
+                       'results': results},
+                      output_file,
+                      indent=2)
+
+
+def _run_scenario_in_child_process(scenario, message_count, message_size, arguments):
+    """Runs a scenario in its own process so its peak memory isn't mixed up with the other scenarios.
+    """
+
+    result_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_scenario,
+                                      args=(result_queue,
+                                            scenario,
+                                            message_count,
+                                            message_size,
+                                            arguments.latency,
+                                            arguments.error_rate,
+                                            arguments.queue_depth,
+                                            arguments.seed,
+                                            arguments.json_backends))
+    process.start()
+    result = result_queue.get()
+    process.join()
+
+    if isinstance(result, Exception):
+        raise result
+
+    return result
+
+
+def _run_scenario(result_queue, *args):
+    # The commands write to the console as they go (which is part of what's being measured) but it's not worth seeing
+    sys.stdout = open(os.devnull, 'w')
+
+    try:
+        result_queue.put(run_scenario(*args))
+    except Exception as err:
+        result_queue.put(err)
+
+
+def _parse_command_line_arguments():
+    parser = argparse.ArgumentParser(description='Benchmarks RabbitHole against a fake RabbitMQ management API.')
+
+    parser.add_argument('--scenarios',
+                        nargs='+',
+                        choices=SCENARIOS,
+                        default=list(SCENARIOS),
+                        help='the scenarios to run')
+    parser.add_argument('--counts',
+                        nargs='+',
+                        type=int,
+                        default=[1000, 10000],
+                        help='the numbers of messages to move')
+    parser.add_argument('--sizes',
+                        nargs='+',
+                        type=int,
+                        default=[256, 4096],
+                        help='the message payload sizes in bytes')
+    parser.add_argument('--latency',
+                        type=float,
+                        default=0.0,
+                        help='the seconds the fake API waits before answering each request')
+    parser.add_argument('--error_rate',
+                        type=float,
+                        default=0.0,
+                        help='the share (0 to 1) of requests the fake API fails')
+    parser.add_argument('--queue_depth',
+                        type=int,
+                        help='the number of messages on the source queue (the message count by default)')
+    parser.add_argument('--seed',
+                        type=int,
+                        help='the seed for the injected errors')
+    parser.add_argument('--json_backends',
+                        nargs='+',
+                        choices=BACKENDS,
+                        default=list(BACKENDS),
+                        help='the JSON backends RabbitHole may use (if installed)')
+    parser.add_argument('--output',
+                        help='a file to save the results to (as JSON)')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import collections
+import json
+import random
+import threading
+import time
+import urllib
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+
+
+class FakeManagementApi(object):
+    """This class represents an in-process stand-in for the RabbitMQ management API.
+
+    Only the endpoints RabbitHole uses are emulated: listing the queues, getting messages from a queue and publishing a
+    message to an exchange. Every exchange delivers to the queue with the same name. Each request can be slowed down
+    (latency) and a share of them can fail with a 500 (error rate).
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=None):
+        self._latency = latency
+        self._error_rate = error_rate
+        self._random = random.Random(seed)
+        self._queues = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        self._server = None
+        self._server_thread = None
+        self.get_count = 0
+        self.delivered_count = 0
+        self.published_count = 0
+        self.error_count = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1'
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        """Starts serving on a free local port.
+        """
+
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), _RequestHandler)
+        self._server.api = self
+        self._server_thread = threading.Thread(target=self._server.serve_forever, name='fake-management-api')
+        self._server_thread.setDaemon(True)
+        self._server_thread.start()
+
+    def stop(self):
+        """Stops serving.
+        """
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server_thread.join()
+            self._server = None
+
+    def fill_queue(self, queue, messages):
+        """Puts messages on a queue (without going through the API).
+
+        :param queue: The name of the queue.
+        :param messages: The messages (in the management API format).
+        """
+
+        with self._lock:
+            self._queues[queue].extend(messages)
+
+    def queue_depth(self, queue):
+        """Gets the number of messages on a queue.
+
+        :param queue: The name of the queue.
+        :return: The number of messages.
+        """
+
+        with self._lock:
+            return len(self._queues[queue])
+
+    def get_queue(self, queue):
+        """Gets a copy of the messages on a queue.
+
+        :param queue: The name of the queue.
+        :return: A list of the messages.
+        """
+
+        with self._lock:
+            return list(self._queues[queue])
+
+    def handle(self, path, body):
+        """Handles a request.
+
+        :param path: The request path.
+        :param body: The request body.
+        :return: A (status code, response) tuple.
+        """
+
+        if self._latency:
+            time.sleep(self._latency)
+
+        parts = [urllib.unquote(part) for part in path.split('?')[0].strip('/').split('/')]
+
+        with self._lock:
+            if self._error_rate and self._random.random() < self._error_rate:
+                self.error_count += 1
+                return 500, {'error': 'internal_server_error', 'reason': 'Injected by the fake management API'}
+
+            if len(parts) == 3 and parts[:2] == ['api', 'queues']:
+                return 200, [{'name': queue, 'vhost': parts[2], 'messages': len(messages)}
+                             for queue, messages in sorted(self._queues.items())]
+
+            if len(parts) == 5 and parts[:2] == ['api', 'queues'] and parts[4] == 'get':
+                return 200, self._get(parts[3], json.loads(body))
+
+            if len(parts) == 5 and parts[:2] == ['api', 'exchanges'] and parts[4] == 'publish':
+                return 200, self._publish(parts[3], json.loads(body))
+
+        return 404, {'error': 'Object Not Found', 'reason': 'Not Found'}
+
+    def _get(self, queue, request):
+        messages = self._queues[queue]
+        count = min(int(request.get('count', 1)), len(messages))
+        requeue = str(request.get('requeue', 'true')).lower() == 'true'
+
+        response = []
+        for position in range(count):
+            message = dict(messages[position] if requeue else messages.popleft())
+            message['redelivered'] = requeue
+            # The number of messages left on the queue after this one
+            message['message_count'] = len(messages) - position - 1 if requeue else len(messages)
+            response.append(message)
+
+        self.get_count += 1
+        self.delivered_count += count
+        return response
+
+    def _publish(self, exchange, request):
+        self._queues[exchange].append({'payload_bytes': len(request.get('payload', '')),
+                                       'redelivered': False,
+                                       'exchange': exchange,
+                                       'routing_key': request.get('routing_key', ''),
+                                       'message_count': 0,
+                                       'properties': request.get('properties', {}),
+                                       'payload': request.get('payload', ''),
+                                       'payload_encoding': request.get('payload_encoding', 'string')})
+
+        self.published_count += 1
+        return {'routed': True}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive (like the real management API) so connection pooling behaves the same way
+    protocol_version = 'HTTP/1.1'
+
+    # Send each response in one go (small unbuffered writes run into delayed ACKs and add 40ms to every request)
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._respond(*self.server.api.handle(self.path, None))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.getheader('Content-Length') or 0))
+        self._respond(*self.server.api.handle(self.path, body))
+
+    def _respond(self, status_code, response):
+        response_body = json.dumps(response)
+
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,257 @@
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from timeit import default_timer as timer
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from Benchmarks.fake_management_api import FakeManagementApi
+from RabbitHole import json_codec
+from RabbitHole.configuration import Configuration
+from RabbitHole.console import Console
+from RabbitHole.message_archive import MessageArchiveWriter
+from RabbitHole.queue_command import QueueCommand
+from RabbitHole.rabbitmq import RabbitMQError
+from RabbitHole.replay_command import ReplayCommand
+from RabbitHole.shuttle_command import ShuttleCommand
+from RabbitHole.snag_command import SnagCommand
+from RabbitHole.transports import HttpTransport
+
+SCENARIOS = ('snag', 'replay', 'queue_file', 'queue_folder', 'shuttle')
+
+SOURCE_QUEUE = 'benchmark.source'
+ERROR_QUEUE = 'benchmark.error'
+DESTINATION_QUEUE = 'benchmark.destination'
+
+# The number of files a queue_folder run splits its messages across
+FOLDER_FILE_COUNT = 10
+
+
+def create_message(number, message_size, source_queue=DESTINATION_QUEUE):
+    """Creates a message (in the management API format) that looks like an NServiceBus error.
+
+    :param number: The message number.
+    :param message_size: The size of the payload in bytes.
+    :param source_queue: The queue the message failed on.
+    :return: The message.
+    """
+
+    return {'payload_bytes': message_size,
+            'redelivered': False,
+            'exchange': '',
+            'routing_key': ERROR_QUEUE,
+            'message_count': 0,
+            'properties': {'delivery_mode': 2,
+                           'headers': {'NServiceBus.MessageId': 'benchmark-{0}'.format(number),
+                                       'NServiceBus.FailedQ': source_queue,
+                                       'NServiceBus.ProcessingEndpoint': source_queue,
+                                       'NServiceBus.Retries': 5,
+                                       'NServiceBus.TimeSent': '2016-01-01 00:00:00:000000 Z',
+                                       '$.diagnostics.hostid': 'benchmark'}},
+            'payload': 'x' * message_size,
+            'payload_encoding': 'string'}
+
+
+def create_messages(message_count, message_size, source_queue=DESTINATION_QUEUE):
+    return [create_message(number, message_size, source_queue) for number in range(message_count)]
+
+
+def run_scenario(scenario,
+                 message_count,
+                 message_size,
+                 latency=0.0,
+                 error_rate=0.0,
+                 queue_depth=None,
+                 seed=None,
+                 json_backends=json_codec.BACKENDS):
+    """Runs a RabbitHole command against a fake management API and measures it.
+
+    :param scenario: The scenario (one of SCENARIOS).
+    :param message_count: The number of messages the command is asked to move.
+    :param message_size: The size of each message payload in bytes.
+    :param latency: The seconds the fake API waits before answering each request.
+    :param error_rate: The share (0 to 1) of requests the fake API fails.
+    :param queue_depth: The number of messages on the source queue (the message count if None).
+    :param seed: The seed for the injected errors.
+    :param json_backends: The JSON backends RabbitHole is allowed to use.
+    :return: A dictionary of the results.
+    """
+
+    if scenario not in SCENARIOS:
+        raise ValueError('{0} is not a benchmark scenario'.format(scenario))
+
+    codec = json_codec.JsonCodec(json_backends)
+    json_codec.set_codec(codec)
+
+    queue_depth = max(message_count, queue_depth or 0)
+    working_folder = tempfile.mkdtemp(prefix='rabbithole-benchmark-')
+    latencies = []
+    error = None
+
+    # Anything a command leaves behind (like a shuttle rescue file) ends up in the working folder
+    original_folder = os.getcwd()
+    os.chdir(working_folder)
+
+    try:
+        with FakeManagementApi(latency, error_rate, seed) as api:
+            command = _prepare_scenario(scenario, api, working_folder, message_count, message_size, queue_depth)
+
+            with _RecordedLatencies(latencies):
+                start = timer()
+                try:
+                    command()
+                except (RabbitMQError, IOError) as err:
+                    error = str(err)
+                elapsed_seconds = timer() - start
+
+            moved_count = api.delivered_count if scenario == 'snag' else api.published_count
+    finally:
+        os.chdir(original_folder)
+        shutil.rmtree(working_folder, ignore_errors=True)
+
+    latencies.sort()
+
+    return {'scenario': scenario,
+            'message_count': message_count,
+            'message_size': message_size,
+            'moved_count': moved_count,
+            'elapsed_seconds': elapsed_seconds,
+            'messages_per_second': moved_count / elapsed_seconds if elapsed_seconds > 0 else 0.0,
+            'request_count': len(latencies),
+            'p50_ms': _percentile(latencies, 50) * 1000,
+            'p99_ms': _percentile(latencies, 99) * 1000,
+            'peak_rss_mb': get_peak_rss_mb(),
+            'json_codec': codec.name,
+            'error': error}
+
+
+def get_peak_rss_mb():
+    """Gets the peak resident set size of the process in megabytes (or None if the platform can't say).
+    """
+
+    if resource is None:
+        return None
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes and macOS reports bytes
+    if sys.platform == 'darwin':
+        return peak_rss / (1024.0 * 1024.0)
+    return peak_rss / 1024.0
+
+
+def _percentile(sorted_values, percentile):
+    if not sorted_values:
+        return 0.0
+    index = int(round(percentile / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def _prepare_scenario(scenario, api, working_folder, message_count, message_size, queue_depth):
+    """Sets up the fake API and the files for a scenario.
+
+    :return: A callable that runs the command.
+    """
+
+    arguments = argparse.Namespace(rabbit_host_url=api.url,
+                                   rabbit_host_port=api.port,
+                                   rabbit_vhost='%2F',
+                                   rabbit_username='guest',
+                                   rabbit_password='guest',
+                                   transport='http',
+                                   simulate=False,
+                                   verbose=False,
+                                   silent=False,
+                                   debug=False,
+                                   message_count=str(message_count))
+
+    if scenario == 'snag':
+        api.fill_queue(SOURCE_QUEUE, create_messages(queue_depth, message_size))
+        arguments.command = 'snag'
+        arguments.message_source_queue = SOURCE_QUEUE
+        arguments.save_file = os.path.join(working_folder, 'snagged.json')
+        return _create_command(SnagCommand, arguments).execute
+
+    if scenario == 'replay':
+        api.fill_queue(ERROR_QUEUE, create_messages(queue_depth, message_size))
+        arguments.command = 'replay'
+        arguments.message_source_queue = ERROR_QUEUE
+        return _create_command(ReplayCommand, arguments).execute
+
+    if scenario == 'shuttle':
+        api.fill_queue(SOURCE_QUEUE, create_messages(queue_depth, message_size))
+        arguments.command = 'shuttle'
+        arguments.message_source_queue = SOURCE_QUEUE
+        arguments.rabbit_destination_queue = DESTINATION_QUEUE
+        return _create_command(ShuttleCommand, arguments).execute
+
+    arguments.command = 'queue'
+    arguments.rabbit_destination_queue = DESTINATION_QUEUE
+    messages = create_messages(message_count, message_size)
+
+    if scenario == 'queue_file':
+        arguments.message_source_file = os.path.join(working_folder, 'messages.json')
+        _write_archive(arguments.message_source_file, messages)
+        return _create_command(QueueCommand, arguments).queue_file
+
+    arguments.message_source_file = os.path.join(working_folder, 'messages')
+    os.mkdir(arguments.message_source_file)
+    for file_number in range(FOLDER_FILE_COUNT):
+        _write_archive(os.path.join(arguments.message_source_file, 'messages-{0}.json'.format(file_number)),
+                       messages[file_number::FOLDER_FILE_COUNT])
+    return _create_command(QueueCommand, arguments).queue_folder
+
+
+def _create_command(command_class, arguments):
+    logger = logging.getLogger('Benchmarks')
+    configuration = Configuration(logger, arguments)
+    return command_class(configuration, Console(configuration), logger)
+
+
+def _write_archive(file_name, messages):
+    with MessageArchiveWriter(file_name) as archive:
+        for message in messages:
+            archive.write(message)
+
+
+class _RecordedLatencies(object):
+    """Records how long every management API request takes (from the client's side) while it's in use.
+    """
+
+    def __init__(self, latencies):
+        self._latencies = latencies
+        self._lock = threading.Lock()
+        self._originals = {}
+
+    def __enter__(self):
+        for name in ('get_messages', 'publish_message'):
+            original = getattr(HttpTransport, name)
+            self._originals[name] = original
+            setattr(HttpTransport, name, self._timed(original))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for name, original in self._originals.iteritems():
+            setattr(HttpTransport, name, original)
+
+    def _timed(self, method):
+        latencies = self._latencies
+        lock = self._lock
+
+        def timed(*args, **kwargs):
+            start = timer()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed_seconds = timer() - start
+                with lock:
+                    latencies.append(elapsed_seconds)
+
+        return timed
@@ -12,7 +12,9 @@ from RabbitHole import __version__
 from RabbitHole.command_line_arguments import CommandLineArguments
 from RabbitHole.configuration import Configuration
 from RabbitHole.console import Console
+from RabbitHole.rabbitmq import RabbitMQError
 from RabbitHole.replay_command import ReplayCommand
+from RabbitHole.shuttle_command import ShuttleCommand
 from RabbitHole.snag_command import SnagCommand
 from RabbitHole.queue_command import QueueCommand
 
@@ -45,24 +47,44 @@ def main(args=None):
     console.display_welcome(__program_name__, __version__)
 
     start = timer()
-
-    if config.command_line_arguments.command == 'snag':
-        snag_command = SnagCommand(config, console, logger)
-        snag_command.execute()
-    elif config.command_line_arguments.command == 'replay':
-        replay_command = ReplayCommand(config, console, logger)
-        replay_command.execute()
-    elif config.command_line_arguments.command == 'queue':
-        queue_command = QueueCommand(config, console, logger)
-        if os.path.isfile(config.command_line_arguments.message_source_file):
-            queue_command.queue_file()
-        elif os.path.isdir(config.command_line_arguments.message_source_file):
-            queue_command.queue_folder()
-        else:
-            print('\033[1;31;40m+ ERROR: \033[0m{0} is not a file or a folder!'.format(
-                config.command_line_arguments.message_source_file))
-
-    end = timer()
+    exit_code = 0
+
+    try:
+        if config.command_line_arguments.command == 'snag':
+            snag_command = SnagCommand(config, console, logger)
+            snag_command.execute()
+        elif config.command_line_arguments.command == 'replay':
+            replay_command = ReplayCommand(config, console, logger)
+            replay_command.execute()
+        elif config.command_line_arguments.command == 'shuttle':
+            shuttle_command = ShuttleCommand(config, console, logger)
+            shuttle_command.execute()
+        elif config.command_line_arguments.command == 'queue':
+            queue_command = QueueCommand(config, console, logger)
+            if os.path.isfile(config.command_line_arguments.message_source_file):
+                queue_command.queue_file()
+            elif os.path.isdir(config.command_line_arguments.message_source_file):
+                queue_command.queue_folder()
+            else:
+                print('\033[1;31;40m+ ERROR: \033[0m{0} is not a file or a folder!'.format(
+                    config.command_line_arguments.message_source_file))
+    except RabbitMQError as err:
+        # The details have already been written to the console
+        logger.error(err)
+        exit_code = 1
+    finally:
+        # Every publisher in the run shared the one dead-letter file, so it's closed whatever happened
+        config.dead_letters.close()
+
+        end = timer()
+
+        # The statistics are written whatever happened too (a failed run is the one they're most wanted for)
+        if config.stats_json:
+            config.statistics.write_json(config.stats_json, end - start)
+            console.write_update('Run statistics written to {0}'.format(config.stats_json))
+
+    if exit_code:
+        sys.exit(exit_code)
     if not config.silent:
         # Make sure we didn't jack with the user's terminal colors
         print('\033[0;32;40m+ \033[0mDone in {0}!\033[0m\n'.format(end - start))
@@ -0,0 +1,107 @@
+import threading
+
+# The responses that mean the broker is being asked to do too much
+OVERLOAD_STATUS_CODES = (429, 503)
+
+# Requests that take more than this many times the usual latency (smoothed) mean the broker is struggling
+LATENCY_TOLERANCE = 4.0
+
+# Latencies under this many seconds are never counted as slow (they're all noise)
+LATENCY_FLOOR = 0.005
+
+# How much of the window is kept when the broker is struggling
+DECREASE_FACTOR = 0.5
+
+# How quickly the usual latency forgets the best latency it has seen (per request)
+BASELINE_DRIFT = 0.01
+
+# How much each request counts towards the smoothed latency (so one slow request among fast ones is just jitter)
+SMOOTHING = 0.2
+
+
+class AdaptiveLimiter(object):
+    """This class represents the number of requests that can be in flight at the same time, tuned as the run goes.
+
+    The window grows by one request for every window of healthy requests (additive increase) and halves when a request
+    is slow or the broker says it's overloaded (multiplicative decrease), but never more than once per window and
+    never outside the floor and the ceiling. Requests are slow when their smoothed latency is more than
+    LATENCY_TOLERANCE times the usual latency, which is the best latency seen lately. Each kind of request (a get, a
+    publish) is measured against its own latencies, since a get of a page of messages takes longer than a publish.
+    """
+
+    def __init__(self, initial_limit, floor, ceiling):
+        self._floor = max(1, floor)
+        self._ceiling = max(self._floor, ceiling)
+        self._limit = float(min(max(initial_limit, self._floor), self._ceiling))
+        self._in_flight = 0
+        self._latencies = {}
+        # The first slow request can shrink the window straight away
+        self._completed_since_decrease = self._ceiling
+        self._condition = threading.Condition()
+
+    @property
+    def floor(self):
+        return self._floor
+
+    @property
+    def ceiling(self):
+        return self._ceiling
+
+    @property
+    def limit(self):
+        """Gets the number of requests that can be in flight right now.
+        """
+        return int(self._limit)
+
+    def acquire(self):
+        """Waits until there's room in the window for another request.
+        """
+
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, latency, overloaded=False, kind=None):
+        """Frees up the room a request was using and adjusts the window.
+
+        :param latency: How long the request took in seconds.
+        :param overloaded: If True, the broker said it was overloaded.
+        :param kind: The kind of request (its latency is only compared with the latencies of the same kind).
+        """
+
+        with self._condition:
+            self._in_flight -= 1
+            self._completed_since_decrease += 1
+
+            if not overloaded:
+                self._add_latency(kind, latency)
+
+            if overloaded or self._is_slow(kind):
+                if self._completed_since_decrease >= self._limit:
+                    self._limit = max(self._floor, self._limit * DECREASE_FACTOR)
+                    self._completed_since_decrease = 0
+            else:
+                self._limit = min(self._ceiling, self._limit + 1.0 / self._limit)
+
+            self._condition.notify_all()
+
+    def _add_latency(self, kind, latency):
+        if kind not in self._latencies:
+            self._latencies[kind] = [latency, latency]
+            return
+
+        baseline, smoothed = self._latencies[kind]
+        smoothed += (latency - smoothed) * SMOOTHING
+        if latency < baseline:
+            baseline = latency
+        else:
+            baseline += (latency - baseline) * BASELINE_DRIFT
+        self._latencies[kind] = [baseline, smoothed]
+
+    def _is_slow(self, kind):
+        if kind not in self._latencies:
+            return False
+
+        baseline, smoothed = self._latencies[kind]
+        return smoothed > max(LATENCY_FLOOR, baseline * LATENCY_TOLERANCE)
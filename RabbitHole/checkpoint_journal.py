@@ -0,0 +1,144 @@
+import os
+import threading
+
+from RabbitHole import json_codec
+from RabbitHole.message_filter import get_message_fingerprint
+
+
+class CheckpointJournal(object):
+    """This class represents the append-only record of the messages a run has published.
+
+    Every message RabbitMQ acknowledges is added to the journal straight away, so an interrupted run can be resumed
+    without publishing anything twice. Messages from a file are journalled by their position in it (file, message
+    number) and messages from a queue by their ID.
+
+    Only what an interrupted run published is skipped. What the current run publishes is written down but never looked
+    up, so two messages that share an ID in the same run are both published.
+
+    Positions are mostly published in order, so for each file only the number below which everything has been
+    published is held (plus any published messages above it) rather than every position.
+    """
+
+    def __init__(self, file_name, resume=False):
+        self._file_name = file_name
+        self._lock = threading.Lock()
+        self._committed_keys = set()
+        self._committed_positions = {}
+        self._watermarks = {}
+        self._resumed_count = 0
+        self._last_line_is_complete = True
+
+        if resume and os.path.isfile(file_name):
+            self._load()
+        elif os.path.isfile(file_name):
+            raise ValueError('{0} holds the progress of an interrupted run'.format(file_name))
+
+        self._file = open(file_name, 'ab')
+
+        if not self._last_line_is_complete:
+            # Start on a line of our own
+            self._file.write('\n')
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    @property
+    def resumed_count(self):
+        """The number of messages the interrupted run had already published.
+        """
+
+        return self._resumed_count
+
+    def is_committed(self, key):
+        """Checks whether a message was published by the interrupted run being resumed.
+
+        :param key: The key of the message (see get_message_key).
+        :return: True if the message has been published.
+        """
+
+        with self._lock:
+            if isinstance(key, tuple):
+                source, number = key
+                return number <= self._watermarks.get(source, 0) or number in self._committed_positions.get(source, ())
+            return key in self._committed_keys
+
+    def commit(self, key):
+        """Records that a message has been published.
+
+        :param key: The key of the message (see get_message_key).
+        """
+
+        line = json_codec.dumps(list(key) if isinstance(key, tuple) else key) + '\n'
+
+        with self._lock:
+            # Flushed every time so nothing is lost if the process is killed (the operating system still has it)
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self, completed=False):
+        """Closes the journal.
+
+        :param completed: If True, the run finished so there's nothing to resume and the journal is deleted.
+        """
+
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+        if completed:
+            os.remove(self._file_name)
+
+    def _load(self):
+        with open(self._file_name, 'rb') as journal_file:
+            for line in journal_file:
+                self._last_line_is_complete = line.endswith('\n')
+                try:
+                    key = json_codec.loads(line)
+                except ValueError:
+                    # The last line of a killed run can be cut short (and wasn't acknowledged as far as we know)
+                    continue
+                self._add(tuple(key) if isinstance(key, list) else key)
+                self._resumed_count += 1
+
+    def _add(self, key):
+        if not isinstance(key, tuple):
+            self._committed_keys.add(key)
+            return
+
+        source, number = key
+        positions = self._committed_positions.setdefault(source, set())
+        positions.add(number)
+
+        watermark = self._watermarks.get(source, 0)
+        while watermark + 1 in positions:
+            watermark += 1
+            positions.remove(watermark)
+        self._watermarks[source] = watermark
+
+
+def get_message_key(message, source=None, number=None):
+    """Gets the key a message is journalled under.
+
+    :param message: The message.
+    :param source: The file the message came from (if any).
+    :param number: The number of the message in the file (counting from 1).
+    :return: A (source, number) tuple for a message from a file, otherwise the message ID (or a hash of its properties
+             and payload if it doesn't have an ID).
+    """
+
+    if source is not None:
+        if isinstance(source, str):
+            # Keys read back from the journal are unicode, so file names are too (whatever characters are in them)
+            try:
+                source = source.decode('utf-8')
+            except UnicodeDecodeError:
+                source = source.decode('latin-1')
+        return source, number
+
+    # What the broker adds to a message it returns (like redelivered and message_count) changes each time it's read, so
+    # only the message ID (or the properties and payload) can be matched up by a resumed run
+    return get_message_fingerprint(message)
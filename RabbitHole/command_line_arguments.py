@@ -1,5 +1,14 @@
 import argparse
 
+from RabbitHole.message_filter import compile_predicate
+
+DEDUPLICATE_HELP = ('publishes messages with the same destination, routing key and payload once (the copies are '
+                    'counted and skipped)')
+
+WHERE_HELP = ('only takes the messages that meet a condition, such as "routing_key == error", '
+              '"properties.headers.NServiceBus.ExceptionInfo.ExceptionType ~ Timeout", "payload_bytes > 1024" or '
+              '"exists properties.message_id" (repeat to require every condition)')
+
 
 class CommandLineArguments(object):
     """This class represents the command line arguments.
@@ -23,7 +32,7 @@ class CommandLineArguments(object):
         # Common arguments
         parser.add_argument('-r',
                             '--rabbit_host_url',
-                            help='the RabbitMQ host URL')
+                            help='the RabbitMQ host URL (or a comma-separated list of the cluster nodes)')
         parser.add_argument('-p',
                             '--rabbit_host_port',
                             type=int,
@@ -37,6 +46,15 @@ class CommandLineArguments(object):
         parser.add_argument('-w',
                             '--rabbit_password',
                             help='the RabbitMQ password')
+        parser.add_argument('--transport',
+                            choices=['http', 'amqp'],
+                            help='the transport to use (the management HTTP API or native AMQP)')
+        parser.add_argument('--rabbit_amqp_port',
+                            type=int,
+                            help='the RabbitMQ AMQP port (when using the amqp transport)')
+        parser.add_argument('--prefetch_count',
+                            type=int,
+                            help='the AMQP prefetch window (when using the amqp transport)')
         parser.add_argument('--simulate',
                             action='store_true',
                             help='simulates all execution')
@@ -56,16 +74,65 @@ class CommandLineArguments(object):
                             type=int,
                             help='the maximum number of threads to use')
 
+        parser.add_argument('--publish_window',
+                            type=int,
+                            help='the number of requests to have in flight at the same time to begin with')
+        parser.add_argument('--window_floor',
+                            type=int,
+                            help='the fewest requests the window can shrink to when the broker is struggling')
+        parser.add_argument('--window_ceiling',
+                            type=int,
+                            help='the most requests the window can grow to while the broker keeps up')
+        parser.add_argument('--preserve_order',
+                            action='store_true',
+                            help='keeps the order of the messages published to each destination')
+
+        parser.add_argument('--compression_dictionary',
+                            help='the trained zstd dictionary used to write and read compressed message files '
+                                 '(snag trains one if the file does not exist)')
+        parser.add_argument('--stats_json',
+                            '--stats-json',
+                            dest='stats_json',
+                            help='writes the timings and counters of each stage of the run to a JSON file')
+        parser.add_argument('--max_retries',
+                            type=int,
+                            help='the number of times to try a failed request again')
+        parser.add_argument('--retry_backoff',
+                            type=float,
+                            help='the seconds to back off (at most) before the first retry, doubling for each retry')
+        parser.add_argument('--error_budget',
+                            type=int,
+                            help='the number of messages that can fail before the run is stopped')
+        parser.add_argument('--dead_letter_file',
+                            help='the file to save the messages that could not be published in')
+        parser.add_argument('--resume',
+                            action='store_true',
+                            help='finishes an interrupted queue or replay run, skipping the messages it published')
+        parser.add_argument('--journal_folder',
+                            help='the folder queue and replay runs record the messages they publish in')
+        parser.add_argument('--dedup_capacity',
+                            type=int,
+                            help='the number of unique messages --deduplicate is sized for')
+        parser.add_argument('--split_size',
+                            type=int,
+                            help='the size (in MB) of the ranges a big ndjson file is split into to queue them at the '
+                                 'same time (0 to never split)')
+
         subparsers = parser.add_subparsers(help='commands', dest='command')
 
         # Snag command
         snag_parser = subparsers.add_parser('snag',
                                             help='Saves a copy of messages in a queue as a JSON file')
 
-        snag_parser.add_argument('-q',
-                                 '--message_source_queue',
-                                 required=True,
-                                 help='The name of the RabbitMQ source queue to get the messages from')
+        snag_queue_group = snag_parser.add_mutually_exclusive_group(required=True)
+        snag_queue_group.add_argument('-q',
+                                      '--message_source_queue',
+                                      help='The name of the RabbitMQ source queue to get the messages from')
+        snag_queue_group.add_argument('--queue_pattern',
+                                      help='snags every queue with messages whose name matches a glob pattern '
+                                           '(like *.error)')
+        snag_queue_group.add_argument('--queue_regex',
+                                      help='snags every queue with messages whose name matches a regular expression')
         snag_parser.add_argument('-m',
                                  '--message_count',
                                  required=True,
@@ -73,15 +140,55 @@ class CommandLineArguments(object):
         snag_parser.add_argument('-a',
                                  '--save_file',
                                  required=True,
-                                 help='the file to save the JSON message to - PREVENTS RE-QUEUEING')
+                                 help='the file to save the JSON message to - PREVENTS RE-QUEUEING (with a queue '
+                                      'pattern, a folder to save a file per queue in or a file name containing '
+                                      '{queue})')
+        snag_parser.add_argument('--archive_format',
+                                 choices=['json', 'ndjson'],
+                                 help='the format of the save file (a JSON array or newline-delimited JSON)')
+        snag_parser.add_argument('--compression',
+                                 choices=['none', 'gzip', 'zstd'],
+                                 help='compresses the save file (zstd requires the zstandard package)')
+        snag_parser.add_argument('--index',
+                                 action='store_true',
+                                 help='writes an index next to the save file so queue can pick out messages by '
+                                      'number or ID (uncompressed ndjson only)')
+        snag_parser.add_argument('--drain',
+                                 action='store_true',
+                                 help='removes the messages from the queue a chunk at a time, saving each chunk '
+                                      'before getting the next one')
+        snag_parser.add_argument('--append',
+                                 action='store_true',
+                                 help='adds the drained messages to a save file that already has messages in it '
+                                      '(instead of refusing to use it)')
+        snag_parser.add_argument('--chunk_size',
+                                 type=int,
+                                 help='the number of messages to get at a time when draining')
+        snag_parser.add_argument('--where',
+                                 action='append',
+                                 type=where_condition,
+                                 help=WHERE_HELP)
 
         # Replay command
         replay_parser = subparsers.add_parser('replay', help='Returns messages to their source queue')
 
-        replay_parser.add_argument('-q',
-                                   '--message_source_queue',
-                                   required=True,
-                                   help='The name of the RabbitMQ source queue to get the messages from')
+        replay_queue_group = replay_parser.add_mutually_exclusive_group(required=True)
+        replay_queue_group.add_argument('-q',
+                                        '--message_source_queue',
+                                        help='The name of the RabbitMQ source queue to get the messages from')
+        replay_queue_group.add_argument('--queue_pattern',
+                                        help='replays every queue with messages whose name matches a glob pattern '
+                                             '(like *.error)')
+        replay_queue_group.add_argument('--queue_regex',
+                                        help='replays every queue with messages whose name matches a regular '
+                                             'expression')
+        replay_parser.add_argument('--where',
+                                   action='append',
+                                   type=where_condition,
+                                   help=WHERE_HELP)
+        replay_parser.add_argument('--deduplicate',
+                                   action='store_true',
+                                   help=DEDUPLICATE_HELP)
         replay_parser.add_argument('-m',
                                    '--message_count',
                                    required=True,
@@ -99,6 +206,34 @@ class CommandLineArguments(object):
                                   '--message_source_file',
                                   required=True,
                                   help='the message source file or folder')
+        queue_parser.add_argument('--from',
+                                  dest='first_message',
+                                  type=int,
+                                  help='the number of the first message in the file to send, counting from 1 '
+                                       '(needs an indexed file)')
+        queue_parser.add_argument('--to',
+                                  dest='last_message',
+                                  type=int,
+                                  help='the number of the last message in the file to send (needs an indexed file)')
+        queue_parser.add_argument('--ids',
+                                  dest='message_ids',
+                                  nargs='+',
+                                  help='the IDs of the messages in the file to send (needs an indexed file)')
+        queue_parser.add_argument('--deduplicate',
+                                  action='store_true',
+                                  help=DEDUPLICATE_HELP)
+        queue_parser.add_argument('--include',
+                                  dest='include_files',
+                                  action='append',
+                                  help='the files to send from a folder, as a glob pattern (repeat for more patterns, '
+                                       'defaults to json and ndjson files)')
+        queue_parser.add_argument('--exclude',
+                                  dest='exclude_files',
+                                  action='append',
+                                  help='the files (or folders) in a folder to leave out, as a glob pattern')
+        queue_parser.add_argument('--recursive',
+                                  action='store_true',
+                                  help='sends the files in the folders in the folder too')
 
         # Shuttle command
         shuttle_parser = subparsers.add_parser('shuttle',
@@ -116,6 +251,16 @@ class CommandLineArguments(object):
                                     '--rabbit_destination_queue',
                                     required=True,
                                     help='The name of the RabbitMQ destination queue')
+        shuttle_parser.add_argument('--chunk_size',
+                                    type=int,
+                                    help='the number of messages to get at a time')
+        shuttle_parser.add_argument('--buffer_chunks',
+                                    type=int,
+                                    help='the number of chunks that can wait to be published')
+        shuttle_parser.add_argument('--where',
+                                    action='append',
+                                    type=where_condition,
+                                    help=WHERE_HELP)
 
         # Parse the arguments
         # argparse does a sys.exit when the user does something like ask for help (-h) and since we don't consider
@@ -125,3 +270,18 @@ class CommandLineArguments(object):
         # except SystemExit:
         #     return None
         return parser.parse_args()
+
+
+def where_condition(expression):
+    """Checks a --where condition while the arguments are parsed (so a typo fails before anything happens).
+
+    :param expression: The condition.
+    :return: The condition.
+    """
+
+    try:
+        compile_predicate(expression)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err))
+
+    return expression
@@ -1,8 +1,17 @@
 import base64
 import ConfigParser
 import os
+import re
+import threading
+import time
 
 from RabbitHole import __program_name__
+from RabbitHole.dead_letters import DeadLetterFile
+from RabbitHole.deduplicator import MessageDeduplicator
+from RabbitHole.message_file_discovery import DEFAULT_EXCLUDE_FILES
+from RabbitHole.message_file_discovery import DEFAULT_INCLUDE_FILES
+from RabbitHole.message_filter import MessageFilter
+from RabbitHole.run_statistics import RunStatistics
 
 
 class Configuration(object):
@@ -13,6 +22,9 @@ class Configuration(object):
         self._logger = logger
         self._command_line_arguments = command_line_arguments
 
+        # The objects a run shares are first asked for on worker threads, so only one of each is ever created
+        self._shared_objects_lock = threading.Lock()
+
         self._rabbit_host_url = None
         self._rabbit_host_port = None
         self._rabbit_username = None
@@ -25,6 +37,36 @@ class Configuration(object):
         self._silent = None
         self._debug = None
         self._max_threads = None
+        self._transport = None
+        self._rabbit_amqp_port = None
+        self._prefetch_count = None
+        self._chunk_size = None
+        self._archive_format = None
+        self._publish_window = None
+        self._window_floor = None
+        self._window_ceiling = None
+        self._preserve_order = None
+        self._buffer_chunks = None
+        self._stats_json = None
+        self._compression = None
+        self._compression_dictionary = None
+        self._index_archive = None
+        self._journal_folder = None
+        self._resume = None
+        self._max_retries = None
+        self._retry_backoff = None
+        self._error_budget = None
+        self._dead_letter_file = None
+        self._dead_letters = None
+        self._message_filter = None
+        self._deduplicate = None
+        self._dedup_capacity = None
+        self._split_size = None
+        self._deduplicator = None
+        self._include_files = None
+        self._exclude_files = None
+        self._recursive = None
+        self._statistics = None
 
         self._config_file = None
         self._ignore_config_file = True
@@ -352,3 +394,636 @@ class Configuration(object):
     @max_threads.setter
     def max_threads(self, value):
         self._max_threads = value
+
+    @property
+    def transport(self):
+        if self._transport is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('RabbitMQ', 'Transport'):
+                    config_file_value = self._config_file.get('RabbitMQ', 'Transport')
+
+            if hasattr(self.command_line_arguments, 'transport') and self.command_line_arguments.transport is not None:
+                self.transport = self.command_line_arguments.transport
+            elif config_file_value is not None:
+                self.transport = config_file_value.strip().lower()
+            else:
+                self.transport = 'http'
+
+        return self._transport
+
+    @transport.setter
+    def transport(self, value):
+        self._transport = value
+
+    @property
+    def rabbit_amqp_port(self):
+        if self._rabbit_amqp_port is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('RabbitMQ', 'AmqpPort'):
+                    config_file_value = self._config_file.getint('RabbitMQ', 'AmqpPort')
+
+            if hasattr(self.command_line_arguments,
+                       'rabbit_amqp_port') and self.command_line_arguments.rabbit_amqp_port is not None:
+                self.rabbit_amqp_port = self.command_line_arguments.rabbit_amqp_port
+            elif config_file_value is not None:
+                self.rabbit_amqp_port = config_file_value
+            else:
+                self.rabbit_amqp_port = 5672
+
+        return self._rabbit_amqp_port
+
+    @rabbit_amqp_port.setter
+    def rabbit_amqp_port(self, value):
+        self._rabbit_amqp_port = value
+
+    @property
+    def prefetch_count(self):
+        if self._prefetch_count is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('RabbitMQ', 'PrefetchCount'):
+                    config_file_value = self._config_file.getint('RabbitMQ', 'PrefetchCount')
+
+            if hasattr(self.command_line_arguments,
+                       'prefetch_count') and self.command_line_arguments.prefetch_count is not None:
+                self.prefetch_count = self.command_line_arguments.prefetch_count
+            elif config_file_value is not None:
+                self.prefetch_count = config_file_value
+            else:
+                self.prefetch_count = 100
+
+        return self._prefetch_count
+
+    @prefetch_count.setter
+    def prefetch_count(self, value):
+        self._prefetch_count = value
+
+    @property
+    def chunk_size(self):
+        if self._chunk_size is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('General', 'ChunkSize'):
+                    config_file_value = self._config_file.getint('General', 'ChunkSize')
+
+            if hasattr(self.command_line_arguments, 'chunk_size') and self.command_line_arguments.chunk_size is not None:
+                self.chunk_size = self.command_line_arguments.chunk_size
+            elif config_file_value is not None:
+                self.chunk_size = config_file_value
+            else:
+                self.chunk_size = 1000
+
+        return self._chunk_size
+
+    @chunk_size.setter
+    def chunk_size(self, value):
+        self._chunk_size = value
+
+    @property
+    def archive_format(self):
+        if self._archive_format is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('Messages', 'ArchiveFormat'):
+                    config_file_value = self._config_file.get('Messages', 'ArchiveFormat')
+
+            if hasattr(self.command_line_arguments,
+                       'archive_format') and self.command_line_arguments.archive_format is not None:
+                self.archive_format = self.command_line_arguments.archive_format
+            elif config_file_value is not None:
+                self.archive_format = config_file_value.strip().lower()
+            else:
+                self.archive_format = 'json'
+
+        return self._archive_format
+
+    @archive_format.setter
+    def archive_format(self, value):
+        self._archive_format = value
+
+    @property
+    def compression(self):
+        if self._compression is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('Messages', 'Compression'):
+                    config_file_value = self._config_file.get('Messages', 'Compression')
+
+            if hasattr(self.command_line_arguments,
+                       'compression') and self.command_line_arguments.compression is not None:
+                self.compression = self.command_line_arguments.compression
+            elif config_file_value is not None:
+                self.compression = config_file_value.strip().lower()
+            else:
+                self.compression = 'none'
+
+        return self._compression
+
+    @compression.setter
+    def compression(self, value):
+        self._compression = value
+
+    @property
+    def compression_dictionary(self):
+        if self._compression_dictionary is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('Messages', 'CompressionDictionary'):
+                    config_file_value = self._config_file.get('Messages', 'CompressionDictionary')
+
+            if hasattr(self.command_line_arguments,
+                       'compression_dictionary') and self.command_line_arguments.compression_dictionary is not None:
+                self.compression_dictionary = self.command_line_arguments.compression_dictionary
+            elif config_file_value:
+                self.compression_dictionary = config_file_value.strip()
+
+        return self._compression_dictionary
+
+    @compression_dictionary.setter
+    def compression_dictionary(self, value):
+        self._compression_dictionary = value
+
+    @property
+    def index_archive(self):
+        if self._index_archive is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('Messages', 'Index'):
+                    config_file_value = self._config_file.getboolean('Messages', 'Index')
+
+            if hasattr(self.command_line_arguments,
+                       'index') and self.command_line_arguments.index:
+                self.index_archive = self.command_line_arguments.index
+            elif config_file_value is not None:
+                self.index_archive = config_file_value
+            else:
+                self.index_archive = False
+
+        return self._index_archive
+
+    @index_archive.setter
+    def index_archive(self, value):
+        self._index_archive = value
+
+    @property
+    def include_files(self):
+        if self._include_files is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('Messages', 'IncludeFiles'):
+                    config_file_value = self._config_file.get('Messages', 'IncludeFiles')
+
+            if hasattr(self.command_line_arguments,
+                       'include_files') and self.command_line_arguments.include_files is not None:
+                self.include_files = self.command_line_arguments.include_files
+            elif config_file_value is not None:
+                self.include_files = [pattern.strip() for pattern in config_file_value.split(',') if pattern.strip()]
+            else:
+                self.include_files = DEFAULT_INCLUDE_FILES
+
+        return self._include_files
+
+    @include_files.setter
+    def include_files(self, value):
+        self._include_files = value
+
+    @property
+    def exclude_files(self):
+        if self._exclude_files is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('Messages', 'ExcludeFiles'):
+                    config_file_value = self._config_file.get('Messages', 'ExcludeFiles')
+
+            if hasattr(self.command_line_arguments,
+                       'exclude_files') and self.command_line_arguments.exclude_files is not None:
+                self.exclude_files = self.command_line_arguments.exclude_files
+            elif config_file_value is not None:
+                self.exclude_files = [pattern.strip() for pattern in config_file_value.split(',') if pattern.strip()]
+            else:
+                self.exclude_files = DEFAULT_EXCLUDE_FILES
+
+        return self._exclude_files
+
+    @exclude_files.setter
+    def exclude_files(self, value):
+        self._exclude_files = value
+
+    @property
+    def recursive(self):
+        if self._recursive is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('Messages', 'Recursive'):
+                    config_file_value = self._config_file.getboolean('Messages', 'Recursive')
+
+            if hasattr(self.command_line_arguments,
+                       'recursive') and self.command_line_arguments.recursive:
+                self.recursive = self.command_line_arguments.recursive
+            elif config_file_value is not None:
+                self.recursive = config_file_value
+            else:
+                self.recursive = False
+
+        return self._recursive
+
+    @recursive.setter
+    def recursive(self, value):
+        self._recursive = value
+
+    @property
+    def publish_window(self):
+        if self._publish_window is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('General', 'PublishWindow'):
+                    config_file_value = self._config_file.getint('General', 'PublishWindow')
+
+            if hasattr(self.command_line_arguments,
+                       'publish_window') and self.command_line_arguments.publish_window is not None:
+                self.publish_window = self.command_line_arguments.publish_window
+            elif config_file_value is not None:
+                self.publish_window = config_file_value
+            else:
+                self.publish_window = 10
+
+        return self._publish_window
+
+    @publish_window.setter
+    def publish_window(self, value):
+        self._publish_window = value
+
+    @property
+    def window_floor(self):
+        if self._window_floor is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('General', 'WindowFloor'):
+                    config_file_value = self._config_file.getint('General', 'WindowFloor')
+
+            if hasattr(self.command_line_arguments,
+                       'window_floor') and self.command_line_arguments.window_floor is not None:
+                self.window_floor = self.command_line_arguments.window_floor
+            elif config_file_value is not None:
+                self.window_floor = config_file_value
+            else:
+                self.window_floor = 2
+
+        return self._window_floor
+
+    @window_floor.setter
+    def window_floor(self, value):
+        self._window_floor = value
+
+    @property
+    def window_ceiling(self):
+        if self._window_ceiling is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('General', 'WindowCeiling'):
+                    config_file_value = self._config_file.getint('General', 'WindowCeiling')
+
+            if hasattr(self.command_line_arguments,
+                       'window_ceiling') and self.command_line_arguments.window_ceiling is not None:
+                self.window_ceiling = self.command_line_arguments.window_ceiling
+            elif config_file_value is not None:
+                self.window_ceiling = config_file_value
+            else:
+                self.window_ceiling = 32
+
+        return self._window_ceiling
+
+    @window_ceiling.setter
+    def window_ceiling(self, value):
+        self._window_ceiling = value
+
+    @property
+    def preserve_order(self):
+        if self._preserve_order is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('General', 'PreserveOrder'):
+                    config_file_value = self._config_file.getboolean('General', 'PreserveOrder')
+
+            if hasattr(self.command_line_arguments,
+                       'preserve_order') and self.command_line_arguments.preserve_order:
+                self.preserve_order = self.command_line_arguments.preserve_order
+            elif config_file_value is not None:
+                self.preserve_order = config_file_value
+            else:
+                self.preserve_order = False
+
+        return self._preserve_order
+
+    @preserve_order.setter
+    def preserve_order(self, value):
+        self._preserve_order = value
+
+    @property
+    def buffer_chunks(self):
+        if self._buffer_chunks is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('General', 'BufferChunks'):
+                    config_file_value = self._config_file.getint('General', 'BufferChunks')
+
+            if hasattr(self.command_line_arguments,
+                       'buffer_chunks') and self.command_line_arguments.buffer_chunks is not None:
+                self.buffer_chunks = self.command_line_arguments.buffer_chunks
+            elif config_file_value is not None:
+                self.buffer_chunks = config_file_value
+            else:
+                self.buffer_chunks = 4
+
+        return self._buffer_chunks
+
+    @buffer_chunks.setter
+    def buffer_chunks(self, value):
+        self._buffer_chunks = value
+
+    @property
+    def stats_json(self):
+        if self._stats_json is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('General', 'StatsJson'):
+                    config_file_value = self._config_file.get('General', 'StatsJson')
+
+            if hasattr(self.command_line_arguments,
+                       'stats_json') and self.command_line_arguments.stats_json is not None:
+                self.stats_json = self.command_line_arguments.stats_json
+            elif config_file_value:
+                self.stats_json = config_file_value
+
+        return self._stats_json
+
+    @stats_json.setter
+    def stats_json(self, value):
+        self._stats_json = value
+
+    @property
+    def journal_folder(self):
+        if self._journal_folder is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('General', 'JournalFolder'):
+                    config_file_value = self._config_file.get('General', 'JournalFolder')
+
+            if hasattr(self.command_line_arguments,
+                       'journal_folder') and self.command_line_arguments.journal_folder is not None:
+                self.journal_folder = self.command_line_arguments.journal_folder
+            elif config_file_value:
+                self.journal_folder = config_file_value.strip()
+            else:
+                self.journal_folder = os.curdir
+
+        return self._journal_folder
+
+    @journal_folder.setter
+    def journal_folder(self, value):
+        self._journal_folder = value
+
+    @property
+    def resume(self):
+        if self._resume is None:
+            # Resuming is a decision about one run so it's never in the config file
+            self.resume = bool(getattr(self.command_line_arguments, 'resume', False))
+
+        return self._resume
+
+    @resume.setter
+    def resume(self, value):
+        self._resume = value
+
+    @property
+    def max_retries(self):
+        if self._max_retries is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('General', 'MaxRetries'):
+                    config_file_value = self._config_file.getint('General', 'MaxRetries')
+
+            if hasattr(self.command_line_arguments,
+                       'max_retries') and self.command_line_arguments.max_retries is not None:
+                self.max_retries = self.command_line_arguments.max_retries
+            elif config_file_value is not None:
+                self.max_retries = config_file_value
+            else:
+                self.max_retries = 5
+
+        return self._max_retries
+
+    @max_retries.setter
+    def max_retries(self, value):
+        self._max_retries = value
+
+    @property
+    def retry_backoff(self):
+        if self._retry_backoff is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('General', 'RetryBackoff'):
+                    config_file_value = self._config_file.getfloat('General', 'RetryBackoff')
+
+            if hasattr(self.command_line_arguments,
+                       'retry_backoff') and self.command_line_arguments.retry_backoff is not None:
+                self.retry_backoff = self.command_line_arguments.retry_backoff
+            elif config_file_value is not None:
+                self.retry_backoff = config_file_value
+            else:
+                self.retry_backoff = 0.2
+
+        return self._retry_backoff
+
+    @retry_backoff.setter
+    def retry_backoff(self, value):
+        self._retry_backoff = value
+
+    @property
+    def error_budget(self):
+        if self._error_budget is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('General', 'ErrorBudget'):
+                    config_file_value = self._config_file.getint('General', 'ErrorBudget')
+
+            if hasattr(self.command_line_arguments,
+                       'error_budget') and self.command_line_arguments.error_budget is not None:
+                self.error_budget = self.command_line_arguments.error_budget
+            elif config_file_value is not None:
+                self.error_budget = config_file_value
+            else:
+                self.error_budget = 100
+
+        return self._error_budget
+
+    @error_budget.setter
+    def error_budget(self, value):
+        self._error_budget = value
+
+    @property
+    def dead_letter_file(self):
+        if self._dead_letter_file is None:
+
+            if hasattr(self.command_line_arguments,
+                       'dead_letter_file') and self.command_line_arguments.dead_letter_file is not None:
+                self.dead_letter_file = self.command_line_arguments.dead_letter_file
+            else:
+                # Named after the run (like queue-FooQueue.20190102-030405.dead-letters.ndjson), so it only ever holds
+                # the failures of this run
+                command = getattr(self.command_line_arguments, 'command', None) or __program_name__
+                queue = getattr(self.command_line_arguments, 'rabbit_destination_queue', None) or \
+                    getattr(self.command_line_arguments, 'message_source_queue', None) or \
+                    getattr(self.command_line_arguments, 'queue_pattern', None) or \
+                    getattr(self.command_line_arguments, 'queue_regex', None) or 'messages'
+                run_name = '{0}-{1}.{2}'.format(command, queue, time.strftime('%Y%m%d-%H%M%S'))
+                self.dead_letter_file = re.sub(r'[^\w.-]', '_', run_name) + '.dead-letters.ndjson'
+
+        return self._dead_letter_file
+
+    @dead_letter_file.setter
+    def dead_letter_file(self, value):
+        self._dead_letter_file = value
+
+    @property
+    def dead_letters(self):
+        """Gets the file every message that couldn't be published in the run is set aside in.
+        """
+        if self._dead_letters is None:
+            with self._shared_objects_lock:
+                if self._dead_letters is None:
+                    # A resumed run carries on with the failures of the run it's finishing
+                    self.dead_letters = DeadLetterFile(self.dead_letter_file, append=self.resume)
+
+        return self._dead_letters
+
+    @dead_letters.setter
+    def dead_letters(self, value):
+        self._dead_letters = value
+
+    @property
+    def deduplicate(self):
+        if self._deduplicate is None:
+            # Deduplicating is a decision about one run so it's never in the config file
+            self.deduplicate = bool(getattr(self.command_line_arguments, 'deduplicate', False))
+
+        return self._deduplicate
+
+    @deduplicate.setter
+    def deduplicate(self, value):
+        self._deduplicate = value
+
+    @property
+    def dedup_capacity(self):
+        if self._dedup_capacity is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('General', 'DedupCapacity'):
+                    config_file_value = self._config_file.getint('General', 'DedupCapacity')
+
+            if hasattr(self.command_line_arguments,
+                       'dedup_capacity') and self.command_line_arguments.dedup_capacity is not None:
+                self.dedup_capacity = self.command_line_arguments.dedup_capacity
+            elif config_file_value is not None:
+                self.dedup_capacity = config_file_value
+            else:
+                self.dedup_capacity = 5000000
+
+        return self._dedup_capacity
+
+    @dedup_capacity.setter
+    def dedup_capacity(self, value):
+        self._dedup_capacity = value
+
+    @property
+    def split_size(self):
+        """Gets the size (in MB) of the ranges a big message file is split into so they can be queued at the same time.
+        """
+        if self._split_size is None:
+
+            config_file_value = None
+            if self._ignore_config_file is False:
+                if self._config_file.has_option('General', 'SplitSize'):
+                    config_file_value = self._config_file.getint('General', 'SplitSize')
+
+            if hasattr(self.command_line_arguments,
+                       'split_size') and self.command_line_arguments.split_size is not None:
+                self.split_size = self.command_line_arguments.split_size
+            elif config_file_value is not None:
+                self.split_size = config_file_value
+            else:
+                self.split_size = 32
+
+        return self._split_size
+
+    @split_size.setter
+    def split_size(self, value):
+        self._split_size = value
+
+    @property
+    def deduplicator(self):
+        """Gets the record of the messages published in the run by content (or None if messages aren't deduplicated).
+        """
+        if self._deduplicator is None and self.deduplicate:
+            with self._shared_objects_lock:
+                if self._deduplicator is None:
+                    self.deduplicator = MessageDeduplicator(self.dedup_capacity)
+
+        return self._deduplicator
+
+    @deduplicator.setter
+    def deduplicator(self, value):
+        self._deduplicator = value
+
+    @property
+    def message_filter(self):
+        """Gets the compiled --where conditions (or None if every message is wanted).
+        """
+        if self._message_filter is None:
+            # Conditions are a decision about one run so they're never in the config file
+            where = getattr(self.command_line_arguments, 'where', None)
+            if where:
+                self.message_filter = MessageFilter(where)
+
+        return self._message_filter
+
+    @message_filter.setter
+    def message_filter(self, value):
+        self._message_filter = value
+
+    @property
+    def statistics(self):
+        """Gets the statistics shared by everything in the run (only recorded when there's a stats file to write).
+        """
+        if self._statistics is None:
+            self.statistics = RunStatistics(enabled=self.stats_json is not None)
+
+        return self._statistics
+
+    @statistics.setter
+    def statistics(self, value):
+        self._statistics = value
@@ -1,12 +1,31 @@
 from __future__ import print_function
 
+import sys
+
 
 class Console(object):
     """This class represents the console.
     """
 
-    def __init__(self, configuration):
+    # Every console writes to the same terminal, so they all need to know when a progress line is waiting to be ended
+    _progress_line_open = False
+
+    def __init__(self, configuration, quiet=False):
         self._configuration = configuration
+        self._quiet = quiet
+
+    @property
+    def quiet(self):
+        """Gets whether updates are being kept off the console (errors and hints are still written).
+        """
+        return self._quiet
+
+    def get_quiet_console(self):
+        """Gets a console that only writes errors and hints (for work that's too busy to report every step).
+
+        :return: A quiet console.
+        """
+        return Console(self._configuration, quiet=True)
 
     # Foreground    Code    Style       Code    Background  Code
     # ----------------------------------------------------------
@@ -31,6 +50,7 @@ class Console(object):
 
             if self._configuration.verbose:
                 self.write_keyvaluepair('  Config File', self._configuration.using_config_file)
+                self.write_keyvaluepair('    Transport', self._configuration.transport)
                 self.write_keyvaluepair('     Host URL', self._configuration.rabbit_host_url)
                 self.write_keyvaluepair('         Port', self._configuration.rabbit_host_port)
                 self.write_keyvaluepair('        VHost', self._configuration.rabbit_vhost)
@@ -40,14 +60,14 @@ class Console(object):
                 self.write_divider()
 
             if self._configuration.simulate:
-                print('Output in \033[0;35;40mthis color\033[0m indicates a simulated step!')
+                self._print('Output in \033[0;35;40mthis color\033[0m indicates a simulated step!')
                 self.write_divider()
 
     def write_divider(self):
         """Writes a divider line to the console.
         """
         if not self._configuration.silent:
-            print('-' * 80)
+            self._print('-' * 80)
 
     def write_error(self, message):
         """Writes an error message to the console.
@@ -55,7 +75,7 @@ class Console(object):
         :param message: The message to write.
         """
         if not self._configuration.silent:
-            print('\033[1;31;40m+ ERROR: \033[0m{0}'.format(message))
+            self._print('\033[1;31;40m+ ERROR: \033[0m{0}'.format(message))
 
     def write_hint(self, message):
         """Writes a hint message to the console.
@@ -63,7 +83,7 @@ class Console(object):
         :param message: The message to write.
         """
         if not self._configuration.silent:
-            print('\033[1;36;40m+ HINT: \033[0m{0}'.format(message))
+            self._print('\033[1;36;40m+ HINT: \033[0m{0}'.format(message))
 
     def write_keyvaluepair(self, key, value):
         """Writes a key and a value pair message to the console.
@@ -72,15 +92,31 @@ class Console(object):
         :param value: The value.
         """
         if not self._configuration.silent:
-            print('\033[0;36;40m{0}:\033[0m \033[0;37;40m{1}\033[0m'.format(key, value))
+            self._print('\033[0;36;40m{0}:\033[0m \033[0;37;40m{1}\033[0m'.format(key, value))
+
+    def write_progress(self, message, final=False, simulated=False):
+        """Writes a progress message to the console (over the last one when the console is a terminal).
+
+        :param message: The message to write.
+        :param final: If True, this is the last progress message (so the next write starts a new line).
+        :param simulated: If True, the progress is for a simulated step.
+        """
+        if not self._configuration.silent and not self._quiet:
+            progress = '\033[0;32;40m+ {0}{1}\033[0m'.format('\033[0;35;40m' if simulated else '\033[0m', message)
+            if sys.stdout.isatty():
+                sys.stdout.write('\r' + progress + '\033[K' + ('\n' if final else ''))
+                sys.stdout.flush()
+                Console._progress_line_open = not final
+            else:
+                self._print(progress)
 
     def write_simulated_update(self, message):
         """Writes an update message to the console when simulating something.
 
         :param message: The message to write.
         """
-        if not self._configuration.silent:
-            print('\033[0;32;40m+ \033[0;35;40m{0}\033[0m'.format(message))
+        if not self._configuration.silent and not self._quiet:
+            self._print('\033[0;32;40m+ \033[0;35;40m{0}\033[0m'.format(message))
 
     def write_title(self, program_name, program_version):
         """Writes the program title to the console.
@@ -89,7 +125,7 @@ class Console(object):
         :param program_version: The version of the program.
         """
         if not self._configuration.silent:
-            print('\033[0;33;40m{0} v{1}\033[0m'.format(program_name, program_version))
+            self._print('\033[0;33;40m{0} v{1}\033[0m'.format(program_name, program_version))
             self.write_divider()
 
     def write_update(self, message):
@@ -97,5 +133,13 @@ class Console(object):
 
         :param message: The message to write.
         """
-        if not self._configuration.silent:
-            print('\033[0;32;40m+ \033[0m{0}'.format(message))
+        if not self._configuration.silent and not self._quiet:
+            self._print('\033[0;32;40m+ \033[0m{0}'.format(message))
+
+    @staticmethod
+    def _print(message):
+        if Console._progress_line_open:
+            # Don't write over the progress line
+            Console._progress_line_open = False
+            sys.stdout.write('\n')
+        print(message)
@@ -0,0 +1,48 @@
+import threading
+
+from RabbitHole.message_archive import MessageArchiveWriter
+
+
+class DeadLetterFile(object):
+    """This class represents the file the messages that couldn't be published are set aside in.
+
+    The file is newline-delimited JSON (so the queue command can publish it later) and is only created if a message
+    fails. Every RabbitMQ instance in a run shares it, so it also counts the failures of the whole run. Unless it's
+    added to, a file left over from another run is started again rather than mixed in with.
+    """
+
+    def __init__(self, file_name, append=False):
+        self._file_name = file_name
+        self._append = append
+        self._lock = threading.Lock()
+        self._archive = None
+        self._count = 0
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    @property
+    def count(self):
+        return self._count
+
+    def add(self, message):
+        """Sets a message aside (and makes sure it's on the disk before returning).
+
+        :param message: The message.
+        :return: The number of messages that have been set aside in the run.
+        """
+
+        with self._lock:
+            if self._archive is None:
+                self._archive = MessageArchiveWriter(self._file_name, 'ndjson', append=self._append)
+            self._archive.write(message)
+            self._archive.flush(durable=True)
+            self._count += 1
+            return self._count
+
+    def close(self):
+        with self._lock:
+            if self._archive is not None:
+                self._archive.close()
+                self._archive = None
@@ -0,0 +1,137 @@
+import hashlib
+import math
+import struct
+import threading
+
+# The chance that a message is taken for a duplicate when it isn't (while the filter holds no more than its capacity)
+FALSE_POSITIVE_RATE = 1e-6
+
+
+class BloomFilter(object):
+    """This class represents a fixed-size set of digests that can say "probably seen" or "definitely not seen".
+
+    The filter is sized once for its capacity (about 3.6 MB per million digests at the false positive rate above) and
+    never grows, so memory stays bounded however many messages go through it. Each digest sets hash_count bits picked
+    with double hashing (two 64-bit halves of the digest) rather than hash_count separate hashes.
+    """
+
+    def __init__(self, capacity, false_positive_rate=FALSE_POSITIVE_RATE):
+        self._capacity = max(1, capacity)
+        self._bit_count = max(8, int(math.ceil(-self._capacity * math.log(false_positive_rate) / (math.log(2) ** 2))))
+        self._hash_count = max(1, int(round(float(self._bit_count) / self._capacity * math.log(2))))
+        self._bits = bytearray((self._bit_count + 7) // 8)
+        self._count = 0
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def count(self):
+        """The number of digests added (the false positive rate climbs once this is over the capacity).
+        """
+
+        return self._count
+
+    @property
+    def size(self):
+        """The size of the filter in bytes.
+        """
+
+        return len(self._bits)
+
+    def add(self, digest):
+        """Adds a digest.
+
+        :param digest: The digest (at least 16 bytes).
+        :return: True if the digest was probably added before.
+        """
+
+        first_hash, second_hash = struct.unpack_from('<QQ', digest)
+        bits = self._bits
+        bit_count = self._bit_count
+        seen = True
+
+        for i in xrange(self._hash_count):
+            position = (first_hash + i * second_hash) % bit_count
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                seen = False
+
+        if not seen:
+            self._count += 1
+
+        return seen
+
+
+class MessageDeduplicator(object):
+    """This class represents the messages a run has already published, by content.
+
+    Two messages are the same if they go to the same destination with the same routing key and the same payload, so
+    the copies a retry storm leaves in an error queue are published once however their headers differ. Only a digest
+    of each message is kept, in a BloomFilter, so a unique message is very occasionally taken for a duplicate.
+    """
+
+    def __init__(self, capacity):
+        self._bloom_filter = BloomFilter(capacity)
+        self._lock = threading.Lock()
+        self._suppressed_count = 0
+
+    @property
+    def capacity(self):
+        return self._bloom_filter.capacity
+
+    @property
+    def unique_count(self):
+        return self._bloom_filter.count
+
+    @property
+    def suppressed_count(self):
+        return self._suppressed_count
+
+    @property
+    def over_capacity(self):
+        """True if more messages went through than the filter was sized for (so more duplicates may be false).
+        """
+
+        return self._bloom_filter.count > self._bloom_filter.capacity
+
+    def is_duplicate(self, destination_queue, message):
+        """Checks whether a message has already been published in the run (and remembers it if it hasn't).
+
+        :param destination_queue: The queue the message is published to.
+        :param message: The (scrubbed) message.
+        :return: True if the same message has probably already been published.
+        """
+
+        digest = get_content_digest(destination_queue, message)
+
+        with self._lock:
+            if self._bloom_filter.add(digest):
+                self._suppressed_count += 1
+                return True
+            return False
+
+
+def get_content_digest(destination_queue, message):
+    """Gets the digest of what makes a message unique (its destination, routing key and payload).
+
+    :param destination_queue: The queue the message is published to.
+    :param message: The message.
+    :return: The digest (16 bytes).
+    """
+
+    content = hashlib.md5(_to_bytes(destination_queue))
+    for value in (message.get('routing_key'), message.get('payload_encoding') or 'string', message.get('payload')):
+        content.update('\0')
+        content.update(_to_bytes(value))
+    return content.digest()
+
+
+def _to_bytes(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
@@ -0,0 +1,127 @@
+import threading
+from timeit import default_timer as timer
+
+from RabbitHole.adaptive_limiter import AdaptiveLimiter
+from RabbitHole.adaptive_limiter import OVERLOAD_STATUS_CODES
+from RabbitHole.worker_pool import WorkerPool
+
+
+class TaskGroup(object):
+    """This class represents a set of tasks submitted to the engine that can be waited on together.
+    """
+
+    def __init__(self):
+        self._pending = 0
+        self._errors = []
+        self._condition = threading.Condition()
+
+    @property
+    def errors(self):
+        """Gets the unexpected errors raised by the tasks in the group.
+        """
+        with self._condition:
+            return list(self._errors)
+
+    def wrap(self, task):
+        """Wraps a task so the group knows when it's done.
+
+        :param task: The callable to wrap.
+        :return: The wrapped callable.
+        """
+
+        with self._condition:
+            self._pending += 1
+
+        def run(*args, **kwargs):
+            try:
+                task(*args, **kwargs)
+            except Exception as err:
+                with self._condition:
+                    self._errors.append(err)
+            finally:
+                with self._condition:
+                    self._pending -= 1
+                    if not self._pending:
+                        self._condition.notify_all()
+
+        return run
+
+    def wait(self):
+        """Waits for every task in the group to finish.
+        """
+
+        with self._condition:
+            while self._pending:
+                self._condition.wait(1)
+
+
+class ExecutionEngine(object):
+    """This class represents the engine every RabbitMQ request runs on.
+
+    There is one long-lived pool of publishers for the whole run (no matter how many threads are publishing) and every
+    request (get or publish) goes through one adaptive window, so the concurrency of a run is tuned to how the broker
+    is coping rather than set by the number of threads a command happens to start.
+    """
+
+    def __init__(self, request_window, ordered=False, limiter=None):
+        # Without a limiter the window stays the same size
+        self._limiter = limiter or AdaptiveLimiter(request_window, request_window, request_window)
+        self._ordered = ordered
+        self._publish_pool = None
+        self._publish_pool_lock = threading.Lock()
+
+    @property
+    def request_window(self):
+        return self._limiter.limit
+
+    @property
+    def publish_pool(self):
+        with self._publish_pool_lock:
+            if self._publish_pool is None:
+                # There's a publisher for the biggest the window can get
+                self._publish_pool = WorkerPool(self._limiter.ceiling, self._ordered, 'publisher')
+        return self._publish_pool
+
+    def submit_publish(self, group, task, *args, **kwargs):
+        """Submits a publish to the engine (blocking while every publisher is busy).
+
+        :param group: The task group the publish belongs to.
+        :param task: The callable that publishes.
+        :param args: The positional arguments for the task.
+        :param kwargs: The keyword arguments for the task (lane is the ordering key).
+        """
+
+        self.publish_pool.submit(group.wrap(task), *args, **kwargs)
+
+    def run_request(self, task, *args, **kwargs):
+        """Runs a request on the calling thread once there is room for it in the window.
+
+        The window is shared by every kind of request, but each kind (the name of the task) is measured against its own
+        latencies.
+
+        :param task: The callable that makes the request.
+        :param args: The positional arguments for the task.
+        :param kwargs: The keyword arguments for the task.
+        :return: The result of the task.
+        """
+
+        self._limiter.acquire()
+        start = timer()
+        overloaded = False
+
+        try:
+            return task(*args, **kwargs)
+        except Exception as err:
+            overloaded = getattr(err, 'status_code', None) in OVERLOAD_STATUS_CODES
+            raise
+        finally:
+            self._limiter.release(timer() - start, overloaded, getattr(task, '__name__', None))
+
+    def close(self):
+        """Waits for the publishers to finish and stops them.
+        """
+
+        with self._publish_pool_lock:
+            if self._publish_pool is not None:
+                self._publish_pool.join()
+                self._publish_pool = None
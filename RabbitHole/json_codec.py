@@ -0,0 +1,127 @@
+import functools
+import json
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# The JSON backends that can be used (the standard library is always there)
+BACKENDS = ('simplejson', 'ujson', 'json')
+
+COMPACT_SEPARATORS = (',', ':')
+INDENTED_SEPARATORS = (',', ': ')
+
+_INSTALLED_BACKENDS = {'simplejson': simplejson, 'ujson': ujson, 'json': json}
+
+_codec = None
+
+
+class JsonCodec(object):
+    """This class represents the JSON encoder and decoder used for every message.
+
+    Each job goes to the fastest of the allowed backends that are installed. Whatever the backend, the encoded bytes
+    are exactly what the standard library would produce (ujson formats floats its own way, so it only decodes).
+
+    - Compact encoding (publishing and ndjson archives): the standard library's C encoder
+    - Indented encoding (json archives): simplejson (the standard library only indents in pure Python)
+    - Decoding: simplejson, then ujson, then the standard library
+    """
+
+    def __init__(self, backends=BACKENDS):
+        installed = [backend for backend in backends if _INSTALLED_BACKENDS.get(backend) is not None]
+
+        if 'simplejson' in installed:
+            self._indenting_backend = 'simplejson'
+            self._dumps_indented = functools.partial(simplejson.dumps, indent=2, separators=INDENTED_SEPARATORS)
+            self._decoder = simplejson.JSONDecoder()
+        else:
+            self._indenting_backend = 'json'
+            self._dumps_indented = functools.partial(json.dumps, indent=2, separators=INDENTED_SEPARATORS)
+            self._decoder = json.JSONDecoder()
+
+        self._dumps_compact = functools.partial(json.dumps, separators=COMPACT_SEPARATORS)
+
+        self._decoding_backend = next((backend for backend in installed if backend != 'json'), 'json')
+        if self._decoding_backend == 'simplejson':
+            self._loads = simplejson.loads
+        elif self._decoding_backend == 'ujson':
+            self._loads = self._ujson_loads
+        else:
+            self._loads = json.loads
+
+    @property
+    def name(self):
+        return 'decode={0}, indent={1}, compact=json'.format(self._decoding_backend, self._indenting_backend)
+
+    def dumps(self, value, indent=False):
+        """Encodes a value as JSON.
+
+        :param value: The value to encode.
+        :param indent: If True, pretty-prints the JSON (otherwise it's as compact as possible).
+        :return: The JSON (as bytes, ready to be written or sent).
+        """
+
+        if indent:
+            return self._dumps_indented(value)
+        return self._dumps_compact(value)
+
+    def loads(self, data):
+        """Decodes JSON.
+
+        :param data: The JSON.
+        :return: The decoded value.
+        """
+
+        return self._loads(data)
+
+    def raw_decode(self, data, index=0):
+        """Decodes the JSON value that starts at an index (and ignores anything after it).
+
+        :param data: The JSON.
+        :param index: The index the value starts at.
+        :return: A (decoded value, index of the end of the value) tuple.
+        """
+
+        return self._decoder.raw_decode(data, index)
+
+    @staticmethod
+    def _ujson_loads(data):
+        try:
+            return ujson.loads(data, precise_float=True)
+        except (ValueError, OverflowError):
+            # ujson gives up on some valid JSON (like really big numbers) so let the standard library have a go
+            return json.loads(data)
+
+
+def get_codec():
+    """Gets the codec shared by every module (choosing the backends the first time).
+    """
+
+    global _codec
+    if _codec is None:
+        _codec = JsonCodec()
+    return _codec
+
+
+def set_codec(codec):
+    """Replaces the codec shared by every module.
+
+    :param codec: The codec.
+    """
+
+    global _codec
+    _codec = codec
+
+
+def dumps(value, indent=False):
+    return get_codec().dumps(value, indent)
+
+
+def loads(data):
+    return get_codec().loads(data)
@@ -0,0 +1,548 @@
+import gzip
+import os
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from RabbitHole import json_codec
+from RabbitHole.message_archive_index import MessageArchiveIndexWriter
+from RabbitHole.message_archive_index import get_index_end
+from RabbitHole.message_archive_index import get_index_file_name
+
+# json: a (pretty-printed) JSON array of messages
+# ndjson: newline-delimited JSON with one compact message per line
+ARCHIVE_FORMATS = ('json', 'ndjson')
+
+# none: plain text
+# gzip: gzip compressed
+# zstd: Zstandard compressed (requires the zstandard package), optionally with a trained dictionary
+COMPRESSIONS = ('none', 'gzip', 'zstd')
+
+# The usual file extension of each compression
+COMPRESSION_EXTENSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+# Compressed archives are recognised by the first bytes of the file (whatever the file is called)
+GZIP_MAGIC = '\x1f\x8b'
+ZSTD_MAGIC = '\x28\xb5\x2f\xfd'
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# The size of a trained compression dictionary
+DICTIONARY_SIZE = 112640
+
+READ_SIZE = 64 * 1024
+
+WHITESPACE = ' \t\r\n'
+
+# The errors a damaged compressed archive can raise
+_DECOMPRESSION_ERRORS = (zlib.error, EOFError) + ((zstandard.ZstdError,) if zstandard else ())
+
+_compression_dictionaries = {}
+_compression_dictionaries_lock = threading.Lock()
+
+
+class MessageArchiveWriter(object):
+    """This class represents a message archive that is being written one message at a time.
+
+    Uncompressed ndjson archives can also be indexed (see MessageArchiveIndexWriter) so parts of them can be read back
+    without reading the rest.
+    """
+
+    def __init__(self,
+                 file_name,
+                 archive_format='json',
+                 append=False,
+                 compression='none',
+                 compression_dictionary=None,
+                 index=False):
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError('{0} is not a supported archive format'.format(archive_format))
+
+        if compression not in COMPRESSIONS:
+            raise ValueError('{0} is not a supported compression'.format(compression))
+
+        if compression != 'none' and append and archive_format == 'json':
+            # Closing the array would mean rewriting the whole compressed file
+            raise ValueError('Compressed json archives can\'t be added to (use the ndjson format instead)')
+
+        if index and (archive_format != 'ndjson' or compression != 'none'):
+            # The messages have to be at fixed places in the file to be read straight from it
+            raise ValueError('Only uncompressed ndjson archives can be indexed')
+
+        self._file_name = file_name
+        self._archive_format = archive_format
+        self._compression = compression
+        self._message_count = 0
+        self._bytes_written = 0
+        self._array_has_messages = False
+        self._array_is_closed = False
+        self._raw_file = None
+        self._index = None
+
+        if compression != 'none':
+            # Adding to a compressed archive adds another gzip member (or zstd frame) to the end of the file
+            self._raw_file = open(file_name, 'ab' if append else 'wb')
+            self._file = _open_compressed_writer(self._raw_file, compression, compression_dictionary)
+            if archive_format == 'json':
+                self._file.write('[')
+        elif archive_format == 'ndjson':
+            self._file = open(file_name, 'ab' if append else 'wb')
+            if index:
+                self._file.seek(0, os.SEEK_END)
+                try:
+                    self._index = MessageArchiveIndexWriter(get_index_file_name(file_name), self._file.tell())
+                except (IOError, ValueError):
+                    self._file.close()
+                    raise
+        elif append and os.path.isfile(file_name):
+            self._file = open(file_name, 'r+b')
+            self._open_existing_array()
+        else:
+            self._file = open(file_name, 'w+b')
+            self._file.write('[')
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    @property
+    def message_count(self):
+        return self._message_count
+
+    @property
+    def bytes_written(self):
+        return self._bytes_written
+
+    def write(self, message):
+        """Writes a message to the archive.
+
+        :param message: The message to write.
+        """
+
+        if self._archive_format == 'ndjson':
+            data = json_codec.dumps(message)
+            self._file.write(data)
+            self._file.write('\n')
+            if self._index is not None:
+                self._index.add(message, len(data) + 1)
+        else:
+            if self._array_is_closed:
+                self._file.seek(-1, os.SEEK_CUR)
+                self._file.truncate()
+                self._array_is_closed = False
+            if self._array_has_messages:
+                self._file.write(',\n')
+            data = json_codec.dumps(message, indent=True)
+            self._file.write(data)
+            self._array_has_messages = True
+
+        self._message_count += 1
+        self._bytes_written += len(data)
+
+    def flush(self, durable=False):
+        """Flushes the archive, leaving a complete archive on the disk.
+
+        :param durable: If True, doesn't return until the operating system has written the file to the disk.
+        """
+
+        if self._archive_format == 'json' and not self._array_is_closed and self._raw_file is None:
+            self._file.write(']')
+            self._array_is_closed = True
+
+        if self._compression == 'zstd':
+            self._file.flush(zstandard.FLUSH_BLOCK)
+        else:
+            self._file.flush()
+
+        if self._raw_file is not None:
+            self._raw_file.flush()
+
+        if durable:
+            os.fsync((self._raw_file or self._file).fileno())
+
+        if self._index is not None:
+            # The index goes after the archive so it never points past the end of it
+            self._index.flush(durable)
+
+    def close(self):
+        """Flushes and closes the archive.
+        """
+
+        if self._raw_file is not None:
+            if not self._raw_file.closed:
+                if self._archive_format == 'json':
+                    self._file.write(']')
+                self._file.close()
+                self._raw_file.close()
+        elif not self._file.closed:
+            self.flush()
+            self._file.close()
+            if self._index is not None:
+                self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _open_existing_array(self):
+        """Positions the file so the next message is added to the end of the existing JSON array.
+        """
+
+        self._file.seek(0, os.SEEK_END)
+        position = self._file.tell()
+
+        while position > 0:
+            read_size = min(position, 4096)
+            position -= read_size
+            self._file.seek(position)
+            block = self._file.read(read_size).rstrip(WHITESPACE)
+            if block:
+                if not block.endswith(']'):
+                    raise IOError('{0} does not contain a JSON array!'.format(self._file_name))
+                self._file.seek(position + len(block))
+                self._array_is_closed = True
+                self._array_has_messages = not self._is_empty_array(position + len(block) - 1)
+                return
+
+        self._file.write('[')
+
+    def _is_empty_array(self, closing_bracket_position):
+        self._file.seek(0)
+        start = self._file.read(min(closing_bracket_position, 4096)).strip(WHITESPACE)
+        self._file.seek(closing_bracket_position + 1)
+        return start == '['
+
+
+class MessageArchiveReader(object):
+    """This class represents a message archive that is read back one message at a time.
+
+    Archives can be newline-delimited JSON, a JSON array or a single JSON message. Nothing is parsed until it is needed
+    so the memory used doesn't depend on the size of the archive.
+    """
+
+    def __init__(self, file_name, compression_dictionary=None):
+        self._file_name = file_name
+        self._compression_dictionary = compression_dictionary
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    def __iter__(self):
+        with open(self._file_name, 'rb') as archive_file:
+            compression = detect_compression(archive_file.read(len(ZSTD_MAGIC)))
+            archive_file.seek(0)
+
+            if compression == 'gzip':
+                stream = gzip.GzipFile(fileobj=archive_file, mode='rb')
+            elif compression == 'zstd':
+                if zstandard is None:
+                    raise IOError('{0} is zstd compressed (pip install zstandard to read it)'.format(self._file_name))
+                dictionary = load_compression_dictionary(self._compression_dictionary)
+                decompressor = zstandard.ZstdDecompressor(dict_data=dictionary) if dictionary else \
+                    zstandard.ZstdDecompressor()
+                stream = decompressor.stream_reader(archive_file, read_size=READ_SIZE, read_across_frames=True)
+            else:
+                stream = archive_file
+
+            try:
+                for message in self.iter_messages(stream):
+                    yield message
+            except _DECOMPRESSION_ERRORS as err:
+                raise IOError('{0} could not be decompressed ({1})'.format(self._file_name, err))
+
+    @staticmethod
+    def iter_messages(archive_file):
+        """Reads the messages from an archive stream.
+
+        :param archive_file: The (binary) archive stream.
+        :return: A generator of the messages in the archive.
+        """
+
+        codec = json_codec.get_codec()
+        buffer = ''
+        index = 0
+        in_array = None
+        end_of_file = False
+
+        while True:
+            # Skip the whitespace (and the array punctuation) between messages
+            while True:
+                buffer_length = len(buffer)
+                while index < buffer_length and (buffer[index] in WHITESPACE or (in_array and buffer[index] == ',')):
+                    index += 1
+                if index < buffer_length or end_of_file:
+                    break
+                buffer = archive_file.read(READ_SIZE)
+                index = 0
+                end_of_file = not buffer
+
+            if index >= len(buffer):
+                return
+
+            if in_array is None:
+                in_array = buffer[index] == '['
+                if in_array:
+                    index += 1
+                    continue
+
+            if in_array and buffer[index] == ']':
+                return
+
+            if not in_array:
+                # A whole line goes to the (faster) document decoder, which handles every newline-delimited message
+                line_end = buffer.find('\n', index)
+                if line_end >= 0:
+                    try:
+                        message = codec.loads(buffer[index:line_end])
+                    except ValueError:
+                        # The message spans more than one line (it's pretty-printed)
+                        pass
+                    else:
+                        yield message
+                        index = line_end + 1
+                        continue
+
+            try:
+                message, end = codec.raw_decode(buffer, index)
+            except ValueError:
+                if end_of_file:
+                    raise
+                # The message isn't all here yet so read some more (at least as much as we've already got)
+                chunk = archive_file.read(max(READ_SIZE, len(buffer) - index))
+                end_of_file = not chunk
+                buffer = buffer[index:] + chunk
+                index = 0
+                continue
+
+            yield message
+            index = end
+
+
+class MessageArchiveRangeReader(object):
+    """This class represents a byte range of a newline-delimited JSON archive that is read back one message at a time.
+
+    The range starts and ends on a message boundary (see split_message_archive), so a big archive can be read by several
+    readers at the same time.
+    """
+
+    def __init__(self, file_name, start, end):
+        self._file_name = file_name
+        self._start = start
+        self._end = end
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    @property
+    def start(self):
+        return self._start
+
+    @property
+    def size(self):
+        return self._end - self._start
+
+    def __iter__(self):
+        with open(self._file_name, 'rb') as archive_file:
+            archive_file.seek(self._start)
+            for message in MessageArchiveReader.iter_messages(_RangeStream(archive_file, self.size)):
+                yield message
+
+
+class _RangeStream(object):
+    """Reads no further than the end of a range of a file.
+    """
+
+    def __init__(self, archive_file, length):
+        self._archive_file = archive_file
+        self._remaining = length
+
+    def read(self, size):
+        if self._remaining <= 0:
+            return ''
+        data = self._archive_file.read(min(size, self._remaining))
+        self._remaining -= len(data)
+        return data
+
+
+def split_message_archive(file_name, range_size):
+    """Splits an uncompressed newline-delimited JSON archive into ranges of about range_size bytes.
+
+    Each range starts on a line that holds a whole message, found by reading on from where the range would otherwise
+    start, so nothing but those few lines is read. The ranges only depend on the archive and the range size.
+
+    :param file_name: The name of the archive.
+    :param range_size: The size of each range in bytes.
+    :return: The list of (start, end) byte ranges (or None if the archive can't be split because it's compressed, a JSON
+             array or a message spread over several lines).
+    """
+
+    archive_size = os.path.getsize(file_name)
+    codec = json_codec.get_codec()
+
+    with open(file_name, 'rb') as archive_file:
+        if detect_compression(archive_file.read(len(ZSTD_MAGIC))) != 'none':
+            return None
+
+        archive_file.seek(0)
+        first_line = archive_file.readline()
+        while first_line and not first_line.strip():
+            first_line = archive_file.readline()
+        if not _is_message_line(codec, first_line):
+            return None
+
+        boundaries = [0]
+
+        for position in xrange(range_size, archive_size, max(1, range_size)):
+            if position <= boundaries[-1]:
+                # The last boundary was found past this one
+                continue
+
+            # Finish the line the byte before the position is on, so a line that starts at the position is kept
+            archive_file.seek(position - 1)
+            archive_file.readline()
+
+            while True:
+                line_start = archive_file.tell()
+                line = archive_file.readline()
+                if not line or _is_message_line(codec, line):
+                    break
+
+            if not line:
+                break
+
+            boundaries.append(line_start)
+
+        boundaries.append(archive_size)
+
+    return zip(boundaries[:-1], boundaries[1:])
+
+
+def _is_message_line(codec, line):
+    line = line.strip()
+    if not line.startswith('{'):
+        return False
+    try:
+        return isinstance(codec.loads(line), dict)
+    except ValueError:
+        return False
+
+
+def check_archive_can_be_added_to(file_name, archive_format='json', compression='none', index=False):
+    """Checks that messages can be added to an archive (so nothing is taken off a queue that can't be saved).
+
+    :param file_name: The name of the archive (it's fine if it doesn't exist yet).
+    :param archive_format: The format the messages will be added in (json or ndjson).
+    :param compression: The compression the messages will be added with (none, gzip or zstd).
+    :param index: If True, the messages will be added to the index next to the archive too.
+    :raises IOError: If the archive is in another format or compression (or its index doesn't match it).
+    """
+
+    if not os.path.isfile(file_name) or not os.path.getsize(file_name):
+        return
+
+    with open(file_name, 'rb') as archive_file:
+        existing_compression = detect_compression(archive_file.read(len(ZSTD_MAGIC)))
+        if existing_compression != compression:
+            raise IOError('{0} is compressed with {1}, not {2}!'.format(file_name, existing_compression, compression)
+                          if existing_compression != 'none' else '{0} is not compressed!'.format(file_name))
+
+        if compression == 'none':
+            archive_file.seek(0)
+            is_array = archive_file.read(READ_SIZE).lstrip(WHITESPACE).startswith('[')
+            if archive_format == 'json' and not is_array:
+                raise IOError('{0} does not contain a JSON array!'.format(file_name))
+            if archive_format == 'ndjson' and is_array:
+                raise IOError('{0} is a JSON array, not newline-delimited JSON!'.format(file_name))
+
+    if index and get_index_end(get_index_file_name(file_name)) != os.path.getsize(file_name):
+        raise IOError('{0} has no index that matches it (it can only be added to if it has always been '
+                      'indexed)!'.format(file_name))
+
+
+def detect_compression(header):
+    """Detects the compression of an archive from its first bytes.
+
+    :param header: The first (four) bytes of the archive.
+    :return: The compression (one of COMPRESSIONS).
+    """
+
+    if header.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if header.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return 'none'
+
+
+def load_compression_dictionary(dictionary_file_name):
+    """Loads a trained zstd compression dictionary (once per file).
+
+    :param dictionary_file_name: The name of the dictionary file (or None for no dictionary).
+    :return: The dictionary (or None).
+    """
+
+    if not dictionary_file_name:
+        return None
+
+    with _compression_dictionaries_lock:
+        dictionary = _compression_dictionaries.get(dictionary_file_name)
+        if dictionary is None:
+            if zstandard is None:
+                raise IOError('Compression dictionaries require the zstandard package (pip install zstandard)')
+            with open(dictionary_file_name, 'rb') as dictionary_file:
+                dictionary = zstandard.ZstdCompressionDict(dictionary_file.read())
+            _compression_dictionaries[dictionary_file_name] = dictionary
+
+    return dictionary
+
+
+def train_compression_dictionary(messages, dictionary_file_name, dictionary_size=DICTIONARY_SIZE):
+    """Trains a zstd compression dictionary on messages and saves it.
+
+    Messages that are mostly the same headers compress much better with a dictionary, but the same dictionary is needed
+    to read the archive back.
+
+    :param messages: The sample messages.
+    :param dictionary_file_name: The name of the file to save the dictionary to.
+    :param dictionary_size: The maximum size of the dictionary in bytes.
+    :return: The dictionary.
+    :raises ValueError: If a dictionary can't be trained on the messages.
+    """
+
+    if zstandard is None:
+        raise IOError('Compression dictionaries require the zstandard package (pip install zstandard)')
+
+    try:
+        dictionary = zstandard.train_dictionary(dictionary_size, [json_codec.dumps(message) for message in messages])
+    except zstandard.ZstdError as err:
+        # Usually there aren't enough messages to learn from
+        raise ValueError('Unable to train a compression dictionary ({0})'.format(err))
+
+    with open(dictionary_file_name, 'wb') as dictionary_file:
+        dictionary_file.write(dictionary.as_bytes())
+
+    with _compression_dictionaries_lock:
+        _compression_dictionaries[dictionary_file_name] = dictionary
+
+    return dictionary
+
+
+def _open_compressed_writer(raw_file, compression, compression_dictionary):
+    if compression == 'gzip':
+        return gzip.GzipFile(filename='', fileobj=raw_file, mode='wb', compresslevel=GZIP_LEVEL)
+
+    if zstandard is None:
+        raise IOError('zstd compression requires the zstandard package (pip install zstandard)')
+
+    dictionary = load_compression_dictionary(compression_dictionary)
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dictionary) if dictionary else \
+        zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    return compressor.stream_writer(raw_file)
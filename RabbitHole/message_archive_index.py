@@ -0,0 +1,173 @@
+import mmap
+import os
+
+from RabbitHole import json_codec
+
+# The index of an archive is saved next to it (messages.ndjson -> messages.ndjson.idx)
+INDEX_EXTENSION = '.idx'
+
+# The most bytes read from the end of an index to find its last entry
+TAIL_SIZE = 4096
+
+
+class MessageArchiveIndexWriter(object):
+    """This class represents the index of a newline-delimited JSON archive that is being written.
+
+    The index has one compact JSON line per message: [byte offset, byte length, message ID, routing key]. The n-th line
+    belongs to the n-th message so a range of messages can be found without reading the archive.
+    """
+
+    def __init__(self, file_name, archive_size=0):
+        if archive_size:
+            # The index has to be added to rather than started again (and has to cover what's already archived)
+            if get_index_end(file_name) != archive_size:
+                raise ValueError('{0} is missing or does not match its archive (it can only be added to an archive '
+                                 'that has always been indexed)'.format(file_name))
+            self._file = open(file_name, 'ab')
+        else:
+            self._file = open(file_name, 'wb')
+
+        self._file_name = file_name
+        self._offset = archive_size
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    def add(self, message, length):
+        """Adds the next message in the archive to the index.
+
+        :param message: The message.
+        :param length: The number of bytes the message takes up in the archive.
+        """
+
+        self._file.write(json_codec.dumps([self._offset, length, get_message_id(message), message.get('routing_key')]))
+        self._file.write('\n')
+        self._offset += length
+
+    def flush(self, durable=False):
+        self._file.flush()
+        if durable:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class IndexedMessageArchiveReader(object):
+    """This class represents some of the messages in an indexed archive, read back without parsing the rest.
+
+    The index picks out the messages and the archive is memory-mapped so each one is read straight from its offset.
+    Messages are numbered from 1 in the order they were archived.
+    """
+
+    def __init__(self, file_name, first_message=None, last_message=None, message_ids=None):
+        self._file_name = file_name
+        self._index_file_name = get_index_file_name(file_name)
+        self._first_message = first_message or 1
+        self._last_message = last_message
+        self._message_ids = set(message_ids) if message_ids else None
+        self._found_message_ids = set()
+        self._bytes_read = 0
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    @property
+    def bytes_read(self):
+        return self._bytes_read
+
+    @property
+    def missing_message_ids(self):
+        """The message IDs that weren't in the archive (once the messages have been read).
+        """
+
+        if self._message_ids is None:
+            return []
+        return sorted(self._message_ids - self._found_message_ids)
+
+    def __iter__(self):
+        if not os.path.isfile(self._index_file_name):
+            raise IOError('{0} has no index (snag it with --index to read part of it)'.format(self._file_name))
+
+        archive_size = os.path.getsize(self._file_name)
+        if get_index_end(self._index_file_name) != archive_size:
+            raise IOError('The index of {0} is out of date'.format(self._file_name))
+
+        if not archive_size:
+            return
+
+        codec = json_codec.get_codec()
+
+        with open(self._file_name, 'rb') as archive_file:
+            archive = mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for offset, length in self._select():
+                    self._bytes_read += length
+                    yield codec.loads(archive[offset:offset + length])
+            finally:
+                archive.close()
+
+    def _select(self):
+        """Finds the selected messages in the index.
+
+        :return: A generator of the (offset, length) of each selected message.
+        """
+
+        with open(self._index_file_name, 'rb') as index_file:
+            for message_number, line in enumerate(index_file, 1):
+                if self._message_ids is None:
+                    if message_number < self._first_message:
+                        # Nothing before the range is parsed
+                        continue
+                    if self._last_message is not None and message_number > self._last_message:
+                        return
+
+                offset, length, message_id, routing_key = json_codec.loads(line)
+
+                if self._message_ids is not None:
+                    if message_id not in self._message_ids:
+                        continue
+                    self._found_message_ids.add(message_id)
+
+                yield offset, length
+
+
+def get_index_file_name(archive_file_name):
+    return archive_file_name + INDEX_EXTENSION
+
+
+def get_index_end(index_file_name):
+    """Gets the end of the archive covered by an index (from its last entry).
+
+    :param index_file_name: The name of the index file.
+    :return: The byte offset of the end of the last indexed message (0 for an empty index, None for no index).
+    """
+
+    if not os.path.isfile(index_file_name):
+        return None
+
+    with open(index_file_name, 'rb') as index_file:
+        index_file.seek(0, os.SEEK_END)
+        index_size = index_file.tell()
+        index_file.seek(max(0, index_size - TAIL_SIZE))
+        lines = index_file.read().splitlines()
+
+    if not lines:
+        return 0
+
+    offset, length = json_codec.loads(lines[-1])[:2]
+    return offset + length
+
+
+def get_message_id(message):
+    """Gets the ID of a message (the AMQP message ID or, failing that, the NServiceBus one).
+
+    :param message: The message.
+    :return: The message ID (or None).
+    """
+
+    properties = message.get('properties') or {}
+    return properties.get('message_id') or (properties.get('headers') or {}).get('NServiceBus.MessageId')
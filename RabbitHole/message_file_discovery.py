@@ -0,0 +1,141 @@
+import fnmatch
+import heapq
+import os
+import stat
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # The scandir package is the Python 2 backport of os.scandir
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# The files a folder is searched for unless told otherwise (what snag writes, compressed or not)
+DEFAULT_INCLUDE_FILES = ('*.json', '*.ndjson', '*.json.gz', '*.ndjson.gz', '*.json.zst', '*.ndjson.zst')
+
+# The files a folder is searched without unless told otherwise (the failures of earlier runs)
+DEFAULT_EXCLUDE_FILES = ('*.dead-letters.ndjson',)
+
+
+class MessageFileQueue(object):
+    """This class represents the message files found in a folder so far, handed out largest first.
+
+    Files can be taken while the folder is still being searched, so the first workers start straight away. Each file
+    taken is the largest one found so far, which keeps a giant file from being the last one left running.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._condition = threading.Condition()
+        self._finished = False
+        self._count = 0
+        self._error = None
+
+    @property
+    def count(self):
+        """The number of files found so far.
+        """
+
+        return self._count
+
+    def put(self, file_name, size):
+        with self._condition:
+            # The count breaks ties so files of the same size come out in the order they were found
+            heapq.heappush(self._heap, (-size, self._count, file_name))
+            self._count += 1
+            self._condition.notify()
+
+    def finish(self, error=None):
+        """Records that the search is over.
+
+        :param error: The error that ended the search early (if any), raised by get once the files found run out.
+        """
+
+        with self._condition:
+            self._finished = True
+            self._error = error
+            self._condition.notify_all()
+
+    def get(self):
+        """Takes the largest file found so far (waiting for the search to find one if needed).
+
+        :return: The name of the file (or None once the search is over and every file has been taken).
+        """
+
+        with self._condition:
+            while not self._heap and not self._finished:
+                self._condition.wait()
+
+            if self._heap:
+                return heapq.heappop(self._heap)[2]
+
+            if self._error is not None:
+                raise self._error
+
+            return None
+
+
+def find_message_files(folder_name, include_files=DEFAULT_INCLUDE_FILES, exclude_files=(), recursive=False):
+    """Finds the message files in a folder a directory entry at a time.
+
+    A pattern without a slash is matched against the file name and one with a slash against the path from the folder
+    (ex: 2019/*.json). Folders are skipped unless the search is recursive.
+
+    :param folder_name: The name of the folder to search.
+    :param include_files: The glob patterns of the files to find.
+    :param exclude_files: The glob patterns of the files (and folders) to leave out.
+    :param recursive: If True, the folders in the folder are searched too.
+    :return: A generator of (file name, size in bytes) tuples.
+    """
+
+    folders = [(folder_name, '')]
+
+    while folders:
+        folder, relative_folder = folders.pop()
+
+        for name, is_folder, size in _scan_folder(folder):
+            relative_name = relative_folder + name
+
+            if _matches_any(name, relative_name, exclude_files):
+                continue
+
+            if is_folder:
+                if recursive:
+                    folders.append((os.path.join(folder, name), relative_name + '/'))
+            elif _matches_any(name, relative_name, include_files):
+                yield os.path.join(folder, name), size
+
+
+def _scan_folder(folder):
+    """Lists a folder a directory entry at a time.
+
+    :return: A generator of (name, is folder, size) tuples (symbolic links are followed, like os.path.isdir does).
+    """
+
+    if scandir is not None:
+        for entry in scandir(folder):
+            try:
+                is_folder = entry.is_dir()
+                yield entry.name, is_folder, 0 if is_folder else entry.stat().st_size
+            except OSError:
+                # The entry went away (or is a broken link)
+                continue
+        return
+
+    for name in os.listdir(folder):
+        try:
+            entry_stat = os.stat(os.path.join(folder, name))
+        except OSError:
+            continue
+        is_folder = stat.S_ISDIR(entry_stat.st_mode)
+        yield name, is_folder, 0 if is_folder else entry_stat.st_size
+
+
+def _matches_any(name, relative_name, patterns):
+    for pattern in patterns:
+        if fnmatch.fnmatch(relative_name if '/' in pattern else name, pattern):
+            return True
+    return False
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import operator
+import re
+
+from RabbitHole.message_archive_index import get_message_id
+
+# Stands in for a path that isn't in a message (None is a value a message can have)
+MISSING = object()
+
+# <path> <operator> <value>, where the value can be quoted
+_COMPARISON = re.compile(r'^\s*(?P<path>[^\s=!~<>]+)\s*(?P<operator>==|!=|!~|~|>=|<=|>|<)\s*(?P<value>.*?)\s*$')
+
+# [not] exists <path>
+_EXISTS = re.compile(r'^\s*(?P<not>not\s+)?exists\s+(?P<path>\S+)\s*$')
+
+_NUMERIC_OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+
+
+class MessageFilter(object):
+    """This class represents a compiled list of conditions a message has to meet (all of them).
+
+    Each condition is compiled once into a predicate: its path into a MessagePath and its value into the type it's
+    compared as (and its regular expression, if it has one), so checking a message is a walk down each path and a
+    comparison.
+    """
+
+    def __init__(self, expressions):
+        self._expressions = tuple(expressions)
+        self._predicates = tuple(compile_predicate(expression) for expression in self._expressions)
+
+    @property
+    def expressions(self):
+        return self._expressions
+
+    def matches(self, message):
+        """Checks whether a message meets every condition.
+
+        :param message: The message.
+        :return: True if the message matches.
+        """
+
+        for predicate in self._predicates:
+            if not predicate(message):
+                return False
+        return True
+
+
+class MessagePath(object):
+    """This class represents a compiled, dot-separated path into a message (ex: properties.headers.NServiceBus.FailedQ).
+
+    Header names contain dots too, so the keys a path could be made of are worked out once and the shortest key that
+    leads somewhere is used at each step. Numeric parts of the path index into lists.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        segments = path.split('.')
+        if not all(segments):
+            raise ValueError('{0} is not a valid path'.format(path))
+
+        self._length = len(segments)
+        self._keys = tuple(tuple((end, '.'.join(segments[start:end])) for end in range(start + 1, self._length + 1))
+                           for start in range(self._length))
+        self._indexes = tuple(int(segment) if re.match(r'^-?\d+$', segment) else None for segment in segments)
+
+    @property
+    def path(self):
+        return self._path
+
+    def get(self, message):
+        """Gets the value at the path.
+
+        :param message: The message.
+        :return: The value (or MISSING if the message doesn't have the path).
+        """
+
+        return self._get(message, 0)
+
+    def _get(self, value, position):
+        if position == self._length:
+            return value
+
+        if isinstance(value, dict):
+            for end, key in self._keys[position]:
+                child = value.get(key, MISSING)
+                if child is not MISSING:
+                    found = self._get(child, end)
+                    if found is not MISSING:
+                        return found
+        elif isinstance(value, list):
+            index = self._indexes[position]
+            if index is not None and -len(value) <= index < len(value):
+                return self._get(value[index], position + 1)
+
+        return MISSING
+
+
+def compile_predicate(expression):
+    """Compiles a condition into a predicate.
+
+    The conditions are:
+    - path == value and path != value (numbers are compared as numbers, true, false and null match JSON literals)
+    - path ~ regex and path !~ regex (the regular expression can match anywhere in the value)
+    - path > number, path >= number, path < number and path <= number
+    - exists path and not exists path
+
+    :param expression: The condition.
+    :return: A callable that takes a message and returns True if the message meets the condition.
+    :raises ValueError: If the condition isn't valid.
+    """
+
+    exists_match = _EXISTS.match(expression)
+    if exists_match:
+        message_path = MessagePath(exists_match.group('path'))
+        if exists_match.group('not'):
+            return lambda message: message_path.get(message) is MISSING
+        return lambda message: message_path.get(message) is not MISSING
+
+    comparison_match = _COMPARISON.match(expression)
+    if not comparison_match:
+        raise ValueError('{0} is not a valid condition (expected path == value, path ~ regex, path > number or '
+                         'exists path)'.format(expression))
+
+    message_path = MessagePath(comparison_match.group('path'))
+    comparison = comparison_match.group('operator')
+    text = _unquote(comparison_match.group('value'))
+    if isinstance(text, str):
+        # Messages are decoded from JSON, so their strings are unicode
+        text = text.decode('utf-8')
+    number = _to_number(text)
+
+    if comparison in ('==', '!='):
+        negate = comparison == '!='
+        return lambda message: _equals(message_path.get(message), text, number) != negate
+
+    if comparison in ('~', '!~'):
+        try:
+            regex = re.compile(text)
+        except re.error as err:
+            raise ValueError('{0} is not a valid regular expression ({1})'.format(text, err))
+        negate = comparison == '!~'
+        return lambda message: _search(message_path.get(message), regex) != negate
+
+    if number is None:
+        raise ValueError('{0} can only be compared with a number (not {1})'.format(comparison, text))
+
+    compare = _NUMERIC_OPERATORS[comparison]
+
+    def compare_numbers(message):
+        value = _to_number(message_path.get(message))
+        return value is not None and compare(value, number)
+
+    return compare_numbers
+
+
+def get_message_fingerprint(message):
+    """Gets what a message is recognised by when it comes round again after being put back on a queue.
+
+    :param message: The message.
+    :return: The message ID (or a hash of the properties and payload if it doesn't have an ID, since the rest of what
+             the broker returns, like redelivered and message_count, changes).
+    """
+
+    message_id = get_message_id(message)
+    if message_id:
+        return message_id
+
+    # The standard library is used so the keys are sorted (and the hash is the same every time)
+    return 'sha1:' + hashlib.sha1(json.dumps([message.get('properties'), message.get('payload')],
+                                             sort_keys=True)).hexdigest()
+
+
+def _unquote(text):
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in '\'"':
+        return text[1:-1]
+    return text
+
+
+def _to_number(value):
+    if isinstance(value, bool) or value is None or value is MISSING:
+        return None
+    if isinstance(value, (int, long, float)):
+        return value
+    if isinstance(value, basestring):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def _equals(value, text, number):
+    if value is MISSING:
+        return False
+    if value is None:
+        return text == 'null'
+    if isinstance(value, bool):
+        return text == ('true' if value else 'false')
+    if isinstance(value, (int, long, float)):
+        return number is not None and value == number
+    if isinstance(value, basestring):
+        return value == text
+    return False
+
+
+def _search(value, regex):
+    if value is MISSING or value is None or isinstance(value, (dict, list)):
+        return False
+    if isinstance(value, bool):
+        value = 'true' if value else 'false'
+    elif not isinstance(value, basestring):
+        value = str(value)
+    return regex.search(value) is not None
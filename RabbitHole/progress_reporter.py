@@ -0,0 +1,77 @@
+import datetime
+import threading
+from timeit import default_timer as timer
+
+# The least time (in seconds) between two progress updates
+REPORT_INTERVAL = 0.25
+
+
+class ProgressReporter(object):
+    """This class represents the progress of a long-running step (shown a few times a second rather than per message).
+
+    Any number of threads can add to the count. The console is only written to when the report interval has passed, so
+    the cost of reporting doesn't depend on the number of messages.
+    """
+
+    def __init__(self, console, description, total=None, simulated=False, interval=REPORT_INTERVAL):
+        self._console = console
+        self._description = description
+        self._total = total
+        self._simulated = simulated
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._count = 0
+        self._start = timer()
+        self._next_report = self._start + interval
+        self._finished = False
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def total(self):
+        return self._total
+
+    def add(self, count=1):
+        """Adds to the count (and shows the progress if it's time to).
+
+        :param count: The number of messages to add.
+        """
+
+        with self._lock:
+            self._count += count
+            now = timer()
+            if now >= self._next_report and not self._finished:
+                self._next_report = now + self._interval
+                self._console.write_progress(self._format(now), simulated=self._simulated)
+
+    def finish(self):
+        """Shows the final progress.
+        """
+
+        with self._lock:
+            if not self._finished:
+                self._finished = True
+                self._console.write_progress(self._format(timer()), final=True, simulated=self._simulated)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish()
+
+    def _format(self, now):
+        elapsed_seconds = now - self._start
+        rate = self._count / elapsed_seconds if elapsed_seconds > 0 else 0.0
+
+        if not self._total:
+            return '{0}: {1} - {2:.1f} messages/second'.format(self._description, self._count, rate)
+
+        if rate > 0 and self._count < self._total:
+            eta = str(datetime.timedelta(seconds=int((self._total - self._count) / rate)))
+        else:
+            eta = '0:00:00'
+
+        return '{0}: {1} of {2} ({3:.0f}%) - {4:.1f} messages/second - ETA {5}'.format(
+            self._description, self._count, self._total, 100.0 * self._count / self._total, rate, eta)
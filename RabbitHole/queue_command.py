@@ -1,9 +1,13 @@
+import os
 import threading
+from timeit import default_timer as timer
 
-from Queue import Queue
-
+from RabbitHole.message_file_discovery import MessageFileQueue
+from RabbitHole.progress_reporter import ProgressReporter
 from RabbitHole.rabbitmq_message_helper import RabbitMQMessageHelper
 from RabbitHole.rabbitmq import RabbitMQ
+from RabbitHole.rabbitmq import RabbitMQError
+from RabbitHole.worker_pool import WorkerPool
 
 
 class QueueCommand(object):
@@ -28,116 +32,453 @@ class QueueCommand(object):
                                              self._configuration.command_line_arguments.message_source_file)
             self._console.write_keyvaluepair('Destination Queue',
                                              self._configuration.command_line_arguments.rabbit_destination_queue)
+            if self._has_message_selection():
+                self._console.write_keyvaluepair('         Messages', self._describe_message_selection())
             self._console.write_divider()
 
-        messages = self._rabbitmq_message_helper.get_rabbit_messages_from_file(
-            self._configuration.command_line_arguments.message_source_file,
-            self._configuration.simulate,
-            self._configuration.verbose)
+        self._check_message_selection()
 
-        self._logger.debug('There were {0} messages in the file'.format(len(messages)))
+        try:
+            file_ranges = self._get_file_ranges()
+        except IOError as err:
+            # The details have already been written to the console
+            raise RabbitMQError(str(err))
 
-        self._rabbitmq.publish_messages(messages,
-                                        self._configuration.rabbit_host_url,
-                                        self._configuration.rabbit_host_port,
-                                        self._configuration.rabbit_vhost,
-                                        self._configuration.rabbit_authorization_string,
-                                        self._configuration.command_line_arguments.rabbit_destination_queue,
-                                        self._configuration.simulate,
-                                        self._configuration.verbose)
+        try:
+            if file_ranges:
+                self._queue_file_ranges(file_ranges)
+            else:
+                self._queue_whole_file()
+        finally:
+            self._rabbitmq.close()
 
-    def queue_folder(self):
-        """Sends messages to a queue from all JSON-formatted files in a folder.
+    def _queue_whole_file(self):
+        """Sends messages to a queue from a file with a single reader.
+        """
 
-            :return:
-            """
+        journal = self._open_checkpoint_journal()
+        completed = False
+
+        # Selected messages are journalled by ID so a resumed run matches them up whatever was selected
+        if self._has_message_selection():
+            journal_source = None
+        else:
+            journal_source = os.path.abspath(self._configuration.command_line_arguments.message_source_file)
+
+        try:
+            messages = self._rabbitmq_message_helper.get_rabbit_messages_from_file(
+                self._configuration.command_line_arguments.message_source_file,
+                self._configuration.simulate,
+                self._configuration.verbose,
+                self._configuration.compression_dictionary,
+                getattr(self._configuration.command_line_arguments, 'first_message', None),
+                getattr(self._configuration.command_line_arguments, 'last_message', None),
+                getattr(self._configuration.command_line_arguments, 'message_ids', None))
+
+            message_count = self._rabbitmq.publish_messages(messages,
+                                                            self._configuration.rabbit_host_url,
+                                                            self._configuration.rabbit_host_port,
+                                                            self._configuration.rabbit_vhost,
+                                                            self._configuration.rabbit_authorization_string,
+                                                            self._configuration.command_line_arguments.rabbit_destination_queue,
+                                                            self._configuration.simulate,
+                                                            self._configuration.verbose,
+                                                            journal=journal,
+                                                            journal_source=journal_source)
+            completed = True
+        except IOError as err:
+            # The details have already been written to the console
+            raise RabbitMQError(str(err))
+        finally:
+            self._rabbitmq_message_helper.close_checkpoint_journal(journal, completed)
+
+        self._logger.debug('There were %s messages in the file', message_count)
+
+    def _get_file_ranges(self):
+        """Splits a big message file into byte ranges that can be queued at the same time.
+
+        :return: The list of (start, end) byte ranges (or None if the file is queued by a single reader because it's too
+                 small to split, can't be split, or its order has to be kept).
+        """
 
-        global THREAD_QUEUE
+        if self._has_message_selection() or self._configuration.preserve_order or self._configuration.split_size <= 0:
+            return None
 
-        THREAD_QUEUE = Queue(maxsize=0)
+        file_ranges = self._rabbitmq_message_helper.get_rabbit_message_file_ranges(
+            self._configuration.command_line_arguments.message_source_file,
+            int(self._configuration.split_size * 1024 * 1024))
 
-        number_of_threads = self._configuration.max_threads
+        if file_ranges is None or len(file_ranges) < 2:
+            return None
 
-        message_files = self._rabbitmq_message_helper.get_rabbit_message_files_in_folder(
-            self._configuration.command_line_arguments.message_source_file)
+        return file_ranges
 
-        for message_file in message_files:
-            THREAD_QUEUE.put(message_file)
+    def _queue_file_ranges(self, file_ranges):
+        """Sends messages to a queue from the byte ranges of a big file, a range per worker at a time.
 
-        self._console.write_keyvaluepair('    Source Folder',
-                                         self._configuration.command_line_arguments.message_source_file)
-        self._console.write_keyvaluepair('Destination Queue',
-                                         self._configuration.command_line_arguments.rabbit_destination_queue)
-        self._console.write_keyvaluepair('       File Count',
-                                         len(message_files))
-        self._console.write_keyvaluepair('       Queue Size',
-                                         THREAD_QUEUE.qsize())
-        self._console.write_keyvaluepair(' Max Thread Count',
-                                         number_of_threads)
-        self._console.write_divider()
-
-        thread_list = []
+        :param file_ranges: The list of (start, end) byte ranges.
+        """
 
-        # Build the threads
-        for i in range(number_of_threads):
-            worker = threading.Thread(target=self._queue_file_on_thread, args=(THREAD_QUEUE,))
-            worker.setDaemon(True)
-            thread_list.append(worker)
+        message_source_file = self._configuration.command_line_arguments.message_source_file
 
-        self._console.write_update(
-            'Publishing {0} message files to {1}'.format(len(message_files),
-                                                         self._configuration.command_line_arguments.rabbit_destination_queue))
-        self._configuration.silent = True
+        # There's no point in having more workers than ranges
+        number_of_workers = max(1, min(len(file_ranges), self._configuration.max_threads))
 
-        # Start the threads
-        for i in thread_list:
-            i.start()
+        if self._configuration.verbose:
+            self._console.write_keyvaluepair('      Range Count', len(file_ranges))
+            self._console.write_keyvaluepair('     Worker Count', number_of_workers)
+            self._console.write_divider()
 
-        # Wait for the queue to be empty
-        THREAD_QUEUE.join()
+        # The workers share one RabbitMQ and one progress report, just like a folder of files
+        quiet_console = self._console.get_quiet_console()
+        range_rabbitmq_message_helper = RabbitMQMessageHelper(self._configuration, quiet_console, self._logger)
+        range_rabbitmq = RabbitMQ(self._configuration, quiet_console, self._logger)
+
+        journal = self._open_checkpoint_journal()
+
+        results = []
+        results_lock = threading.Lock()
+
+        start = timer()
+
+        try:
+            with ProgressReporter(self._console,
+                                  'Publishing to {0}'.format(
+                                      self._configuration.command_line_arguments.rabbit_destination_queue),
+                                  simulated=self._configuration.simulate) as progress, \
+                    WorkerPool(number_of_workers, name='queue-file') as pool:
+                for range_start, range_end in file_ranges:
+                    pool.submit(self._queue_file_range,
+                                message_source_file,
+                                range_start,
+                                range_end,
+                                range_rabbitmq_message_helper,
+                                range_rabbitmq,
+                                progress,
+                                journal,
+                                results,
+                                results_lock)
+        finally:
+            range_rabbitmq.close()
+
+        end = timer()
+
+        try:
+            self._write_folder_summary(results, end - start, 'Ranges')
+        finally:
+            self._rabbitmq_message_helper.close_checkpoint_journal(
+                journal, all(error is None for file_range, message_count, error in results))
+
+    def _queue_file_range(self,
+                          message_source_file,
+                          range_start,
+                          range_end,
+                          rabbitmq_message_helper,
+                          rabbitmq,
+                          progress,
+                          journal,
+                          results,
+                          results_lock):
+        """Sends messages to a queue from one of the byte ranges of a file (on a worker thread).
+
+        :param message_source_file: The file.
+        :param range_start: The byte offset the range starts at.
+        :param range_end: The byte offset the range ends at.
+        :param rabbitmq_message_helper: The message helper the workers share.
+        :param rabbitmq: The RabbitMQ the workers share.
+        :param progress: The progress reporter the workers share.
+        :param journal: The checkpoint journal the workers share (if any).
+        :param results: The list of (range, message count, error) results.
+        :param results_lock: The lock that guards the results.
+        """
 
-        self._configuration.silent = False
+        file_range = '{0} bytes {1}-{2}'.format(message_source_file, range_start, range_end)
+        message_count = 0
+        error = None
+
+        try:
+            messages = rabbitmq_message_helper.get_rabbit_messages_from_file_range(message_source_file,
+                                                                                   range_start,
+                                                                                   range_end)
+
+            # Each range is journalled as a source of its own (the ranges only depend on the file and the split size)
+            message_count = rabbitmq.publish_messages(messages,
+                                                      self._configuration.rabbit_host_url,
+                                                      self._configuration.rabbit_host_port,
+                                                      self._configuration.rabbit_vhost,
+                                                      self._configuration.rabbit_authorization_string,
+                                                      self._configuration.command_line_arguments.rabbit_destination_queue,
+                                                      self._configuration.simulate,
+                                                      self._configuration.verbose,
+                                                      progress,
+                                                      journal,
+                                                      '{0}@{1}'.format(os.path.abspath(message_source_file),
+                                                                       range_start)) or 0
+        except (RabbitMQError, IOError) as err:
+            error = err
+
+        self._logger.debug('There were %s messages in %s', message_count, file_range)
+
+        with results_lock:
+            results.append((file_range, message_count, error))
 
-    def _queue_file_on_thread(self, thread_queue):
-        """Sends messages to a queue from a JSON-formatted file.
+    def queue_folder(self):
+        """Sends messages to a queue from all JSON-formatted files in a folder.
 
         :return:
         """
 
-        # Yes, we're putting ourselves in an infinite loop. This should be executed by a daemon thread which will only then
-        # exit when the main thread ends.
-        while True:
-            message_source_file = thread_queue.get()
+        if self._has_message_selection():
+            self._console.write_error('--from, --to and --ids only work with a single file!')
+            raise RabbitMQError('Messages can only be selected from a single file')
 
-            messages = self._rabbitmq_message_helper.get_rabbit_messages_from_file(message_source_file,
-                                                                                   self._configuration.simulate,
-                                                                                   self._configuration.verbose)
+        message_source_folder = self._configuration.command_line_arguments.message_source_file
+        number_of_workers = max(1, self._configuration.max_threads)
 
-            self._logger.debug('There were {0} messages in the file'.format(len(messages)))
+        self._console.write_keyvaluepair('    Source Folder',
+                                         message_source_folder)
+        self._console.write_keyvaluepair('Destination Queue',
+                                         self._configuration.command_line_arguments.rabbit_destination_queue)
+        self._console.write_keyvaluepair('     Worker Count',
+                                         number_of_workers)
+        self._console.write_divider()
 
-            self._rabbitmq.publish_messages(messages,
-                                            self._configuration.rabbit_host_url,
-                                            self._configuration.rabbit_host_port,
-                                            self._configuration.rabbit_vhost,
-                                            self._configuration.rabbit_authorization_string,
-                                            self._configuration.command_line_arguments.rabbit_destination_queue,
-                                            self._configuration.simulate,
-                                            self._configuration.verbose)
+        self._console.write_update(
+            'Publishing message files to {0}'.format(self._configuration.command_line_arguments.rabbit_destination_queue))
+
+        # The workers share one RabbitMQ (and so one pool of publishers and kept-alive connections for the whole run)
+        # and one progress report, and keep everything else but errors off the console
+        quiet_console = self._console.get_quiet_console()
+        folder_rabbitmq_message_helper = RabbitMQMessageHelper(self._configuration, quiet_console, self._logger)
+        folder_rabbitmq = RabbitMQ(self._configuration, quiet_console, self._logger)
+
+        journal = self._open_checkpoint_journal()
+
+        results = []
+        results_lock = threading.Lock()
+
+        # The folder is searched on a thread of its own so the first files are being sent while the rest are found
+        message_files = MessageFileQueue()
+        discovery_thread = threading.Thread(target=self._find_folder_files,
+                                            args=(message_source_folder, message_files),
+                                            name='queue-folder-discovery')
+        discovery_thread.daemon = True
+
+        discovery_errors = []
+
+        start = timer()
+
+        try:
+            with ProgressReporter(self._console,
+                                  'Publishing to {0}'.format(
+                                      self._configuration.command_line_arguments.rabbit_destination_queue),
+                                  simulated=self._configuration.simulate) as progress, \
+                    WorkerPool(number_of_workers, name='queue-folder') as pool:
+                discovery_thread.start()
+
+                # Each worker takes its next file straight from the message files when it's free (rather than having
+                # files queued up for it), so a bigger file found later still goes before the smaller ones
+                for i in range(number_of_workers):
+                    pool.submit(self._queue_folder_files,
+                                message_files,
+                                folder_rabbitmq_message_helper,
+                                folder_rabbitmq,
+                                progress,
+                                journal,
+                                results,
+                                discovery_errors,
+                                results_lock)
+        finally:
+            folder_rabbitmq.close()
+            self._rabbitmq.close()
+
+        end = timer()
+
+        discovery_error = discovery_errors[0] if discovery_errors else None
+
+        try:
+            if discovery_error is not None:
+                self._console.write_error('Unable to search {0} ({1})'.format(message_source_folder, discovery_error))
+                raise RabbitMQError(str(discovery_error))
+
+            if not results:
+                self._console.write_error('No message files found in {0}!'.format(message_source_folder))
+                self._console.write_hint('Use --include to pick out files that aren\'t named *.json or *.ndjson '
+                                         '(or --recursive to search the folders in the folder)')
+
+            self._write_folder_summary(results, end - start)
+        finally:
+            self._rabbitmq_message_helper.close_checkpoint_journal(
+                journal,
+                discovery_error is None and all(error is None for message_file, message_count, error in results))
+
+    def _find_folder_files(self, message_source_folder, message_files):
+        """Searches a folder for message files, handing each one over as it's found (on the discovery thread).
+
+        :param message_source_folder: The folder.
+        :param message_files: The MessageFileQueue the files are handed over in.
+        """
 
-            thread_queue.task_done()
+        error = None
+
+        try:
+            for message_file, size in self._rabbitmq_message_helper.find_rabbit_message_files(message_source_folder):
+                message_files.put(message_file, size)
+        except OSError as err:
+            error = err
+        finally:
+            self._logger.debug('Found %s message files in %s', message_files.count, message_source_folder)
+            message_files.finish(error)
+
+    def _open_checkpoint_journal(self):
+        try:
+            return self._rabbitmq_message_helper.open_checkpoint_journal(
+                'queue-{0}'.format(self._configuration.command_line_arguments.rabbit_destination_queue))
+        except IOError as err:
+            # The details have already been written to the console
+            raise RabbitMQError(str(err))
+
+    def _has_message_selection(self):
+        arguments = self._configuration.command_line_arguments
+        return (getattr(arguments, 'first_message', None) is not None or
+                getattr(arguments, 'last_message', None) is not None or
+                bool(getattr(arguments, 'message_ids', None)))
+
+    def _describe_message_selection(self):
+        arguments = self._configuration.command_line_arguments
+        if getattr(arguments, 'message_ids', None):
+            return '{0} IDs'.format(len(arguments.message_ids))
+        return '{0} to {1}'.format(arguments.first_message or 1, arguments.last_message or 'the end')
+
+    def _check_message_selection(self):
+        """Makes sure the selected messages make sense (before anything is sent).
+        """
 
-            # def _get_chunks(self, list_to_chunk, items_per_chunk):
-            #     """Chunks a list into parts.
+        arguments = self._configuration.command_line_arguments
+        first_message = getattr(arguments, 'first_message', None)
+        last_message = getattr(arguments, 'last_message', None)
+
+        error = None
+        if getattr(arguments, 'message_ids', None) and (first_message is not None or last_message is not None):
+            error = 'Messages can be selected by number (--from and --to) or by ID (--ids) but not both'
+        elif first_message is not None and first_message < 1:
+            error = 'Messages are numbered from 1'
+        elif last_message is not None and last_message < (first_message or 1):
+            error = 'The last message comes before the first message'
+
+        if error:
+            self._console.write_error(error)
+            raise RabbitMQError(error)
+
+    def _queue_folder_files(self,
+                            message_files,
+                            rabbitmq_message_helper,
+                            rabbitmq,
+                            progress,
+                            journal,
+                            results,
+                            discovery_errors,
+                            results_lock):
+        """Sends messages to a queue from the files in a folder, largest first, until there are none left (on a worker
+        thread).
+
+        :param message_files: The MessageFileQueue the files are taken from.
+        :param rabbitmq_message_helper: The message helper the workers share.
+        :param rabbitmq: The RabbitMQ the workers share.
+        :param progress: The progress reporter the workers share.
+        :param journal: The checkpoint journal the workers share (if any).
+        :param results: The list of (file, message count, error) results.
+        :param discovery_errors: The list of the errors that ended the search of the folder early.
+        :param results_lock: The lock that guards the results and errors.
+        """
 
-            #     :param list_to_chunk:
-            #     :param items_per_chunk:
-            #     :return:
-            #     """
+        while True:
+            try:
+                message_file = message_files.get()
+            except OSError as err:
+                with results_lock:
+                    discovery_errors.append(err)
+                return
+
+            if message_file is None:
+                return
+
+            self._queue_folder_file(message_file,
+                                    rabbitmq_message_helper,
+                                    rabbitmq,
+                                    progress,
+                                    journal,
+                                    results,
+                                    results_lock)
+
+    def _queue_folder_file(self,
+                           message_source_file,
+                           rabbitmq_message_helper,
+                           rabbitmq,
+                           progress,
+                           journal,
+                           results,
+                           results_lock):
+        """Sends messages to a queue from one of the files in a folder (on a worker thread).
+
+        :param message_source_file: The file.
+        :param rabbitmq_message_helper: The message helper the workers share.
+        :param rabbitmq: The RabbitMQ the workers share.
+        :param progress: The progress reporter the workers share.
+        :param journal: The checkpoint journal the workers share (if any).
+        :param results: The list of (file, message count, error) results.
+        :param results_lock: The lock that guards the results.
+        """
 
-            #     chunks = []
+        message_count = 0
+        error = None
+
+        try:
+            messages = rabbitmq_message_helper.get_rabbit_messages_from_file(message_source_file,
+                                                                             self._configuration.simulate,
+                                                                             self._configuration.verbose,
+                                                                             self._configuration.compression_dictionary)
+
+            message_count = rabbitmq.publish_messages(messages,
+                                                      self._configuration.rabbit_host_url,
+                                                      self._configuration.rabbit_host_port,
+                                                      self._configuration.rabbit_vhost,
+                                                      self._configuration.rabbit_authorization_string,
+                                                      self._configuration.command_line_arguments.rabbit_destination_queue,
+                                                      self._configuration.simulate,
+                                                      self._configuration.verbose,
+                                                      progress,
+                                                      journal,
+                                                      os.path.abspath(message_source_file)) or 0
+        except (RabbitMQError, IOError) as err:
+            error = err
+
+        self._logger.debug('There were %s messages in %s', message_count, message_source_file)
+
+        with results_lock:
+            results.append((message_source_file, message_count, error))
+
+    def _write_folder_summary(self, results, elapsed_seconds, unit='Files'):
+        """Writes the summary of a folder run (and fails the run if any of the files failed).
+
+        :param results: The list of (file, message count, error) results.
+        :param elapsed_seconds: How long the run took.
+        :param unit: What the results are for (Files, or Ranges for the ranges of a big file).
+        """
 
-            #     for x in range(0, len(list_to_chunk), items_per_chunk):
-            #         chunk = list_to_chunk[x:x + items_per_chunk]
-            #         chunks.append(chunk)
+        message_count = sum(result_message_count for message_file, result_message_count, error in results)
+        failed_files = [message_file for message_file, result_message_count, error in results if error is not None]
 
-            #     return chunks
+        self._console.write_divider()
+        self._console.write_keyvaluepair('{0:>15}'.format(unit + ' Queued'), len(results) - len(failed_files))
+        self._console.write_keyvaluepair('{0:>15}'.format(unit + ' Failed'), len(failed_files))
+        if self._configuration.deduplicator is not None:
+            self._console.write_keyvaluepair('     Duplicates', self._configuration.deduplicator.suppressed_count)
+        self._console.write_keyvaluepair('       Messages', message_count)
+        self._console.write_keyvaluepair('     Throughput', '{0:.1f} messages/second'.format(
+            message_count / elapsed_seconds if elapsed_seconds > 0 else 0.0))
+
+        if failed_files:
+            for failed_file in sorted(failed_files):
+                self._console.write_error('{0} was not queued'.format(failed_file))
+            raise RabbitMQError('{0} of {1} {2} failed'.format(len(failed_files), len(results), unit.lower()))
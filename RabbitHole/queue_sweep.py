@@ -0,0 +1,187 @@
+import fnmatch
+import re
+import threading
+
+from timeit import default_timer as timer
+
+from RabbitHole.rabbitmq import RabbitMQ
+from RabbitHole.rabbitmq import RabbitMQError
+from RabbitHole.rabbitmq_message_helper import RabbitMQMessageHelper
+from RabbitHole.worker_pool import WorkerPool
+
+
+class QueueSelector(object):
+    """This class represents a pattern that picks out queues by name.
+
+    Glob patterns (like *.error) have to match the whole name and regular expressions can match anywhere in it (use ^
+    and $ to anchor them).
+    """
+
+    def __init__(self, pattern, regex=False):
+        self._pattern = pattern
+        self._regex = regex
+        self._expression = re.compile(pattern if regex else fnmatch.translate(pattern))
+
+    @property
+    def pattern(self):
+        return self._pattern
+
+    def matches(self, queue_name):
+        """Checks whether a queue is picked out by the pattern.
+
+        :param queue_name: The name of the queue.
+        :return: True if the queue matches.
+        """
+
+        if self._regex:
+            return self._expression.search(queue_name) is not None
+        return self._expression.match(queue_name) is not None
+
+    def select(self, queues, include_empty=False):
+        """Picks out the matching queues from a queue list.
+
+        :param queues: The queues (dictionaries with the name and number of messages of each queue).
+        :param include_empty: If True, queues without any messages are picked out too.
+        :return: The sorted names of the matching queues.
+        """
+
+        return sorted(queue['name'] for queue in queues
+                      if self.matches(queue['name']) and (include_empty or queue.get('messages', 1) != 0))
+
+
+def create_queue_selector(command_line_arguments):
+    """Creates the queue selector for the command line arguments.
+
+    :param command_line_arguments: The command line arguments.
+    :return: A QueueSelector, or None if a single queue was named.
+    """
+
+    queue_pattern = getattr(command_line_arguments, 'queue_pattern', None)
+    if queue_pattern:
+        return QueueSelector(queue_pattern)
+
+    queue_regex = getattr(command_line_arguments, 'queue_regex', None)
+    if queue_regex:
+        return QueueSelector(queue_regex, regex=True)
+
+    return None
+
+
+class QueueSweep(object):
+    """Runs a command against every queue a pattern picks out in a single run.
+
+    The queues are worked on a few at a time and share one RabbitMQ (and so one pool of kept-alive connections and one
+    request window for the whole run). Everything but errors is kept off the console until the combined summary.
+    """
+
+    def __init__(self, configuration, console, logger):
+        self._configuration = configuration
+        self._console = console
+        self._logger = logger
+        self._rabbitmq = RabbitMQ(configuration, console, logger)
+
+    def run(self, selector, action, process_queue):
+        """Lists the queues, processes every matching one and writes the summary.
+
+        :param selector: The QueueSelector.
+        :param action: What's done to each queue (for the console, like 'Snagged').
+        :param process_queue: The callable that processes a queue (it's given the queue name, the shared RabbitMQ and
+                              message helper and returns the number of messages).
+        :return: The number of messages processed.
+        """
+
+        try:
+            queues = selector.select(self._rabbitmq.list_queues(self._configuration.rabbit_host_url,
+                                                                self._configuration.rabbit_host_port,
+                                                                self._configuration.rabbit_vhost,
+                                                                self._configuration.rabbit_authorization_string))
+        finally:
+            self._rabbitmq.close()
+
+        if not queues:
+            self._console.write_error('No queues with messages match {0}!'.format(selector.pattern))
+            self._console.write_hint('Queues without any messages are skipped')
+            return 0
+
+        # There's no point in having more workers than queues
+        number_of_workers = max(1, min(len(queues), self._configuration.max_threads))
+
+        self._console.write_keyvaluepair('Queue Pattern', selector.pattern)
+        self._console.write_keyvaluepair('  Queue Count', len(queues))
+        self._console.write_keyvaluepair(' Worker Count', number_of_workers)
+        self._console.write_divider()
+
+        quiet_console = self._console.get_quiet_console()
+        sweep_rabbitmq_message_helper = RabbitMQMessageHelper(self._configuration, quiet_console, self._logger)
+        sweep_rabbitmq = RabbitMQ(self._configuration, quiet_console, self._logger)
+
+        results = []
+        results_lock = threading.Lock()
+
+        start = timer()
+
+        try:
+            with WorkerPool(number_of_workers, name='queue-sweep') as pool:
+                for queue in queues:
+                    pool.submit(self._process_queue,
+                                queue,
+                                process_queue,
+                                sweep_rabbitmq,
+                                sweep_rabbitmq_message_helper,
+                                results,
+                                results_lock)
+        finally:
+            sweep_rabbitmq.close()
+
+        end = timer()
+
+        return self._write_summary(action, results, end - start)
+
+    def _process_queue(self, queue, process_queue, rabbitmq, rabbitmq_message_helper, results, results_lock):
+        """Processes one of the queues (on a worker thread).
+        """
+
+        message_count = 0
+        error = None
+
+        try:
+            message_count = process_queue(queue, rabbitmq, rabbitmq_message_helper) or 0
+        except (RabbitMQError, IOError) as err:
+            error = err
+
+        self._logger.debug('There were %s messages in %s', message_count, queue)
+
+        with results_lock:
+            results.append((queue, message_count, error))
+
+    def _write_summary(self, action, results, elapsed_seconds):
+        """Writes the combined summary (and fails the run if any of the queues failed).
+
+        :param action: What was done to each queue.
+        :param results: The list of (queue, message count, error) results.
+        :param elapsed_seconds: How long the run took.
+        :return: The number of messages processed.
+        """
+
+        failed_queues = [(queue, error) for queue, message_count, error in results if error is not None]
+        message_count = sum(result_message_count for queue, result_message_count, error in results)
+
+        for queue, result_message_count, error in sorted(results):
+            if error is None:
+                self._console.write_keyvaluepair(queue, result_message_count)
+
+        self._console.write_divider()
+        self._console.write_keyvaluepair('{0:>15}'.format('Queues ' + action), len(results) - len(failed_queues))
+        self._console.write_keyvaluepair('  Queues Failed', len(failed_queues))
+        if self._configuration.deduplicator is not None:
+            self._console.write_keyvaluepair('     Duplicates', self._configuration.deduplicator.suppressed_count)
+        self._console.write_keyvaluepair('       Messages', message_count)
+        self._console.write_keyvaluepair('     Throughput', '{0:.1f} messages/second'.format(
+            message_count / elapsed_seconds if elapsed_seconds > 0 else 0.0))
+
+        if failed_queues:
+            for queue, error in sorted(failed_queues):
+                self._console.write_error('{0} failed ({1})'.format(queue, error))
+            raise RabbitMQError('{0} of {1} queues failed'.format(len(failed_queues), len(results)))
+
+        return message_count
@@ -1,8 +1,86 @@
-import json
-import requests
-import sys
-
+import threading
+
+from RabbitHole import json_codec
+from RabbitHole.adaptive_limiter import AdaptiveLimiter
+from RabbitHole.checkpoint_journal import get_message_key
+from RabbitHole.engine import ExecutionEngine
+from RabbitHole.engine import TaskGroup
+from RabbitHole.message_filter import get_message_fingerprint
+from RabbitHole.progress_reporter import ProgressReporter
 from RabbitHole.rabbitmq_message_helper import RabbitMQMessageHelper
+from RabbitHole.retry_policy import RetryPolicy
+from RabbitHole.retry_policy import can_carry_on
+from RabbitHole.transports import TransportError
+from RabbitHole.transports import create_http_transport
+from RabbitHole.transports import create_transport
+
+
+class RabbitMQError(Exception):
+    """This class represents a RabbitMQ operation that failed (the details have already been written to the console).
+    """
+    pass
+
+
+class PublishResults(object):
+    """This class represents the (thread safe) tally of a publish.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._succeeded = 0
+        self._failed = 0
+        self._skipped = 0
+        self._suppressed = 0
+        self._stopped = False
+        self._first_error = None
+
+    @property
+    def succeeded(self):
+        return self._succeeded
+
+    @property
+    def failed(self):
+        return self._failed
+
+    @property
+    def skipped(self):
+        return self._skipped
+
+    @property
+    def suppressed(self):
+        """The number of duplicate messages that weren't published.
+        """
+        return self._suppressed
+
+    @property
+    def stopped(self):
+        """True if a failure means the rest of the messages shouldn't be published.
+        """
+        return self._stopped
+
+    @property
+    def first_error(self):
+        return self._first_error
+
+    def add_success(self):
+        with self._lock:
+            self._succeeded += 1
+
+    def add_skipped(self):
+        with self._lock:
+            self._skipped += 1
+
+    def add_suppressed(self):
+        with self._lock:
+            self._suppressed += 1
+
+    def add_failure(self, error, stop=True):
+        with self._lock:
+            self._failed += 1
+            if stop:
+                self._stopped = True
+            if self._first_error is None:
+                self._first_error = error
 
 
 class RabbitMQ(object):
@@ -14,6 +92,88 @@ class RabbitMQ(object):
         self._console = console
         self._logger = logger
         self._rabbitmq_message_helper = RabbitMQMessageHelper(configuration, console, logger)
+        self._transports = {}
+        self._transports_lock = threading.Lock()
+        self._engine = None
+        self._retry_policy = RetryPolicy(configuration.max_retries,
+                                         configuration.retry_backoff,
+                                         statistics=configuration.statistics,
+                                         logger=logger)
+
+    @property
+    def engine(self):
+        """Gets the execution engine shared by everything this instance gets and publishes.
+        """
+
+        with self._transports_lock:
+            if self._engine is None:
+                self._engine = ExecutionEngine(self._configuration.publish_window,
+                                               self._configuration.preserve_order,
+                                               AdaptiveLimiter(self._configuration.publish_window,
+                                                               self._configuration.window_floor,
+                                                               self._configuration.window_ceiling))
+        return self._engine
+
+    def get_transport(self, rabbit_host_url, rabbit_host_port, rabbit_vhost, rabbit_authorization_string):
+        """Gets the (long-lived) transport for a RabbitMQ host.
+
+        :param rabbit_host_url: The RabbitMQ host URL.
+        :param rabbit_host_port: The RabbitMQ host port.
+        :param rabbit_vhost: The RabbitMQ vhost.
+        :param rabbit_authorization_string: The authorization string for the request header.
+        :return: The transport selected in the configuration.
+        """
+
+        key = (rabbit_host_url, rabbit_host_port, rabbit_vhost, rabbit_authorization_string)
+
+        with self._transports_lock:
+            if key not in self._transports:
+                self._transports[key] = create_transport(self._configuration,
+                                                         rabbit_host_url,
+                                                         rabbit_host_port,
+                                                         rabbit_vhost,
+                                                         rabbit_authorization_string)
+
+            return self._transports[key]
+
+    def get_management_transport(self, rabbit_host_url, rabbit_host_port, rabbit_vhost, rabbit_authorization_string):
+        """Gets the (long-lived) management HTTP API transport for a RabbitMQ host, whatever the configured transport.
+
+        :param rabbit_host_url: The RabbitMQ host URL (or a comma-separated list of the URLs of the cluster nodes).
+        :param rabbit_host_port: The RabbitMQ host port.
+        :param rabbit_vhost: The RabbitMQ vhost.
+        :param rabbit_authorization_string: The authorization string for the request header.
+        :return: An HttpTransport (or a ClusterTransport).
+        """
+
+        if self._configuration.transport != 'amqp':
+            return self.get_transport(rabbit_host_url, rabbit_host_port, rabbit_vhost, rabbit_authorization_string)
+
+        key = ('management', rabbit_host_url, rabbit_host_port, rabbit_vhost, rabbit_authorization_string)
+
+        with self._transports_lock:
+            if key not in self._transports:
+                self._transports[key] = create_http_transport(rabbit_host_url,
+                                                              rabbit_host_port,
+                                                              rabbit_vhost,
+                                                              rabbit_authorization_string,
+                                                              statistics=self._configuration.statistics)
+
+            return self._transports[key]
+
+    def close(self):
+        """Stops the execution engine and closes all of the transports.
+        """
+
+        if self._engine is not None:
+            self._logger.debug('The request window finished at %s', self._engine.request_window)
+            self._engine.close()
+            self._engine = None
+
+        with self._transports_lock:
+            for transport in self._transports.values():
+                transport.close()
+            self._transports = {}
 
     def build_rabbit_get_url(self, rabbit_host_url, rabbit_host_port, rabbit_vhost, message_source_queue):
         """Builds the RabbitMQ GET URL.
@@ -45,6 +205,29 @@ class RabbitMQ(object):
 
         return url
 
+    def list_queues(self, rabbit_host_url, rabbit_host_port, rabbit_vhost, rabbit_authorization_string):
+        """Lists the queues in a vhost (AMQP can't list queues so this always uses the management HTTP API).
+
+        :param rabbit_host_url: The RabbitMQ host URL.
+        :param rabbit_host_port: The RabbitMQ host port.
+        :param rabbit_vhost: The RabbitMQ vhost.
+        :param rabbit_authorization_string: The authorization string for the request header.
+        :return: A list of the queues (dictionaries with the name and number of messages of each queue).
+        """
+
+        self._console.write_update('Listing the queues...')
+
+        transport = self.get_management_transport(rabbit_host_url,
+                                                  rabbit_host_port,
+                                                  rabbit_vhost,
+                                                  rabbit_authorization_string)
+
+        try:
+            return self._retry_policy.call(self.engine.run_request, (transport.list_queues,))
+        except TransportError as err:
+            self._console.write_error('[{0}]{1}'.format(err.status_code, err.text))
+            raise RabbitMQError(str(err))
+
     def get_rabbit_messages_from_queue(self,
                                        message_count,
                                        rabbit_host_url,
@@ -69,22 +252,17 @@ class RabbitMQ(object):
 
         self._console.write_update('Getting messages from {0}...'.format(message_source_queue))
 
-        rabbit_url = self.build_rabbit_get_url(rabbit_host_url, rabbit_host_port, rabbit_vhost, message_source_queue)
+        transport = self.get_transport(rabbit_host_url, rabbit_host_port, rabbit_vhost, rabbit_authorization_string)
 
-        if requeue:
-            rabbit_request_data = {'count': message_count, 'requeue': 'true', 'encoding': 'auto'}
-        else:
-            rabbit_request_data = {'count': message_count, 'requeue': 'false', 'encoding': 'auto'}
-        rabbit_request_json = json.dumps(rabbit_request_data)
-        rabbit_request_headers = {'Content-type': 'application/json', 'Authorization': rabbit_authorization_string}
-
-        rabbit_response = requests.post(rabbit_url, data=rabbit_request_json, headers=rabbit_request_headers)
-
-        if rabbit_response.status_code != 200:
-            self._console.write_error('[{0}]{1}'.format(rabbit_response.status_code, rabbit_response.text))
-            sys.exit(1)
-
-        return rabbit_response.json()
+        try:
+            # A get that takes the messages off the queue can't be made twice if it wasn't answered (the broker may
+            # have taken them anyway)
+            return self._retry_policy.call(self.engine.run_request,
+                                           (transport.get_messages, message_source_queue, message_count, requeue),
+                                           retry_unanswered=requeue)
+        except TransportError as err:
+            self._console.write_error('[{0}]{1}'.format(err.status_code, err.text))
+            raise RabbitMQError(str(err))
 
     def publish_messages(self,
                          messages,
@@ -94,10 +272,13 @@ class RabbitMQ(object):
                          rabbit_authorization_string,
                          destination_queue=None,
                          simulate=False,
-                         verbose=False):
+                         verbose=False,
+                         progress=None,
+                         journal=None,
+                         journal_source=None):
         """Publishes (or re-publishes) messages to RabbitMQ.
 
-        :param messages: A list of the messages to publish.
+        :param messages: The messages to publish (a list or any other iterable, such as a message archive reader).
         :param rabbit_host_url: The RabbitMQ host URL.
         :param rabbit_host_port: The RabbitMQ host port.
         :param rabbit_vhost: The RabbitMQ vhost.
@@ -105,73 +286,288 @@ class RabbitMQ(object):
         :param destination_queue: The queue to publish to (if None, the messages will be re-published).
         :param simulate: If True, simulates the action.
         :param verbose: If True, enable verbose output.
+        :param progress: The progress reporter to add to (if None, the progress of this publish is reported on its own).
+        :param journal: The checkpoint journal to skip already published messages with and record the rest in (if any).
+        :param journal_source: The file the messages came from (they're journalled by ID if None).
+        :return: The number of messages published.
+        """
+
+        # Lists tell us how many messages there are but a stream of messages won't
+        message_total = len(messages) if hasattr(messages, '__len__') else None
+
+        if message_total == 0:
+            self._console.write_update('No messages to process!')
+            return
+
+        if destination_queue:
+            self._logger.debug('The destination queue was supplied.')
+            routed_messages = ((destination_queue, message) for message in messages)
+            description = 'Publishing to {0}'.format(destination_queue)
+        else:
+            self._logger.debug('The destination queue was NOT supplied. Determining it for each message.')
+            routed_messages = ((self._rabbitmq_message_helper.get_source_queue(message), message)
+                               for message in messages)
+            description = 'Publishing to the source queues'
+
+        if journal is not None:
+            routed_messages = self._add_journal_keys(routed_messages, journal_source)
+
+        transport = self.get_transport(rabbit_host_url, rabbit_host_port, rabbit_vhost, rabbit_authorization_string)
+
+        if progress is not None:
+            return self._publish_routed_messages(routed_messages, transport, simulate, progress, journal)
+
+        with ProgressReporter(self._console, description, message_total, simulate) as progress:
+            return self._publish_routed_messages(routed_messages, transport, simulate, progress, journal)
+
+    def publish_message_groups(self,
+                               message_groups,
+                               rabbit_host_url,
+                               rabbit_host_port,
+                               rabbit_vhost,
+                               rabbit_authorization_string,
+                               simulate=False,
+                               verbose=False,
+                               journal=None):
+        """Publishes groups of messages to their destinations, with every group streaming at the same time.
+
+        :param message_groups: A dictionary of the destination queues and the list of messages to publish to each.
+        :param rabbit_host_url: The RabbitMQ host URL.
+        :param rabbit_host_port: The RabbitMQ host port.
+        :param rabbit_vhost: The RabbitMQ vhost.
+        :param rabbit_authorization_string: The authorization string for the request header.
+        :param simulate: If True, simulates the action.
+        :param verbose: If True, enable verbose output.
+        :param journal: The checkpoint journal to skip already published messages with and record the rest in (if any).
         :return: The number of messages published.
         """
 
-        if not messages:
+        message_total = sum(len(messages) for messages in message_groups.values())
+
+        if message_total == 0:
             self._console.write_update('No messages to process!')
             return
 
-        rabbit_request_headers = {'Content-type': 'application/json', 'Authorization': rabbit_authorization_string}
+        transport = self.get_transport(rabbit_host_url, rabbit_host_port, rabbit_vhost, rabbit_authorization_string)
+
+        description = 'Publishing to {0} queues'.format(len(message_groups))
+
+        routed_messages = self._interleave_message_groups(message_groups)
+        if journal is not None:
+            routed_messages = self._add_journal_keys(routed_messages)
+
+        with ProgressReporter(self._console, description, message_total, simulate) as progress:
+            return self._publish_routed_messages(routed_messages, transport, simulate, progress, journal)
+
+    @staticmethod
+    def _add_journal_keys(routed_messages, journal_source=None):
+        """Adds the key each message is journalled under.
+
+        :param routed_messages: The (destination queue, message) pairs.
+        :param journal_source: The file the messages came from (they're journalled by ID if None).
+        :return: A generator of (destination queue, message, journal key) triples.
+        """
+
+        for number, (destination_queue, message) in enumerate(routed_messages, 1):
+            yield destination_queue, message, get_message_key(message, journal_source, number)
+
+    @staticmethod
+    def _interleave_message_groups(message_groups):
+        """Takes a message from each group in turn so no destination waits for the others to finish.
+
+        :param message_groups: A dictionary of the destination queues and their messages.
+        :return: A generator of (destination queue, message) pairs.
+        """
+
+        streams = [(destination_queue, iter(messages)) for destination_queue, messages in message_groups.items()]
+
+        while streams:
+            remaining_streams = []
+            for destination_queue, stream in streams:
+                for message in stream:
+                    yield destination_queue, message
+                    remaining_streams.append((destination_queue, stream))
+                    break
+            streams = remaining_streams
+
+    def filter_taken_messages(self,
+                              messages,
+                              message_filter,
+                              rabbit_host_url,
+                              rabbit_host_port,
+                              rabbit_vhost,
+                              rabbit_authorization_string,
+                              message_source_queue,
+                              returned_fingerprints,
+                              simulate=False):
+        """Puts the messages taken off a queue that don't match a filter back on the queue (just as they were).
+
+        :param messages: The messages taken off the queue.
+        :param message_filter: The MessageFilter.
+        :param rabbit_host_url: The RabbitMQ host URL.
+        :param rabbit_host_port: The RabbitMQ host port.
+        :param rabbit_vhost: The RabbitMQ vhost.
+        :param rabbit_authorization_string: The authorization string for the request header.
+        :param message_source_queue: The name of the queue the messages were taken off.
+        :param returned_fingerprints: The fingerprints of the messages put back so far in the run (added to).
+        :param simulate: If True, the messages were left on the queue so nothing is put back.
+        :return: A (matching messages, came round) tuple, where came round is True if a message that was put back
+                 earlier in the run was taken off the queue again (so the whole queue has been looked at).
+        """
+
+        matching_messages = []
+        unmatched_messages = []
+        came_round = False
+
+        for message in messages:
+            if message_filter.matches(message):
+                matching_messages.append(message)
+                continue
+
+            fingerprint = get_message_fingerprint(message)
+            if fingerprint in returned_fingerprints:
+                came_round = True
+            returned_fingerprints.add(fingerprint)
+            unmatched_messages.append(message)
+
+        if unmatched_messages and not simulate:
+            transport = self.get_transport(rabbit_host_url, rabbit_host_port, rabbit_vhost, rabbit_authorization_string)
+            with ProgressReporter(self._console,
+                                  'Returning to {0}'.format(message_source_queue),
+                                  len(unmatched_messages)) as progress:
+                self._publish_routed_messages(((message_source_queue, message) for message in unmatched_messages),
+                                              transport,
+                                              simulate,
+                                              progress,
+                                              scrub=False)
+
+        return matching_messages, came_round
+
+    def _publish_routed_messages(self, routed_messages, transport, simulate, progress, journal=None, scrub=True):
+        """Publishes messages that know where they're going on the execution engine.
+
+        :param routed_messages: The (destination queue, message) pairs to publish (or (destination queue, message,
+                                journal key) triples when there's a journal).
+        :param transport: The transport to publish with.
+        :param simulate: If True, simulates the action.
+        :param progress: The progress reporter to add the published messages to.
+        :param journal: The checkpoint journal (if any).
+        :param scrub: If False, the messages are published just as they are.
+        :return: The number of messages published.
+        """
 
+        results = PublishResults()
+        group = TaskGroup()
         processed_messages = 0
+        # Messages that are put back as they were aren't deduplicated either
+        deduplicator = self._configuration.deduplicator if scrub else None
 
-        with requests.Session() as session:
-            # pool_connections is the number of connection pools to cache (default 10)
-            # pool_maxsize is the maximum number of connections to save in the pool (default 10)
-            # adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=10)
-            # session.mount('http://', adapter)
+        try:
+            for routed_message in routed_messages:
+                destination_queue, message = routed_message[:2]
+                journal_key = routed_message[2] if journal is not None else None
 
-            for message in messages:
+                if results.stopped:
+                    # Something went wrong so stop handing out work (what's in flight will finish)
+                    break
 
                 processed_messages += 1
 
-                if not destination_queue:
-                    self._logger.debug('The destination queue was NOT supplied. Attempting to determine it.')
-                    destination_queue = self._rabbitmq_message_helper.get_source_queue(message)
-                else:
-                    self._logger.debug('The destination queue was supplied.')
+                if journal is not None and journal.is_committed(journal_key):
+                    results.add_skipped()
+                    progress.add()
+                    continue
 
                 if not destination_queue:
                     self._console.write_error('Unable to determine the destination queue!')
                     self._console.write_hint('Does the message contain any of these fields?')
                     for field in self._configuration.source_queue_fields:
                         self._console.write_hint('- {0}'.format(field))
-                    sys.exit(1)
+                    raise RabbitMQError('Unable to determine the destination queue')
 
-                rabbit_url = self.build_rabbit_publish_url(rabbit_host_url,
-                                                           rabbit_host_port,
-                                                           rabbit_vhost,
-                                                           destination_queue)
+                if scrub:
+                    self._logger.debug('Scrubbing %s from %s', self._configuration.fields_to_remove, message)
+                    message = self._rabbitmq_message_helper.scrub_message(message,
+                                                                          self._configuration.fields_to_remove)
 
-                if len(messages) > 1:
-                    self._console.write_update(
-                        '{0} of {1} - Publishing message to {2}'.format(processed_messages, len(messages), destination_queue))
+                if deduplicator is not None and deduplicator.is_duplicate(destination_queue, message):
+                    # A copy has already been published (journalled so a resumed run doesn't look at it again)
+                    results.add_suppressed()
+                    progress.add()
+                    if journal is not None:
+                        journal.commit(journal_key)
+                    continue
+
+                if simulate:
+                    results.add_success()
+                    progress.add()
                 else:
-                    self._console.write_update('Publishing message to {0}'.format(destination_queue))
+                    self.engine.submit_publish(group, self._publish_message, transport, destination_queue, message,
+                                               results, progress, journal, journal_key, lane=destination_queue)
+        finally:
+            # Never leave publishes running behind the caller's back
+            group.wait()
 
-                self._logger.debug('Scrubbing {0} from {1}'.format(self._configuration.fields_to_remove, message))
-                message = self._rabbitmq_message_helper.scrub_message(message, self._configuration.fields_to_remove)
+        for error in group.errors:
+            results.add_failure(TransportError(None, error))
 
-                json_message = json.dumps(message)
+        if not processed_messages:
+            self._console.write_update('No messages to process!')
 
-                if simulate:
-                    self._console.write_simulated_update('[200] Success!')
-                else:
-                    rabbit_response = session.post(rabbit_url, data=json_message, headers=rabbit_request_headers)
+        if results.skipped:
+            self._console.write_update('Skipped {0} messages that were already published'.format(results.skipped))
+
+        if results.suppressed:
+            self._console.write_update('Suppressed {0} duplicate messages'.format(results.suppressed))
+            if deduplicator.over_capacity:
+                self._console.write_hint('More than {0} unique messages were published, so a few of the suppressed '
+                                         'messages may not be duplicates (raise DedupCapacity)'.format(
+                                             deduplicator.capacity))
+
+        if results.failed:
+            error = results.first_error
+            self._console.write_update('The RabbitMQ response was {0}'.format(error.status_code))
+            self._console.write_error('[{0}]{1}'.format(error.status_code, error.text))
+            self._console.write_error('{0} messages were published and {1} failed'.format(results.succeeded,
+                                                                                          results.failed))
+            if results.stopped:
+                self._console.write_error('The run was stopped before every message was published')
+            if self._configuration.dead_letters.count:
+                self._console.write_hint('The failed messages were saved to {0} (use the queue command to publish '
+                                         'them - a resumed run leaves them out)'.format(
+                                             self._configuration.dead_letters.file_name))
+            raise RabbitMQError(str(error))
+
+        return results.succeeded
+
+    def _publish_message(self, transport, destination_queue, message, results, progress, journal=None, journal_key=None):
+        """Publishes a single message (on a publisher thread).
+        """
+
+        try:
+            self._retry_policy.call(self.engine.run_request, (transport.publish_message, destination_queue, message))
+        except TransportError as err:
+            # The message is set aside and the run carries on (unless no other message would get through either or
+            # too many have failed)
+            dead_letter_count = self._configuration.dead_letters.add(message)
+            if journal is not None:
+                # The dead-letter file is the way to publish it now, so a resumed run mustn't publish it again
+                journal.commit(journal_key)
+            results.add_failure(err, not can_carry_on(err) or dead_letter_count > self._configuration.error_budget)
+            # A failed message has still been dealt with, so the progress (and its ETA) gets to the total
+            progress.add()
+            return
 
-                    if rabbit_response.status_code != 200:
-                        self._console.write_update('The RabbitMQ response was {0}'.format(rabbit_response.status_code))
-                        self._console.write_error('[{0}]{1}'.format(rabbit_response.status_code, rabbit_response.text))
-                        sys.exit(1)
-                    else:
-                        self._console.write_update('[{0}] Success!'.format(rabbit_response.status_code))
+        if journal is not None:
+            # Only once RabbitMQ has it
+            journal.commit(journal_key)
 
-        return processed_messages
+        results.add_success()
+        progress.add()
 
     def is_json(self, message):
         try:
-            json_object = json.loads(message)
+            json_object = json_codec.loads(message)
         except ValueError, e:
             return False
         return True
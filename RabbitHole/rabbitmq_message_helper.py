@@ -1,6 +1,21 @@
-import json
 import re
 import os.path
+from timeit import default_timer as timer
+
+from RabbitHole.checkpoint_journal import CheckpointJournal
+from RabbitHole.message_archive import COMPRESSION_EXTENSIONS
+from RabbitHole.message_archive import check_archive_can_be_added_to
+from RabbitHole.message_archive import MessageArchiveRangeReader
+from RabbitHole.message_archive import MessageArchiveReader
+from RabbitHole.message_archive import MessageArchiveWriter
+from RabbitHole.message_archive import split_message_archive
+from RabbitHole.message_archive import train_compression_dictionary
+from RabbitHole.message_archive_index import IndexedMessageArchiveReader
+from RabbitHole.message_file_discovery import find_message_files
+from RabbitHole.progress_reporter import ProgressReporter
+from RabbitHole.run_statistics import RunStatistics
+from RabbitHole.scrub_plan import ScrubPlan
+from RabbitHole.source_queue_resolver import SourceQueueResolver
 
 
 class RabbitMQMessageHelper(object):
@@ -11,13 +26,28 @@ class RabbitMQMessageHelper(object):
         self._configuration = configuration
         self._console = console
         self._logger = logger
-
-    def save_rabbit_messages_to_file(self, messages, save_file, simulate=False):
+        self._scrub_plans = {}
+        self._source_queue_resolvers = {}
+        self._path_keys = {}
+        self._statistics = configuration.statistics if configuration is not None else RunStatistics(enabled=False)
+
+    def save_rabbit_messages_to_file(self,
+                                     messages,
+                                     save_file,
+                                     simulate=False,
+                                     archive_format='json',
+                                     compression='none',
+                                     compression_dictionary=None,
+                                     index=False):
         """Saves RabbitMQ messages to a file in JSON format.
 
         :param messages: The messages to save.
         :param save_file: The name of the file to save the messages to.
         :param simulate: If True, simulates the action.
+        :param archive_format: The format of the file (json or ndjson).
+        :param compression: The compression of the file (none, gzip or zstd).
+        :param compression_dictionary: The zstd dictionary file (trained on the messages if it doesn't exist).
+        :param index: If True, writes an index next to the file (ndjson only).
         :return:
         """
 
@@ -25,29 +55,130 @@ class RabbitMQMessageHelper(object):
             self._console.write_simulated_update('Saving messages to {0}'.format(save_file))
         else:
             if messages:
-                with open(save_file, 'w') as file_to_save:
-                    if len(messages) > 1:
-                        file_to_save.write('[')
-                    saved_count = 0
-                    for message in messages:
-                        self._console.write_update('Saving message {0} of {1} to {2}'.format(saved_count + 1, len(messages), save_file))
-                        file_to_save.write(json.dumps(message, indent=2))
-                        saved_count += 1
-                        if saved_count < len(messages):
-                            file_to_save.write(',\n')
-                    if len(messages) > 1:
-                        file_to_save.write(']')
+                compression_dictionary = self._get_compression_dictionary(messages, compression, compression_dictionary)
+                try:
+                    with MessageArchiveWriter(save_file,
+                                              archive_format,
+                                              compression=compression,
+                                              compression_dictionary=compression_dictionary,
+                                              index=index) as archive, \
+                            ProgressReporter(self._console, 'Saving to {0}'.format(save_file), len(messages)) as progress:
+                        for message in messages:
+                            start = timer()
+                            archive.write(message)
+                            self._statistics.record('file_write', timer() - start)
+                            progress.add()
+                        self._flush_archive(archive)
+                except (IOError, ValueError) as err:
+                    self._console.write_error(err)
+                    raise IOError(str(err))
 
             else:
                 self._console.write_error('No messages found!')
 
-    def get_rabbit_messages_from_file(self, message_file_name, simulate=False, verbose=False):
-        """Gets messages from a JSON file.
+    def append_rabbit_messages_to_file(self,
+                                       messages,
+                                       save_file,
+                                       simulate=False,
+                                       archive_format='json',
+                                       compression='none',
+                                       compression_dictionary=None,
+                                       index=False):
+        """Appends RabbitMQ messages to a file and makes sure they are on the disk before returning.
+
+        The file is always left holding a complete archive so an interrupted run keeps everything written so far.
 
-        :param message_file_name: The full path and name of the JSON file containing the message.
+        :param messages: The messages to append.
+        :param save_file: The name of the file to append the messages to.
+        :param simulate: If True, simulates the action.
+        :param archive_format: The format of the file (json or ndjson).
+        :param compression: The compression of the file (none, gzip or zstd).
+        :param compression_dictionary: The zstd dictionary file (trained on the messages if it doesn't exist).
+        :param index: If True, adds the messages to the index next to the file (ndjson only).
+        :return: The number of messages appended.
+        """
+
+        if simulate:
+            self._console.write_simulated_update('Appending {0} messages to {1}'.format(len(messages), save_file))
+            return len(messages)
+
+        if not messages:
+            return 0
+
+        compression_dictionary = self._get_compression_dictionary(messages, compression, compression_dictionary)
+
+        try:
+            with MessageArchiveWriter(save_file,
+                                      archive_format,
+                                      append=True,
+                                      compression=compression,
+                                      compression_dictionary=compression_dictionary,
+                                      index=index) as archive:
+                for message in messages:
+                    start = timer()
+                    archive.write(message)
+                    self._statistics.record('file_write', timer() - start)
+                self._flush_archive(archive, durable=True)
+        except (IOError, ValueError) as err:
+            self._console.write_error(err)
+            raise IOError(str(err))
+
+        self._console.write_update('Saved {0} messages to {1}'.format(len(messages), save_file))
+
+        return len(messages)
+
+    def check_rabbit_message_file_can_be_appended_to(self,
+                                                     save_file,
+                                                     append=False,
+                                                     archive_format='json',
+                                                     compression='none',
+                                                     index=False):
+        """Checks that messages can be appended to a file (before any are taken off a queue).
+
+        :param save_file: The name of the file the messages will be appended to.
+        :param append: If True, the messages are meant to be added to what's already in the file.
+        :param archive_format: The format of the file (json or ndjson).
+        :param compression: The compression of the file (none, gzip or zstd).
+        :param index: If True, the messages will be added to the index next to the file (ndjson only).
+        :raises IOError: If the file already has messages in it and they weren't meant to be added to (or can't be).
+        """
+
+        if not os.path.isfile(save_file) or not os.path.getsize(save_file):
+            return
+
+        if not append:
+            self._console.write_error('{0} already exists!'.format(save_file))
+            self._console.write_hint('Use --append to add the messages to it (or pick another save file)')
+            raise IOError('{0} already exists'.format(save_file))
+
+        try:
+            check_archive_can_be_added_to(save_file, archive_format, compression, index)
+        except IOError as err:
+            self._console.write_error(err)
+            raise
+
+    def get_rabbit_messages_from_file(self,
+                                      message_file_name,
+                                      simulate=False,
+                                      verbose=False,
+                                      compression_dictionary=None,
+                                      first_message=None,
+                                      last_message=None,
+                                      message_ids=None):
+        """Gets messages from a message archive.
+
+        The messages are read one at a time as the result is iterated. Compressed archives are recognised by their first
+        few bytes and decompressed as they're read. Selecting messages (by number or ID) needs an indexed archive, and
+        only the selected messages are read.
+
+        :param message_file_name: The full path and name of the file containing the messages.
         :param simulate: If True, simulates the action.
         :param verbose: If True, enable verbose output.
-        :return: The message contained in the file.
+        :param compression_dictionary: The zstd dictionary file the archive was compressed with (if any).
+        :param first_message: The number of the first message to get (counting from 1).
+        :param last_message: The number of the last message to get.
+        :param message_ids: The IDs of the messages to get.
+        :return: A generator of the messages contained in the file.
         """
 
         if simulate:
@@ -55,75 +186,273 @@ class RabbitMQMessageHelper(object):
         else:
             self._console.write_update('Getting messages from {0}'.format(message_file_name))
 
-            if not os.path.isfile(message_file_name):
-                self._console.write_error('{0} not found!'.format(message_file_name))
-                raise IOError()
+        if not os.path.isfile(message_file_name):
+            self._console.write_error('{0} not found!'.format(message_file_name))
+            raise IOError()
+
+        if first_message is not None or last_message is not None or message_ids:
+            reader = IndexedMessageArchiveReader(message_file_name, first_message, last_message, message_ids)
+        else:
+            reader = MessageArchiveReader(message_file_name, compression_dictionary)
+
+        return self._read_rabbit_messages_from_file(reader)
+
+    def get_rabbit_message_file_ranges(self, message_file_name, range_size):
+        """Splits a message archive into byte ranges that can be read at the same time.
+
+        :param message_file_name: The full path and name of the file containing the messages.
+        :param range_size: The size of each range in bytes.
+        :return: The list of (start, end) byte ranges (or None if the archive can't be split).
+        """
+
+        if not os.path.isfile(message_file_name):
+            self._console.write_error('{0} not found!'.format(message_file_name))
+            raise IOError()
+
+        return split_message_archive(message_file_name, range_size)
 
+    def get_rabbit_messages_from_file_range(self, message_file_name, start, end):
+        """Gets the messages in a byte range of a message archive (see get_rabbit_message_file_ranges).
+
+        :param message_file_name: The full path and name of the file containing the messages.
+        :param start: The byte offset of the first message in the range.
+        :param end: The byte offset of the end of the range.
+        :return: A generator of the messages in the range.
+        """
+
+        return self._read_rabbit_messages_from_file(MessageArchiveRangeReader(message_file_name, start, end))
+
+    def _flush_archive(self, archive, durable=False):
+        start = timer()
+        archive.flush(durable)
+        # The bytes are counted once for the whole archive
+        self._statistics.record('file_write', timer() - start, archive.bytes_written, 0)
+
+    def _get_compression_dictionary(self, messages, compression, compression_dictionary):
+        """Gets the zstd dictionary file to compress with (training it on the messages if it doesn't exist yet).
+
+        :return: The dictionary file (or None if there isn't one).
+        """
+
+        if compression != 'zstd' or not compression_dictionary:
+            return None
+
+        if not os.path.isfile(compression_dictionary):
             try:
-                with open(message_file_name) as json_data:
-                    d = json.load(json_data)
-                    self._logger.debug('Read {0} messages from {1}'.format(len(d), message_file_name))
-                    # return [d]
-                    return d
-            except:
+                train_compression_dictionary(messages, compression_dictionary)
+            except ValueError as err:
+                self._console.write_hint('{0} - compressing without a dictionary'.format(err))
                 return None
+            self._console.write_hint('Trained a compression dictionary and saved it to {0} (you\'ll need it to read '
+                                     'the messages back)'.format(compression_dictionary))
+
+        return compression_dictionary
+
+    def _read_rabbit_messages_from_file(self, reader):
+        message_file_name = reader.file_name
+        message_count = 0
+        messages = iter(reader)
+
+        while True:
+            start = timer()
+            try:
+                message = next(messages)
+            except StopIteration:
+                break
+            except (ValueError, IOError) as err:
+                self._console.write_error('{0} is not a valid message file! ({1})'.format(message_file_name, err))
+                raise IOError('{0} is not a valid message file'.format(message_file_name))
+            self._statistics.record('file_read', timer() - start)
+
+            message_count += 1
+            yield message
+
+        if isinstance(reader, IndexedMessageArchiveReader):
+            # Only the selected messages were read
+            self._statistics.record('file_read', 0.0, reader.bytes_read, 0)
+            if reader.missing_message_ids:
+                self._console.write_error('{0} of the message IDs were not found in {1}: {2}'.format(
+                    len(reader.missing_message_ids), message_file_name, ', '.join(reader.missing_message_ids)))
+        elif isinstance(reader, MessageArchiveRangeReader):
+            # Only the range was read
+            self._statistics.record('file_read', 0.0, reader.size, 0)
+        else:
+            # The bytes are counted once for the whole archive
+            self._statistics.record('file_read', 0.0, os.path.getsize(message_file_name), 0)
+
+        self._logger.debug('Read %s messages from %s', message_count, message_file_name)
+
+    def get_queue_save_file(self, save_file, queue, archive_format='json', compression='none'):
+        """Gets the file a queue is saved to when several queues are snagged in a single run.
+
+        :param save_file: A file name containing {queue} or the folder to save a file per queue in.
+        :param queue: The name of the queue.
+        :param archive_format: The format of the file (json or ndjson).
+        :param compression: The compression of the file (none, gzip or zstd).
+        :return: The name of the file.
+        """
+
+        safe_queue = self.get_safe_file_name(queue)
+
+        if '{queue}' in save_file:
+            return save_file.replace('{queue}', safe_queue)
+
+        return os.path.join(save_file, safe_queue + '.' + archive_format + COMPRESSION_EXTENSIONS[compression])
+
+    def get_safe_file_name(self, name):
+        """Gets a file name from a queue or run name (anything but letters, digits, dots and dashes is replaced).
+
+        :param name: The name.
+        :return: The file name.
+        """
+
+        return re.sub(r'[^\w.-]', '_', name)
+
+    def open_checkpoint_journal(self, run_name):
+        """Opens the checkpoint journal of a queue or replay run (picking up where an interrupted run left off when
+        resuming).
+
+        :param run_name: The name of the run (such as replay-FooQueue), which the journal file is named after.
+        :return: The journal (or None when simulating, since nothing is published).
+        """
+
+        if self._configuration.simulate:
+            return None
+
+        journal_file = os.path.join(self._configuration.journal_folder, self.get_safe_file_name(run_name) + '.journal')
+
+        try:
+            journal = CheckpointJournal(journal_file, self._configuration.resume)
+        except ValueError:
+            self._console.write_error('{0} holds the progress of an interrupted run!'.format(journal_file))
+            self._console.write_hint('Use --resume to finish that run (or delete the file to start again)')
+            raise IOError('{0} holds the progress of an interrupted run'.format(journal_file))
+        except IOError as err:
+            self._console.write_error('Unable to open {0} ({1})'.format(journal_file, err))
+            raise
+
+        if journal.resumed_count:
+            self._console.write_update('Resuming: {0} messages were already published'.format(journal.resumed_count))
+
+        return journal
+
+    def close_checkpoint_journal(self, journal, completed):
+        """Closes the checkpoint journal of a run (deleting it if the run completed).
+
+        :param journal: The journal (or None).
+        :param completed: If True, the run published everything.
+        """
+
+        if journal is None:
+            return
+
+        journal.close(completed)
+
+        if not completed:
+            self._console.write_hint('Use --resume to finish the run without publishing anything twice')
 
     def get_rabbit_message_files_in_folder(self, folder_name):
         """Gets messages from a folder.
         :param folder_name: The name of the folder to search.
-        :return: The list of files.
+        :return: The list of files (largest first).
+        """
+
+        message_files = list(self.find_rabbit_message_files(folder_name))
+        message_files.sort(key=lambda (file_name, size): -size)
+
+        return [file_name for file_name, size in message_files]
+
+    def find_rabbit_message_files(self, folder_name):
+        """Finds the message files in a folder as it's searched (with the configured patterns and recursion).
+
+        :param folder_name: The name of the folder to search.
+        :return: A generator of (file name, size in bytes) tuples.
         """
 
-        files = os.listdir(folder_name)
+        return find_message_files(folder_name,
+                                  self._configuration.include_files,
+                                  self._configuration.exclude_files,
+                                  self._configuration.recursive)
+
+    def filter_messages(self, messages, message_filter):
+        """Picks out the messages that match a filter.
 
-        all_files = []
+        :param messages: The messages.
+        :param message_filter: The MessageFilter (or None to keep every message).
+        :return: A list of the matching messages.
+        """
 
-        for f in files:
-            all_files.append(os.path.join(folder_name, f))
+        if message_filter is None:
+            return messages
 
-        return all_files
+        matching_messages = [message for message in messages if message_filter.matches(message)]
+
+        if len(matching_messages) < len(messages):
+            self._console.write_update('Skipped {0} messages that don\'t match --where'.format(
+                len(messages) - len(matching_messages)))
+
+        return matching_messages
 
     def get_source_queue(self, message):
         """Gets the source queue from a message.
 
-        :param message: The message as a JSON string.
+        :param message: The message.
         :return: The name of the source queue.
         """
 
-        source_queue = None
-
-        for source_queue_field in self._configuration.source_queue_fields:
+        start = timer()
+        source_queue = self.get_source_queue_resolver(self._configuration.source_queue_fields).resolve(message)
+        self._statistics.record('resolve', timer() - start)
 
-            source_queue_matches = self.get_dictionary_field_values(message, source_queue_field)
-            if source_queue_matches and len(source_queue_matches) > 0:
-                source_queue = source_queue_matches[0]
-                self._logger.debug('Determined the source queue to be {0}'.format(source_queue))
-                pass
+        self._logger.debug('Determined the source queue to be %s', source_queue)
 
         return source_queue
 
+    def get_source_queue_resolver(self, source_queue_fields):
+        """Gets the resolver for a list of source queue fields (compiling it the first time).
+
+        :param source_queue_fields: The fields that can hold the source queue, highest priority first.
+        :return: The source queue resolver.
+        """
+
+        key = tuple(source_queue_fields)
+
+        source_queue_resolver = self._source_queue_resolvers.get(key)
+        if source_queue_resolver is None:
+            source_queue_resolver = SourceQueueResolver(key)
+            self._source_queue_resolvers[key] = source_queue_resolver
+
+        return source_queue_resolver
+
     def scrub_message(self, message, elements_to_delete):
         """Scrubs the unnecessary header information out of a RabbitMQ message.
 
         :param message: The RabbitMQ message in JSON format.
-        :param elements_to_delete: A list of keys identifying the elements to delete.
+        :param elements_to_delete: A list of keys (or exact paths) identifying the elements to delete.
         :return: The scrubbed message.
         """
 
-        # NOTE: This whole function is really nothing more than a generic way to remove keys from a dictionary.
+        start = timer()
+        message = self.get_scrub_plan(elements_to_delete).scrub(message)
+        self._statistics.record('scrub', timer() - start)
 
-        for element_to_delete in elements_to_delete:
+        return message
 
-            try:
-                del message[element_to_delete]
-            except KeyError:
-                pass
+    def get_scrub_plan(self, elements_to_delete):
+        """Gets the compiled scrub plan for a list of elements to delete (compiling it the first time).
 
-        for value in message.values():
-            if isinstance(value, dict):
-                self.scrub_message(value, elements_to_delete)
+        :param elements_to_delete: A list of keys (or exact paths) identifying the elements to delete.
+        :return: The scrub plan.
+        """
 
-        return message
+        key = tuple(elements_to_delete)
+
+        scrub_plan = self._scrub_plans.get(key)
+        if scrub_plan is None:
+            scrub_plan = ScrubPlan(key)
+            self._scrub_plans[key] = scrub_plan
+
+        return scrub_plan
 
     def get_dictionary_field_values(self, search_dict, field):
         """Gets a list of dictionary field values from a nested dictionary.
@@ -161,9 +490,15 @@ class RabbitMQMessageHelper(object):
         :param path: The path to search (ex: 'Field1.Field2.Field3').
         """
 
+        # Paths are split once rather than on every call
+        keys = self._path_keys.get(path)
+        if keys is None:
+            keys = tuple(p or int(i) for i, p in re.findall(r'(\d+)|(\w+)', path))
+            self._path_keys[path] = keys
+
         try:
-            for i, p in re.findall(r'(\d+)|(\w+)', path):
-                dct = dct[p or int(i)]
+            for key in keys:
+                dct = dct[key]
             return dct
         except KeyError:
             return None
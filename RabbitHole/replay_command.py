@@ -1,4 +1,10 @@
+from collections import OrderedDict
+
+from RabbitHole.queue_sweep import QueueSweep
+from RabbitHole.queue_sweep import create_queue_selector
+from RabbitHole.rabbitmq_message_helper import RabbitMQMessageHelper
 from RabbitHole.rabbitmq import RabbitMQ
+from RabbitHole.rabbitmq import RabbitMQError
 
 
 class ReplayCommand(object):
@@ -9,6 +15,7 @@ class ReplayCommand(object):
         self._configuration = configuration
         self._console = console
         self._logger = logger
+        self._rabbitmq_message_helper = RabbitMQMessageHelper(configuration, console, logger)
         self._rabbitmq = RabbitMQ(configuration, console, logger)
 
     def execute(self):
@@ -17,28 +24,105 @@ class ReplayCommand(object):
         :return:
         """
 
+        queue_selector = create_queue_selector(self._configuration.command_line_arguments)
+
         if self._configuration.verbose:
             self._console.write_keyvaluepair('    Message Count',
                                              self._configuration.command_line_arguments.message_count)
             self._console.write_keyvaluepair('     Source Queue',
-                                             self._configuration.command_line_arguments.message_source_queue)
+                                             self._configuration.command_line_arguments.message_source_queue or
+                                             queue_selector.pattern)
             self._console.write_divider()
 
-        messages = self._rabbitmq.get_rabbit_messages_from_queue(
+        if queue_selector is not None:
+            QueueSweep(self._configuration, self._console, self._logger).run(queue_selector,
+                                                                             'Replayed',
+                                                                             self._replay_queue)
+            return
+
+        try:
+            self._replay_queue(self._configuration.command_line_arguments.message_source_queue,
+                               self._rabbitmq,
+                               self._rabbitmq_message_helper,
+                               self._configuration.verbose)
+        finally:
+            self._rabbitmq.close()
+
+    def _replay_queue(self, message_source_queue, rabbitmq, rabbitmq_message_helper, verbose=False):
+        """Returns the messages in a queue to their source queues.
+
+        :param message_source_queue: The name of the queue.
+        :param rabbitmq: The RabbitMQ to get and publish the messages with.
+        :param rabbitmq_message_helper: The message helper to find the source queues with.
+        :param verbose: If True, writes the number of messages going back to each source queue.
+        :return: The number of messages replayed.
+        """
+
+        messages = rabbitmq.get_rabbit_messages_from_queue(
             self._configuration.command_line_arguments.message_count,
             self._configuration.rabbit_host_url,
             self._configuration.rabbit_host_port,
             self._configuration.rabbit_vhost,
-            self._configuration.command_line_arguments.message_source_queue,
+            message_source_queue,
             self._configuration.rabbit_authorization_string,
             True,
             self._configuration.verbose)
 
-        self._rabbitmq.publish_messages(messages,
-                                        self._configuration.rabbit_host_url,
-                                        self._configuration.rabbit_host_port,
-                                        self._configuration.rabbit_vhost,
-                                        self._configuration.rabbit_authorization_string,
-                                        None, # Luuuuke... use the source queue
-                                        self._configuration.simulate,
-                                        self._configuration.verbose)
+        # The messages stay on the queue, so the ones that don't match are simply never replayed
+        messages = rabbitmq_message_helper.filter_messages(messages, self._configuration.message_filter)
+
+        message_groups = self._group_messages_by_source_queue(messages, rabbitmq_message_helper, verbose)
+
+        # The messages stay on the queue, so a resumed replay gets them all again and skips the ones it published
+        try:
+            journal = rabbitmq_message_helper.open_checkpoint_journal('replay-{0}'.format(message_source_queue))
+        except IOError as err:
+            # The details have already been written to the console
+            raise RabbitMQError(str(err))
+
+        completed = False
+
+        try:
+            message_count = rabbitmq.publish_message_groups(message_groups,
+                                                            self._configuration.rabbit_host_url,
+                                                            self._configuration.rabbit_host_port,
+                                                            self._configuration.rabbit_vhost,
+                                                            self._configuration.rabbit_authorization_string,
+                                                            self._configuration.simulate,
+                                                            self._configuration.verbose,
+                                                            journal)
+            completed = True
+        finally:
+            rabbitmq_message_helper.close_checkpoint_journal(journal, completed)
+
+        return message_count
+
+    def _group_messages_by_source_queue(self, messages, rabbitmq_message_helper, verbose=False):
+        """Groups messages by the queue they came from (which is where they'll be replayed to).
+
+        :param messages: The messages.
+        :param rabbitmq_message_helper: The message helper to find the source queues with.
+        :param verbose: If True, writes the number of messages in each group.
+        :return: An ordered dictionary of the source queues and their messages.
+        """
+
+        message_groups = OrderedDict()
+
+        for message in messages:
+            source_queue = rabbitmq_message_helper.get_source_queue(message)
+
+            if not source_queue:
+                self._console.write_error('Unable to determine the destination queue!')
+                self._console.write_hint('Does the message contain any of these fields?')
+                for field in self._configuration.source_queue_fields:
+                    self._console.write_hint('- {0}'.format(field))
+                raise RabbitMQError('Unable to determine the destination queue')
+
+            message_groups.setdefault(source_queue, []).append(message)
+
+        if verbose:
+            for source_queue, source_queue_messages in message_groups.items():
+                self._console.write_keyvaluepair(source_queue, len(source_queue_messages))
+            self._console.write_divider()
+
+        return message_groups
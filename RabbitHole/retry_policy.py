@@ -0,0 +1,103 @@
+import random
+import time
+
+from RabbitHole.run_statistics import RunStatistics
+from RabbitHole.transports import TransportError
+
+# The responses worth trying again: the broker (or something in front of it) is briefly unable to help
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+# The responses that mean the broker refused the message itself (so the rest of the run can carry on without it)
+REJECTED_STATUS_CODES = (400, 413)
+
+# The longest wait (in seconds) between two attempts
+MAX_BACKOFF = 10.0
+
+
+class RetryPolicy(object):
+    """This class represents how failed RabbitMQ requests are tried again.
+
+    A request that fails for a reason that could go away (a dropped connection or a retryable status code) is tried
+    again after an exponential backoff with full jitter, so the threads that failed at the same time don't all come
+    back at the same time. Anything else (like bad credentials or a missing queue) fails straight away.
+    """
+
+    def __init__(self,
+                 max_retries=5,
+                 initial_backoff=0.2,
+                 max_backoff=MAX_BACKOFF,
+                 statistics=None,
+                 logger=None,
+                 sleep=time.sleep,
+                 random_generator=None):
+        self._max_retries = max(0, max_retries)
+        self._initial_backoff = initial_backoff
+        self._max_backoff = max_backoff
+        self._statistics = statistics or RunStatistics(enabled=False)
+        self._logger = logger
+        self._sleep = sleep
+        self._random = random_generator or random.Random()
+
+    @property
+    def max_retries(self):
+        return self._max_retries
+
+    def call(self, task, args=(), retry_unanswered=True):
+        """Calls a task, trying it again if it fails for a reason that could go away.
+
+        :param task: The callable that makes the request (it raises a TransportError if the request fails).
+        :param args: The positional arguments for the task.
+        :param retry_unanswered: If False, requests that got no answer at all aren't tried again (for requests that
+                                 can't safely be made twice, since the broker may have acted on the first one).
+        :return: The result of the task.
+        :raises TransportError: If the request fails for good.
+        """
+
+        attempt = 0
+
+        while True:
+            try:
+                return task(*args)
+            except TransportError as err:
+                if attempt >= self._max_retries or not is_retryable(err, retry_unanswered):
+                    raise
+                backoff = self.get_backoff(attempt)
+                attempt += 1
+                if self._logger is not None:
+                    self._logger.debug('Attempt %s failed (%s) so trying again in %.3f seconds', attempt, err, backoff)
+                self._statistics.record('retry', backoff)
+                self._sleep(backoff)
+
+    def get_backoff(self, attempt):
+        """Gets how long to wait before trying again.
+
+        :param attempt: The number of attempts that have already been retried (0 for the first retry).
+        :return: The wait in seconds (somewhere between 0 and the exponential backoff).
+        """
+
+        return self._random.uniform(0, min(self._max_backoff, self._initial_backoff * (2 ** attempt)))
+
+
+def is_retryable(error, retry_unanswered=True):
+    """Checks whether a failed request is worth trying again.
+
+    :param error: The TransportError.
+    :param retry_unanswered: If False, requests that got no answer at all aren't worth trying again.
+    :return: True if the request could succeed next time.
+    """
+
+    if error.status_code is None:
+        return retry_unanswered
+    return error.status_code in RETRYABLE_STATUS_CODES
+
+
+def can_carry_on(error):
+    """Checks whether the rest of a run can carry on after a publish has failed for good.
+
+    The message is set aside either way, but bad credentials or a missing exchange would fail every other message too.
+
+    :param error: The TransportError (after any retries).
+    :return: True if the rest of the messages can still be published.
+    """
+
+    return error.status_code is None or error.status_code in RETRYABLE_STATUS_CODES + REJECTED_STATUS_CODES
@@ -0,0 +1,163 @@
+import json
+import threading
+
+# The stages of a run that are measured
+STAGES = ('get',          # Getting messages from RabbitMQ
+          'decode',       # Decoding the JSON RabbitMQ sent back
+          'resolve',      # Working out the source queue of a message
+          'scrub',        # Removing fields from a message
+          'encode',       # Encoding a message as JSON to publish it
+          'publish',      # Publishing a message to RabbitMQ
+          'file_read',    # Reading a message from a message archive
+          'file_write',   # Writing a message to a message archive
+          'retry')        # Waiting to try a failed request again
+
+# Latencies are counted in buckets that double in size (the first bucket is everything under 1 microsecond)
+HISTOGRAM_BUCKETS = 32
+
+
+class StageStatistics(object):
+    """This class represents the (thread safe) counters and latency histogram of one stage of a run.
+    """
+
+    def __init__(self, stage):
+        self._stage = stage
+        self._lock = threading.Lock()
+        self._count = 0
+        self._bytes = 0
+        self._total_seconds = 0.0
+        self._max_seconds = 0.0
+        self._histogram = [0] * HISTOGRAM_BUCKETS
+
+    @property
+    def stage(self):
+        return self._stage
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    @property
+    def total_seconds(self):
+        return self._total_seconds
+
+    def record(self, elapsed_seconds, byte_count=0, count=1):
+        """Records work done in the stage.
+
+        :param elapsed_seconds: How long the work took.
+        :param byte_count: The number of bytes the work handled.
+        :param count: The number of messages (or requests) the work handled.
+        """
+
+        bucket = min(int(elapsed_seconds * 1000000).bit_length(), HISTOGRAM_BUCKETS - 1)
+
+        with self._lock:
+            self._count += count
+            self._bytes += byte_count
+            self._total_seconds += elapsed_seconds
+            if elapsed_seconds > self._max_seconds:
+                self._max_seconds = elapsed_seconds
+            if count:
+                self._histogram[bucket] += 1
+
+    def get_percentile(self, percentile):
+        """Gets a latency percentile (as the upper bound of the histogram bucket it falls in).
+
+        :param percentile: The percentile (0 to 100).
+        :return: The latency in seconds.
+        """
+
+        with self._lock:
+            histogram = list(self._histogram)
+
+        samples = sum(histogram)
+        if not samples:
+            return 0.0
+
+        rank = percentile / 100.0 * samples
+        seen = 0
+        for bucket, bucket_count in enumerate(histogram):
+            seen += bucket_count
+            if bucket_count and seen >= rank:
+                return min(self._get_bucket_upper_bound(bucket), self._max_seconds)
+
+        return self._max_seconds
+
+    def to_dictionary(self):
+        """Gets the statistics as a dictionary (ready to be written as JSON).
+        """
+
+        with self._lock:
+            histogram = list(self._histogram)
+            count = self._count
+            byte_count = self._bytes
+            total_seconds = self._total_seconds
+            max_seconds = self._max_seconds
+
+        return {'count': count,
+                'bytes': byte_count,
+                'total_seconds': total_seconds,
+                'mean_ms': total_seconds / count * 1000 if count else 0.0,
+                'p50_ms': self.get_percentile(50) * 1000,
+                'p99_ms': self.get_percentile(99) * 1000,
+                'max_ms': max_seconds * 1000,
+                'histogram': [{'le_ms': self._get_bucket_upper_bound(bucket) * 1000, 'count': bucket_count}
+                              for bucket, bucket_count in enumerate(histogram) if bucket_count]}
+
+    @staticmethod
+    def _get_bucket_upper_bound(bucket):
+        return (1 << bucket) / 1000000.0
+
+
+class RunStatistics(object):
+    """This class represents the timings and counters of every stage of a run.
+
+    It is shared by every thread in the run. When it isn't enabled nothing is recorded.
+    """
+
+    def __init__(self, enabled=True):
+        self._enabled = enabled
+        self._stages = dict((stage, StageStatistics(stage)) for stage in STAGES)
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    def get_stage(self, stage):
+        return self._stages[stage]
+
+    def record(self, stage, elapsed_seconds, byte_count=0, count=1):
+        """Records work done in a stage of the run.
+
+        :param stage: The stage (one of STAGES).
+        :param elapsed_seconds: How long the work took.
+        :param byte_count: The number of bytes the work handled.
+        :param count: The number of messages (or requests) the work handled.
+        """
+
+        if self._enabled:
+            self._stages[stage].record(elapsed_seconds, byte_count, count)
+
+    def to_dictionary(self, elapsed_seconds=None):
+        """Gets the statistics as a dictionary (ready to be written as JSON).
+
+        :param elapsed_seconds: How long the whole run took.
+        :return: A dictionary of the run and its stages.
+        """
+
+        return {'elapsed_seconds': elapsed_seconds,
+                'stages': dict((stage, self._stages[stage].to_dictionary()) for stage in STAGES)}
+
+    def write_json(self, file_name, elapsed_seconds=None):
+        """Writes the statistics to a JSON file.
+
+        :param file_name: The name of the file.
+        :param elapsed_seconds: How long the whole run took.
+        """
+
+        with open(file_name, 'w') as statistics_file:
+            json.dump(self.to_dictionary(elapsed_seconds), statistics_file, indent=2, sort_keys=True)
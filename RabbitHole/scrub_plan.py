@@ -0,0 +1,83 @@
+# Fields that start with one of these (and a dot) are exact paths from the top of a message rather than keys to remove
+# wherever they turn up (ex: properties.headers.NServiceBus.Retries)
+PATH_ROOTS = ('properties',)
+
+
+class ScrubPlan(object):
+    """This class represents a compiled list of fields to remove from messages.
+
+    The fields are compiled once: plain field names become a frozen set that every nested dictionary is checked against
+    in a single walk of the message, and exact paths go straight to the dictionary that holds them.
+    """
+
+    def __init__(self, fields_to_remove):
+        self._fields_to_remove = tuple(fields_to_remove)
+
+        keys = set()
+        paths = []
+
+        for field in self._fields_to_remove:
+            field = field.strip()
+            if not field:
+                continue
+            segments = field.split('.')
+            if len(segments) > 1 and segments[0] in PATH_ROOTS:
+                paths.append(self._compile_path(segments))
+            else:
+                keys.add(field)
+
+        self._keys = frozenset(keys)
+        self._paths = tuple(paths)
+
+    @property
+    def fields_to_remove(self):
+        return self._fields_to_remove
+
+    def scrub(self, message):
+        """Removes the fields from a message (in place).
+
+        :param message: The message.
+        :return: The scrubbed message.
+        """
+
+        for path in self._paths:
+            self._remove_path(message, path)
+
+        if self._keys:
+            self._remove_keys(message)
+
+        return message
+
+    def _remove_keys(self, dictionary):
+        for key in self._keys.intersection(dictionary):
+            del dictionary[key]
+
+        for value in dictionary.itervalues():
+            if isinstance(value, dict):
+                self._remove_keys(value)
+
+    @staticmethod
+    def _compile_path(segments):
+        """Compiles a path into the ways it can be split into parent keys and a field name.
+
+        Header names contain dots too (ex: NServiceBus.Retries) so properties.headers.NServiceBus.Retries could be the
+        NServiceBus.Retries field of headers or the Retries field of a NServiceBus dictionary. The shortest parent path
+        is tried first.
+
+        :param segments: The dot-separated parts of the path.
+        :return: A tuple of (parent keys, field name) pairs.
+        """
+
+        return tuple((tuple(segments[:i]), '.'.join(segments[i:])) for i in range(1, len(segments)))
+
+    @staticmethod
+    def _remove_path(message, path):
+        for parent_keys, field in path:
+            dictionary = message
+            for key in parent_keys:
+                dictionary = dictionary.get(key) if isinstance(dictionary, dict) else None
+                if dictionary is None:
+                    break
+            if isinstance(dictionary, dict) and field in dictionary:
+                del dictionary[field]
+                return
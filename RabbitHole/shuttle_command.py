@@ -1,15 +1,35 @@
+import threading
+
+from Queue import Empty
+from Queue import Full
+from Queue import Queue
+
+from RabbitHole.progress_reporter import ProgressReporter
+from RabbitHole.rabbitmq_message_helper import RabbitMQMessageHelper
 from RabbitHole.rabbitmq import RabbitMQ
+from RabbitHole.rabbitmq import RabbitMQError
 
 
 class ShuttleCommand(object):
     """Gets messages from a queue and puts them on another queue.
+
+    Getting and publishing run at the same time: a getter thread takes chunks of messages off the source queue and puts
+    them in a bounded buffer while the publishers empty it onto the destination queue.
     """
 
     def __init__(self, configuration, console, logger):
         self._configuration = configuration
         self._console = console
         self._logger = logger
-        self._rabbitmq = RabbitMQ(configuration, console, logger)
+        self._rabbitmq_message_helper = RabbitMQMessageHelper(configuration, console, logger)
+        # The progress of the whole shuttle is reported here rather than each get and publish
+        self._rabbitmq = RabbitMQ(configuration, console.get_quiet_console(), logger)
+        self._getting_done = threading.Event()
+        self._stop_getting = threading.Event()
+        self._getting_failed = False
+        self._unbuffered_messages = []
+        self._current_chunk = []
+        self._current_position = 0
 
     def execute(self):
         """Executes the command.
@@ -24,23 +44,150 @@ class ShuttleCommand(object):
                                              self._configuration.command_line_arguments.message_source_queue)
             self._console.write_keyvaluepair('Destination Queue',
                                              self._configuration.command_line_arguments.rabbit_destination_queue)
+            self._console.write_keyvaluepair('       Chunk Size',
+                                             self._configuration.chunk_size)
+            self._console.write_keyvaluepair('    Buffer Chunks',
+                                             self._configuration.buffer_chunks)
             self._console.write_divider()
 
-        messages = self._rabbitmq.get_rabbit_messages_from_queue(
-            self._configuration.command_line_arguments.message_count,
-            self._configuration.rabbit_host_url,
-            self._configuration.rabbit_host_port,
-            self._configuration.rabbit_vhost,
-            self._configuration.command_line_arguments.message_source_queue,
-            self._configuration.rabbit_authorization_string,
-            True,
-            self._configuration.verbose)
-
-        self._rabbitmq.publish_messages(messages,
-                                        self._configuration.rabbit_host_url,
-                                        self._configuration.rabbit_host_port,
-                                        self._configuration.rabbit_vhost,
-                                        self._configuration.rabbit_authorization_string,
-                                        self._configuration.command_line_arguments.rabbit_destination_queue,
-                                        self._configuration.simulate,
-                                        self._configuration.verbose)
+        message_buffer = Queue(maxsize=max(1, self._configuration.buffer_chunks))
+
+        getter = threading.Thread(target=self._get_messages, args=(message_buffer,), name='getter')
+        getter.setDaemon(True)
+        getter.start()
+
+        progress = ProgressReporter(self._console,
+                                    'Shuttling to {0}'.format(
+                                        self._configuration.command_line_arguments.rabbit_destination_queue),
+                                    int(self._configuration.command_line_arguments.message_count),
+                                    self._configuration.simulate)
+
+        try:
+            self._rabbitmq.publish_messages(self._get_buffered_messages(message_buffer),
+                                            self._configuration.rabbit_host_url,
+                                            self._configuration.rabbit_host_port,
+                                            self._configuration.rabbit_vhost,
+                                            self._configuration.rabbit_authorization_string,
+                                            self._configuration.command_line_arguments.rabbit_destination_queue,
+                                            self._configuration.simulate,
+                                            self._configuration.verbose,
+                                            progress)
+        finally:
+            progress.finish()
+            self._stop_getting.set()
+            getter.join()
+            self._rescue_messages(message_buffer)
+            self._rabbitmq.close()
+
+        if self._getting_failed:
+            raise RabbitMQError('Unable to get the messages from the source queue')
+
+    def _get_messages(self, message_buffer):
+        """Gets chunks of messages from the source queue and puts them in the buffer (on the getter thread).
+
+        :param message_buffer: The buffer to fill.
+        """
+
+        remaining_messages = int(self._configuration.command_line_arguments.message_count)
+        chunk_size = max(1, self._configuration.chunk_size)
+        message_filter = self._configuration.message_filter
+        returned_fingerprints = set()
+        came_round = False
+
+        # Simulated runs leave the messages on the queue
+        requeue = self._configuration.simulate
+
+        try:
+            while remaining_messages > 0 and not self._stop_getting.is_set():
+                messages = self._rabbitmq.get_rabbit_messages_from_queue(
+                    min(chunk_size, remaining_messages),
+                    self._configuration.rabbit_host_url,
+                    self._configuration.rabbit_host_port,
+                    self._configuration.rabbit_vhost,
+                    self._configuration.command_line_arguments.message_source_queue,
+                    self._configuration.rabbit_authorization_string,
+                    requeue,
+                    self._configuration.verbose)
+
+                if not messages:
+                    break
+
+                remaining_messages -= len(messages)
+
+                if message_filter is not None:
+                    # The messages that don't match go back on the source queue (and once they come round again,
+                    # every message has been looked at)
+                    messages, came_round = self._rabbitmq.filter_taken_messages(
+                        messages,
+                        message_filter,
+                        self._configuration.rabbit_host_url,
+                        self._configuration.rabbit_host_port,
+                        self._configuration.rabbit_vhost,
+                        self._configuration.rabbit_authorization_string,
+                        self._configuration.command_line_arguments.message_source_queue,
+                        returned_fingerprints,
+                        requeue)
+
+                while messages:
+                    try:
+                        message_buffer.put(messages, timeout=0.1)
+                        break
+                    except Full:
+                        if self._stop_getting.is_set():
+                            # Nobody is going to publish these so hang on to them
+                            self._unbuffered_messages.extend(messages)
+                            return
+
+                if requeue or came_round:
+                    # The same messages would come back again
+                    break
+        except RabbitMQError:
+            self._getting_failed = True
+        finally:
+            self._getting_done.set()
+
+    def _get_buffered_messages(self, message_buffer):
+        """Takes the messages out of the buffer as they arrive.
+
+        :param message_buffer: The buffer to empty.
+        :return: A generator of the messages.
+        """
+
+        while True:
+            try:
+                messages = message_buffer.get(timeout=0.1)
+            except Empty:
+                if self._getting_done.is_set() and message_buffer.empty():
+                    self._current_chunk = []
+                    return
+                continue
+
+            self._current_chunk = messages
+            for self._current_position, message in enumerate(messages):
+                yield message
+
+    def _rescue_messages(self, message_buffer):
+        """Saves any messages that were taken off the source queue but never published.
+
+        :param message_buffer: The buffer.
+        """
+
+        # The publishers stop asking for messages when something goes wrong, so the last message they were handed
+        # (and the rest of its chunk) never made it
+        messages = self._current_chunk[self._current_position:] + self._unbuffered_messages
+        while not message_buffer.empty():
+            messages.extend(message_buffer.get_nowait())
+
+        if not messages or self._configuration.simulate:
+            return
+
+        rescue_file = 'shuttle-{0}.rescued.{1}'.format(self._configuration.command_line_arguments.message_source_queue,
+                                                       self._configuration.archive_format)
+
+        self._console.write_error('{0} messages were taken from {1} but not published!'.format(
+            len(messages), self._configuration.command_line_arguments.message_source_queue))
+        self._rabbitmq_message_helper.append_rabbit_messages_to_file(messages,
+                                                                     rescue_file,
+                                                                     False,
+                                                                     self._configuration.archive_format)
+        self._console.write_hint('They were saved to {0} (use the queue command to publish them)'.format(rescue_file))
@@ -1,5 +1,10 @@
+import os
+
+from RabbitHole.queue_sweep import QueueSweep
+from RabbitHole.queue_sweep import create_queue_selector
 from RabbitHole.rabbitmq_message_helper import RabbitMQMessageHelper
 from RabbitHole.rabbitmq import RabbitMQ
+from RabbitHole.rabbitmq import RabbitMQError
 
 
 class SnagCommand(object):
@@ -19,25 +24,192 @@ class SnagCommand(object):
         :return:
         """
 
+        queue_selector = create_queue_selector(self._configuration.command_line_arguments)
+
         if self._configuration.verbose:
             self._console.write_keyvaluepair('Message Count',
                                              self._configuration.command_line_arguments.message_count)
             self._console.write_keyvaluepair(' Source Queue',
-                                             self._configuration.command_line_arguments.message_source_queue)
+                                             self._configuration.command_line_arguments.message_source_queue or
+                                             queue_selector.pattern)
             self._console.write_keyvaluepair('    Save File',
                                              self._configuration.command_line_arguments.save_file)
+            self._console.write_keyvaluepair('  Compression',
+                                             self._configuration.compression)
+            self._console.write_keyvaluepair('        Index',
+                                             self._configuration.index_archive)
             self._console.write_divider()
 
-        messages = self._rabbitmq.get_rabbit_messages_from_queue(
+        if self._configuration.index_archive and (self._configuration.archive_format != 'ndjson' or
+                                                  self._configuration.compression != 'none'):
+            # Check before anything is taken off the queue
+            self._console.write_error('Only uncompressed ndjson files can be indexed!')
+            self._console.write_hint('Use --archive_format ndjson --compression none to index the save file')
+            raise RabbitMQError('Only uncompressed ndjson files can be indexed')
+
+        if getattr(self._configuration.command_line_arguments, 'drain', False):
+            if self._configuration.compression != 'none' and self._configuration.archive_format == 'json':
+                # Check before anything is taken off the queue
+                self._console.write_error('Compressed json files can\'t be drained to!')
+                self._console.write_hint('Use --archive_format ndjson to drain to a compressed file')
+                raise RabbitMQError('Compressed json files can\'t be drained to')
+
+        if queue_selector is not None:
+            self._snag_queues(queue_selector)
+            return
+
+        try:
+            self._snag_queue(self._configuration.command_line_arguments.message_source_queue,
+                             self._configuration.command_line_arguments.save_file,
+                             self._rabbitmq,
+                             self._rabbitmq_message_helper)
+        finally:
+            self._rabbitmq.close()
+
+    def _snag_queues(self, queue_selector):
+        """Saves the messages in every queue the selector picks out, each to a file of its own.
+
+        :param queue_selector: The QueueSelector.
+        """
+
+        save_file = self._configuration.command_line_arguments.save_file
+
+        if '{queue}' not in save_file and not self._configuration.simulate and not os.path.isdir(save_file):
+            try:
+                os.makedirs(save_file)
+            except OSError as err:
+                self._console.write_error('Unable to create the {0} folder ({1})'.format(save_file, err))
+                raise RabbitMQError(str(err))
+
+        QueueSweep(self._configuration, self._console, self._logger).run(
+            queue_selector,
+            'Snagged',
+            lambda queue, rabbitmq, rabbitmq_message_helper: self._snag_queue(
+                queue,
+                rabbitmq_message_helper.get_queue_save_file(save_file,
+                                                            queue,
+                                                            self._configuration.archive_format,
+                                                            self._configuration.compression),
+                rabbitmq,
+                rabbitmq_message_helper))
+
+    def _snag_queue(self, message_source_queue, save_file, rabbitmq, rabbitmq_message_helper):
+        """Saves the messages in a queue to a file.
+
+        :param message_source_queue: The name of the queue.
+        :param save_file: The file to save the messages to.
+        :param rabbitmq: The RabbitMQ to get the messages with.
+        :param rabbitmq_message_helper: The message helper to save the messages with.
+        :return: The number of messages saved.
+        """
+
+        if getattr(self._configuration.command_line_arguments, 'drain', False):
+            try:
+                return self._drain(message_source_queue, save_file, rabbitmq, rabbitmq_message_helper)
+            except IOError as err:
+                # The details have already been written to the console
+                raise RabbitMQError(str(err))
+
+        messages = rabbitmq.get_rabbit_messages_from_queue(
             self._configuration.command_line_arguments.message_count,
             self._configuration.rabbit_host_url,
             self._configuration.rabbit_host_port,
             self._configuration.rabbit_vhost,
-            self._configuration.command_line_arguments.message_source_queue,
+            message_source_queue,
             self._configuration.rabbit_authorization_string,
             True,
             self._configuration.verbose)
 
-        self._rabbitmq_message_helper.save_rabbit_messages_to_file(messages,
-                                                                   self._configuration.command_line_arguments.save_file,
-                                                                   self._configuration.command_line_arguments.simulate)
+        # The messages stay on the queue, so the ones that don't match are simply never written
+        messages = rabbitmq_message_helper.filter_messages(messages, self._configuration.message_filter)
+
+        try:
+            rabbitmq_message_helper.save_rabbit_messages_to_file(
+                messages,
+                save_file,
+                self._configuration.command_line_arguments.simulate,
+                self._configuration.archive_format,
+                self._configuration.compression,
+                self._configuration.compression_dictionary,
+                self._configuration.index_archive)
+        except IOError as err:
+            # The details have already been written to the console
+            raise RabbitMQError(str(err))
+
+        return len(messages)
+
+    def _drain(self, message_source_queue, save_file, rabbitmq, rabbitmq_message_helper):
+        """Removes messages from the queue a chunk at a time, saving each chunk before getting the next one.
+
+        :param message_source_queue: The name of the queue.
+        :param save_file: The file to save the messages to.
+        :param rabbitmq: The RabbitMQ to get the messages with.
+        :param rabbitmq_message_helper: The message helper to save the messages with.
+        :return: The number of messages saved.
+        """
+
+        if not self._configuration.simulate:
+            # A drain can't be undone, so make sure the messages can be saved before any are taken off the queue
+            rabbitmq_message_helper.check_rabbit_message_file_can_be_appended_to(
+                save_file,
+                getattr(self._configuration.command_line_arguments, 'append', False),
+                self._configuration.archive_format,
+                self._configuration.compression,
+                self._configuration.index_archive)
+
+        remaining_messages = int(self._configuration.command_line_arguments.message_count)
+        chunk_size = max(1, self._configuration.chunk_size)
+        saved_messages = 0
+        message_filter = self._configuration.message_filter
+        returned_fingerprints = set()
+        came_round = False
+
+        # Simulated runs leave the messages on the queue
+        requeue = self._configuration.simulate
+
+        while remaining_messages > 0:
+            messages = rabbitmq.get_rabbit_messages_from_queue(
+                min(chunk_size, remaining_messages),
+                self._configuration.rabbit_host_url,
+                self._configuration.rabbit_host_port,
+                self._configuration.rabbit_vhost,
+                message_source_queue,
+                self._configuration.rabbit_authorization_string,
+                requeue,
+                self._configuration.verbose)
+
+            if not messages:
+                break
+
+            remaining_messages -= len(messages)
+
+            if message_filter is not None:
+                # The messages that don't match go back on the queue (and once they come round again, every message
+                # has been looked at)
+                messages, came_round = rabbitmq.filter_taken_messages(messages,
+                                                                      message_filter,
+                                                                      self._configuration.rabbit_host_url,
+                                                                      self._configuration.rabbit_host_port,
+                                                                      self._configuration.rabbit_vhost,
+                                                                      self._configuration.rabbit_authorization_string,
+                                                                      message_source_queue,
+                                                                      returned_fingerprints,
+                                                                      requeue)
+
+            saved_messages += rabbitmq_message_helper.append_rabbit_messages_to_file(
+                messages,
+                save_file,
+                self._configuration.simulate,
+                self._configuration.archive_format,
+                self._configuration.compression,
+                self._configuration.compression_dictionary,
+                self._configuration.index_archive)
+
+            if requeue or came_round:
+                # The same messages would come back again
+                break
+
+        if not saved_messages:
+            self._console.write_error('No messages found!')
+
+        return saved_messages
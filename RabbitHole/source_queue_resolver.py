@@ -0,0 +1,90 @@
+# The most header fingerprints to remember before starting over
+CACHE_SIZE = 4096
+
+
+class SourceQueueResolver(object):
+    """This class represents a compiled list of the fields that can name a message's source queue.
+
+    The fields are in priority order (the first one wins). Every candidate field is looked for in a single walk of the
+    message, which stops as soon as the highest priority field turns up. When the winning field is a header, the
+    message's set of header names (its fingerprint) is remembered along with the field, so later messages with the same
+    headers are resolved with a single lookup.
+    """
+
+    def __init__(self, source_queue_fields):
+        self._source_queue_fields = tuple(source_queue_fields)
+        self._priorities = {}
+        for priority, field in enumerate(self._source_queue_fields):
+            self._priorities.setdefault(field, priority)
+        self._cache = {}
+
+    @property
+    def source_queue_fields(self):
+        return self._source_queue_fields
+
+    def resolve(self, message):
+        """Gets the source queue from a message.
+
+        :param message: The message.
+        :return: The name of the source queue (or None if the message doesn't have any of the fields).
+        """
+
+        headers = self._get_headers(message)
+        fingerprint = None
+
+        if headers is not None:
+            fingerprint = frozenset(headers)
+            field = self._cache.get(fingerprint)
+            if field is not None:
+                return headers[field]
+
+        found = {}
+        self._search(message, found)
+
+        if not found:
+            return None
+
+        source_queue, parent, field = found[min(found)]
+
+        if fingerprint is not None and parent is headers:
+            if len(self._cache) >= CACHE_SIZE:
+                self._cache.clear()
+            self._cache[fingerprint] = field
+
+        return source_queue
+
+    @staticmethod
+    def _get_headers(message):
+        properties = message.get('properties')
+        if isinstance(properties, dict):
+            headers = properties.get('headers')
+            if isinstance(headers, dict):
+                return headers
+        return None
+
+    def _search(self, value, found):
+        """Looks for every candidate field in one walk (depth first, like get_dictionary_field_values).
+
+        :param value: The dictionary (or list) to search.
+        :param found: The (value, parent dictionary, field) of the first match for each priority found so far.
+        :return: True if the highest priority field was found (and the search can stop).
+        """
+
+        if isinstance(value, dict):
+            for key, child in value.iteritems():
+                priority = self._priorities.get(key)
+                if priority is not None:
+                    if priority not in found:
+                        found[priority] = (child, value, key)
+                        if priority == 0:
+                            return True
+                elif isinstance(child, (dict, list)):
+                    if self._search(child, found):
+                        return True
+
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict) and self._search(item, found):
+                    return True
+
+        return False
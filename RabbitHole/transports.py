@@ -0,0 +1,610 @@
+import base64
+import threading
+import urllib
+import urlparse
+from timeit import default_timer as timer
+
+import requests
+
+try:
+    import pika
+except ImportError:
+    pika = None
+
+from RabbitHole import json_codec
+from RabbitHole.run_statistics import RunStatistics
+
+# These are the message properties the RabbitMQ management API understands (and returns)
+MESSAGE_PROPERTY_NAMES = ('content_type',
+                          'content_encoding',
+                          'headers',
+                          'delivery_mode',
+                          'priority',
+                          'correlation_id',
+                          'reply_to',
+                          'expiration',
+                          'message_id',
+                          'timestamp',
+                          'type',
+                          'user_id',
+                          'app_id',
+                          'cluster_id')
+
+# A cluster node that fails is left alone for this many seconds (doubling every time it fails again)
+NODE_COOLDOWN = 1.0
+MAX_NODE_COOLDOWN = 30.0
+
+# How quickly a cluster node's average latency follows its latest requests
+NODE_LATENCY_WEIGHT = 0.2
+
+
+class TransportError(Exception):
+    """This class represents a failed conversation with RabbitMQ.
+    """
+
+    def __init__(self, status_code, text):
+        super(TransportError, self).__init__('[{0}]{1}'.format(status_code, text))
+        self.status_code = status_code
+        self.text = text
+
+
+def create_transport(configuration, rabbit_host_url, rabbit_host_port, rabbit_vhost, rabbit_authorization_string):
+    """Creates the transport selected in the configuration.
+
+    :param configuration: The application configuration.
+    :param rabbit_host_url: The RabbitMQ host URL (or a comma-separated list of the URLs of the cluster nodes).
+    :param rabbit_host_port: The RabbitMQ (management) host port.
+    :param rabbit_vhost: The RabbitMQ vhost.
+    :param rabbit_authorization_string: The authorization string for the request header.
+    :return: A transport.
+    """
+
+    if configuration.transport == 'amqp':
+        return AmqpTransport([urlparse.urlparse(node_url).hostname or node_url
+                              for node_url, node_port in split_host_urls(rabbit_host_url, rabbit_host_port)],
+                             configuration.rabbit_amqp_port,
+                             urllib.unquote(rabbit_vhost),
+                             configuration.rabbit_username,
+                             configuration.rabbit_password,
+                             configuration.prefetch_count,
+                             statistics=configuration.statistics)
+
+    return create_http_transport(rabbit_host_url,
+                                 rabbit_host_port,
+                                 rabbit_vhost,
+                                 rabbit_authorization_string,
+                                 configuration.window_ceiling,
+                                 configuration.statistics)
+
+
+def create_http_transport(rabbit_host_url,
+                          rabbit_host_port,
+                          rabbit_vhost,
+                          rabbit_authorization_string,
+                          pool_size=10,
+                          statistics=None):
+    """Creates the management HTTP API transport for a node or (given a list of nodes) a cluster.
+
+    :param rabbit_host_url: The RabbitMQ host URL (or a comma-separated list of the URLs of the cluster nodes).
+    :param rabbit_host_port: The RabbitMQ (management) host port.
+    :param rabbit_vhost: The RabbitMQ vhost.
+    :param rabbit_authorization_string: The authorization string for the request header.
+    :param pool_size: The number of connections to keep open (to each node).
+    :param statistics: The run statistics.
+    :return: An HttpTransport, or a ClusterTransport for more than one node.
+    """
+
+    transports = [HttpTransport(node_url, node_port, rabbit_vhost, rabbit_authorization_string, pool_size, statistics)
+                  for node_url, node_port in split_host_urls(rabbit_host_url, rabbit_host_port)]
+
+    if len(transports) == 1:
+        return transports[0]
+
+    return ClusterTransport(transports)
+
+
+def split_host_urls(rabbit_host_url, rabbit_host_port):
+    """Splits a host URL setting into the nodes of a cluster.
+
+    :param rabbit_host_url: The RabbitMQ host URL (or a comma-separated list of the URLs of the cluster nodes).
+    :param rabbit_host_port: The port of the nodes that don't have one in their URL.
+    :return: A list of (URL without the port, port) tuples.
+    """
+
+    nodes = []
+
+    for node_url in rabbit_host_url.split(','):
+        node_url = node_url.strip().rstrip('/')
+        if not node_url:
+            continue
+
+        parsed_url = urlparse.urlparse(node_url)
+        if parsed_url.port is not None:
+            nodes.append((node_url[:node_url.rindex(':')], parsed_url.port))
+        else:
+            nodes.append((node_url, rabbit_host_port))
+
+    return nodes
+
+
+class HttpTransport(object):
+    """This class represents the RabbitMQ management HTTP API transport.
+    """
+
+    def __init__(self,
+                 rabbit_host_url,
+                 rabbit_host_port,
+                 rabbit_vhost,
+                 rabbit_authorization_string,
+                 pool_size=10,
+                 statistics=None):
+        self._rabbit_host_url = rabbit_host_url
+        self._rabbit_host_port = rabbit_host_port
+        self._rabbit_vhost = rabbit_vhost
+        self._request_headers = {'Content-type': 'application/json', 'Authorization': rabbit_authorization_string}
+        self._pool_size = max(1, pool_size)
+        self._publish_urls = {}
+        self._statistics = statistics or RunStatistics(enabled=False)
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Gets the session (with a connection pool big enough for every concurrent request).
+        """
+
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                # pool_connections is the number of connection pools to cache (one per host)
+                # pool_maxsize is the maximum number of connections to keep open to each host
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+
+        return self._session
+
+    def build_get_url(self, message_source_queue):
+        """Builds the RabbitMQ GET URL.
+
+        :param message_source_queue: The name of the RabbitMQ source queue.
+        :return: A fully-constructed GET URL for RabbitMQ.
+        """
+
+        return self._rabbit_host_url + ':' + str(
+            self._rabbit_host_port) + '/api/queues/' + self._rabbit_vhost + '/' + message_source_queue + '/get'
+
+    def build_publish_url(self, rabbit_destination_queue):
+        """Builds the RabbitMQ publish URL.
+
+        :param rabbit_destination_queue: The name of the RabbitMQ destination queue.
+        :return: A fully-constructed publish URL for RabbitMQ.
+        """
+
+        return self._rabbit_host_url + ':' + str(
+            self._rabbit_host_port) + '/api/exchanges/' + self._rabbit_vhost + '/' + rabbit_destination_queue + '/publish'
+
+    def build_list_queues_url(self):
+        """Builds the RabbitMQ URL that lists the queues in the vhost.
+
+        :return: A fully-constructed queue list URL for RabbitMQ.
+        """
+
+        return self._rabbit_host_url + ':' + str(
+            self._rabbit_host_port) + '/api/queues/' + self._rabbit_vhost + '?columns=name,messages'
+
+    def list_queues(self):
+        """Lists the queues in the vhost.
+
+        :return: A list of the queues (dictionaries with the name and number of messages of each queue).
+        """
+
+        try:
+            rabbit_response = self.session.get(self.build_list_queues_url(), headers=self._request_headers)
+        except requests.exceptions.RequestException as err:
+            raise TransportError(None, str(err))
+
+        if rabbit_response.status_code != 200:
+            raise TransportError(rabbit_response.status_code, rabbit_response.text)
+
+        return json_codec.loads(rabbit_response.content)
+
+    def get_messages(self, message_source_queue, message_count, requeue=True):
+        """Gets messages from a RabbitMQ queue.
+
+        :param message_source_queue: The name of the RabbitMQ source queue.
+        :param message_count: The number of messages to get.
+        :param requeue: If True, re-queues the message after getting it from the queue.
+        :return: A list of the requested messages.
+        """
+
+        rabbit_request_data = {'count': message_count, 'requeue': 'true' if requeue else 'false', 'encoding': 'auto'}
+
+        start = timer()
+        try:
+            rabbit_response = self.session.post(self.build_get_url(message_source_queue),
+                                                data=json_codec.dumps(rabbit_request_data),
+                                                headers=self._request_headers)
+        except requests.exceptions.RequestException as err:
+            raise TransportError(None, str(err))
+        self._statistics.record('get', timer() - start, len(rabbit_response.content))
+
+        if rabbit_response.status_code != 200:
+            raise TransportError(rabbit_response.status_code, rabbit_response.text)
+
+        start = timer()
+        messages = json_codec.loads(rabbit_response.content)
+        self._statistics.record('decode', timer() - start, len(rabbit_response.content), len(messages))
+
+        return messages
+
+    def publish_message(self, rabbit_destination_queue, message):
+        """Publishes a message to RabbitMQ.
+
+        :param rabbit_destination_queue: The name of the RabbitMQ destination queue.
+        :param message: The message to publish.
+        :return: The status code of the publish.
+        """
+
+        # The URL is only built once for each destination
+        publish_url = self._publish_urls.get(rabbit_destination_queue)
+        if publish_url is None:
+            publish_url = self.build_publish_url(rabbit_destination_queue)
+            self._publish_urls[rabbit_destination_queue] = publish_url
+
+        start = timer()
+        rabbit_request_data = json_codec.dumps(message)
+        self._statistics.record('encode', timer() - start, len(rabbit_request_data))
+
+        start = timer()
+        try:
+            rabbit_response = self.session.post(publish_url,
+                                                data=rabbit_request_data,
+                                                headers=self._request_headers)
+        except requests.exceptions.RequestException as err:
+            raise TransportError(None, str(err))
+        self._statistics.record('publish', timer() - start, len(rabbit_request_data))
+
+        if rabbit_response.status_code != 200:
+            raise TransportError(rabbit_response.status_code, rabbit_response.text)
+
+        return rabbit_response.status_code
+
+    def close(self):
+        """Closes the transport.
+        """
+
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+class ClusterTransport(object):
+    """This class represents the management HTTP API of every node in a cluster.
+
+    Every node has its own transport (and so its own connection pool). Each request goes to the available node with
+    the shortest expected wait, which is the number of requests it has in flight (plus this one) times its average
+    latency, so a node that slows down gets less work. A node that doesn't answer, says it's overloaded or fails with
+    a 5xx is left alone for a cooldown that doubles every time it fails again (the retry policy sends the request
+    somewhere else). When every node is cooling down, the one that'll be ready first is tried anyway.
+    """
+
+    def __init__(self, transports, clock=timer):
+        self._nodes = [_ClusterNode(transport) for transport in transports]
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    @property
+    def request_counts(self):
+        """Gets the number of requests each node has been sent.
+        """
+
+        with self._lock:
+            return [node.request_count for node in self._nodes]
+
+    def list_queues(self):
+        return self._call('list_queues')
+
+    def get_messages(self, message_source_queue, message_count, requeue=True):
+        return self._call('get_messages', message_source_queue, message_count, requeue)
+
+    def publish_message(self, rabbit_destination_queue, message):
+        return self._call('publish_message', rabbit_destination_queue, message)
+
+    def close(self):
+        """Closes the transport of every node.
+        """
+
+        for node in self._nodes:
+            node.transport.close()
+
+    def _call(self, method_name, *args):
+        node = self._acquire_node()
+        start = self._clock()
+
+        try:
+            result = getattr(node.transport, method_name)(*args)
+        except TransportError as err:
+            self._release_node(node, self._clock() - start, is_node_failure(err))
+            raise
+
+        self._release_node(node, self._clock() - start, False)
+        return result
+
+    def _acquire_node(self):
+        with self._lock:
+            now = self._clock()
+            available_nodes = [node for node in self._nodes if node.available_at <= now]
+
+            if available_nodes:
+                # Nodes that haven't answered yet have no latency, so every node is tried early on (and equally good
+                # nodes take turns)
+                node = min(available_nodes,
+                           key=lambda n: ((n.in_flight + 1) * (n.latency or 0.0), n.in_flight, n.request_count))
+            else:
+                node = min(self._nodes, key=lambda n: n.available_at)
+
+            node.in_flight += 1
+            node.request_count += 1
+            return node
+
+    def _release_node(self, node, latency, failed):
+        with self._lock:
+            node.in_flight -= 1
+
+            if failed:
+                node.failure_count += 1
+                node.available_at = self._clock() + min(MAX_NODE_COOLDOWN,
+                                                        NODE_COOLDOWN * (2 ** (node.failure_count - 1)))
+            else:
+                node.failure_count = 0
+                if node.latency is None:
+                    node.latency = latency
+                else:
+                    node.latency += (latency - node.latency) * NODE_LATENCY_WEIGHT
+
+
+class _ClusterNode(object):
+    """This class represents the health of one of the nodes of a ClusterTransport.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.in_flight = 0
+        self.latency = None
+        self.failure_count = 0
+        self.available_at = 0.0
+        self.request_count = 0
+
+
+def is_node_failure(error):
+    """Checks whether a failed request means the node itself is in trouble (rather than the request).
+
+    :param error: The TransportError.
+    :return: True if the node didn't answer, said it's overloaded or failed with a 5xx.
+    """
+
+    return error.status_code is None or error.status_code == 429 or error.status_code >= 500
+
+
+class AmqpTransport(object):
+    """This class represents the native AMQP 0-9-1 transport.
+
+    Every thread that uses the transport gets its own long-lived connection and channel (pika connections are not
+    thread safe). Publishing channels are put in confirm mode so a publish only succeeds once the broker has it. Given
+    the hosts of a cluster, the connections are spread across them and each connection fails over to the next host.
+    A connection that fails is closed, and the thread opens a new one for its next request.
+    """
+
+    def __init__(self,
+                 rabbit_host,
+                 rabbit_amqp_port,
+                 rabbit_vhost,
+                 rabbit_username,
+                 rabbit_password,
+                 prefetch_count=100,
+                 connection_factory=None,
+                 properties_factory=None,
+                 statistics=None):
+        if pika is None and (connection_factory is None or properties_factory is None):
+            raise TransportError(None, 'The AMQP transport requires the pika package (pip install pika)')
+
+        self._rabbit_hosts = list(rabbit_host) if isinstance(rabbit_host, (list, tuple)) else [rabbit_host]
+        self._rabbit_amqp_port = rabbit_amqp_port
+        self._rabbit_vhost = rabbit_vhost
+        self._rabbit_username = rabbit_username
+        self._rabbit_password = rabbit_password
+        self._prefetch_count = prefetch_count
+        self._statistics = statistics or RunStatistics(enabled=False)
+        self._connection_factory = connection_factory or self._create_pika_connection
+        self._properties_factory = properties_factory or (pika.BasicProperties if pika else None)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._connection_number = 0
+
+    def _create_pika_connection(self):
+        with self._connections_lock:
+            first_host = self._connection_number % len(self._rabbit_hosts)
+            self._connection_number += 1
+
+        credentials = pika.PlainCredentials(self._rabbit_username, self._rabbit_password)
+        # pika tries the hosts in order, so each connection starts with a different one
+        parameters = [pika.ConnectionParameters(host=rabbit_host,
+                                                port=self._rabbit_amqp_port,
+                                                virtual_host=self._rabbit_vhost,
+                                                credentials=credentials)
+                      for rabbit_host in self._rabbit_hosts[first_host:] + self._rabbit_hosts[:first_host]]
+        return pika.BlockingConnection(parameters)
+
+    @property
+    def channel(self):
+        """Gets the channel that belongs to the current thread (creating it if needed).
+        """
+
+        channel = getattr(self._local, 'channel', None)
+
+        if channel is None:
+            connection = self._connection_factory()
+            with self._connections_lock:
+                self._connections.append(connection)
+            channel = connection.channel()
+            channel.confirm_delivery()
+            self._local.connection = connection
+            self._local.channel = channel
+
+        return channel
+
+    def _drop_channel(self):
+        """Closes the connection of the current thread after an error so the next request opens a new one (on the next
+        host of a cluster).
+        """
+
+        connection = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        self._local.channel = None
+
+        if connection is not None:
+            with self._connections_lock:
+                if connection in self._connections:
+                    self._connections.remove(connection)
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def get_messages(self, message_source_queue, message_count, requeue=True):
+        """Gets messages from a RabbitMQ queue.
+
+        When requeueing, the messages are fetched with basic.get and held unacknowledged until all of them have been
+        read (so the same message is never read twice) and then rejected back onto the queue. Otherwise the messages
+        are consumed under a prefetch window and acknowledged a window at a time.
+
+        :param message_source_queue: The name of the RabbitMQ source queue.
+        :param message_count: The number of messages to get.
+        :param requeue: If True, re-queues the message after getting it from the queue.
+        :return: A list of the requested messages.
+        """
+
+        message_count = int(message_count)
+        messages = []
+        start = timer()
+
+        try:
+            channel = self.channel
+            if requeue:
+                last_delivery_tag = None
+                while len(messages) < message_count:
+                    method, properties, body = channel.basic_get(message_source_queue, auto_ack=False)
+                    if method is None:
+                        break
+                    last_delivery_tag = method.delivery_tag
+                    messages.append(self._to_message(method, properties, body))
+                if last_delivery_tag is not None:
+                    channel.basic_nack(delivery_tag=last_delivery_tag, multiple=True, requeue=True)
+            else:
+                prefetch_count = max(1, min(message_count, self._prefetch_count))
+                channel.basic_qos(prefetch_count=prefetch_count)
+                unacknowledged = 0
+                last_delivery_tag = None
+                for method, properties, body in channel.consume(message_source_queue, inactivity_timeout=1):
+                    if method is None:
+                        break
+                    messages.append(self._to_message(method, properties, body))
+                    last_delivery_tag = method.delivery_tag
+                    unacknowledged += 1
+                    if unacknowledged >= prefetch_count:
+                        channel.basic_ack(delivery_tag=last_delivery_tag, multiple=True)
+                        unacknowledged = 0
+                    if len(messages) >= message_count:
+                        break
+                if unacknowledged:
+                    channel.basic_ack(delivery_tag=last_delivery_tag, multiple=True)
+                channel.cancel()
+        except TransportError:
+            raise
+        except Exception as err:
+            self._drop_channel()
+            raise TransportError(None, str(err))
+
+        self._statistics.record('get', timer() - start, sum(message['payload_bytes'] for message in messages))
+
+        return messages
+
+    def publish_message(self, rabbit_destination_queue, message):
+        """Publishes a message to RabbitMQ and waits for the broker to confirm it.
+
+        :param rabbit_destination_queue: The name of the RabbitMQ destination exchange.
+        :param message: The message to publish (in the management API format).
+        :return: The status code of the publish.
+        """
+
+        properties = dict((name, value) for name, value in message.get('properties', {}).iteritems()
+                          if name in MESSAGE_PROPERTY_NAMES)
+        body = self._get_body(message)
+
+        start = timer()
+        try:
+            self.channel.basic_publish(exchange=rabbit_destination_queue,
+                                       routing_key=message.get('routing_key', ''),
+                                       body=body,
+                                       properties=self._properties_factory(**properties))
+        except TransportError:
+            raise
+        except Exception as err:
+            self._drop_channel()
+            raise TransportError(None, str(err))
+        self._statistics.record('publish', timer() - start, len(body))
+
+        return 200
+
+    def close(self):
+        """Closes every connection the transport opened.
+        """
+
+        with self._connections_lock:
+            for connection in self._connections:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+            self._connections = []
+        self._local = threading.local()
+
+    def _get_body(self, message):
+        payload = message.get('payload', '')
+
+        if message.get('payload_encoding') == 'base64':
+            return base64.b64decode(payload)
+
+        if isinstance(payload, unicode):
+            return payload.encode('utf-8')
+
+        return payload
+
+    def _to_message(self, method, properties, body):
+        """Converts an AMQP delivery into the message format used by the management API.
+        """
+
+        message_properties = {}
+        for name in MESSAGE_PROPERTY_NAMES:
+            value = getattr(properties, name, None)
+            if value is not None:
+                message_properties[name] = value
+
+        try:
+            payload = body.decode('utf-8')
+            payload_encoding = 'string'
+        except UnicodeDecodeError:
+            payload = base64.b64encode(body)
+            payload_encoding = 'base64'
+
+        return {'payload_bytes': len(body),
+                'redelivered': method.redelivered,
+                'exchange': method.exchange,
+                'routing_key': method.routing_key,
+                'message_count': getattr(method, 'message_count', 0),
+                'properties': message_properties,
+                'payload': payload,
+                'payload_encoding': payload_encoding}
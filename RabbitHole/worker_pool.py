@@ -0,0 +1,93 @@
+import threading
+
+from Queue import Queue
+
+# Tells a worker there's no more work
+_STOP = object()
+
+
+class WorkerPool(object):
+    """This class represents a fixed number of worker threads that run submitted tasks.
+
+    At most one task per worker is in flight and submitting blocks when every worker is busy, so callers can stream an
+    unbounded number of tasks through the pool without buffering them. Ordered pools always send tasks with the same
+    lane key to the same worker, which keeps their order.
+    """
+
+    def __init__(self, worker_count, ordered=False, name='worker'):
+        self._worker_count = max(1, worker_count)
+        self._ordered = ordered
+        self._errors = []
+        self._errors_lock = threading.Lock()
+
+        if ordered:
+            self._queues = [Queue(maxsize=1) for i in range(self._worker_count)]
+        else:
+            self._queues = [Queue(maxsize=self._worker_count)]
+
+        self._threads = []
+        for i in range(self._worker_count):
+            thread = threading.Thread(target=self._work,
+                                      args=(self._queues[i % len(self._queues)],),
+                                      name='{0}-{1}'.format(name, i))
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def worker_count(self):
+        return self._worker_count
+
+    @property
+    def errors(self):
+        """Gets the unexpected errors raised by the tasks.
+        """
+        with self._errors_lock:
+            return list(self._errors)
+
+    def submit(self, task, *args, **kwargs):
+        """Submits a task to the pool (blocking while the pool is full).
+
+        :param task: The callable to run.
+        :param args: The positional arguments for the task.
+        :param kwargs: The keyword arguments for the task (lane is reserved for the lane key).
+        """
+
+        lane = kwargs.pop('lane', None)
+
+        if self._ordered:
+            work_queue = self._queues[hash(lane) % len(self._queues)]
+        else:
+            work_queue = self._queues[0]
+
+        work_queue.put((task, args, kwargs))
+
+    def join(self):
+        """Waits for every submitted task to finish and stops the workers.
+        """
+
+        for i in range(self._worker_count):
+            self._queues[i % len(self._queues)].put(_STOP)
+
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.join()
+
+    def _work(self, work_queue):
+        while True:
+            work = work_queue.get()
+
+            if work is _STOP:
+                return
+
+            task, args, kwargs = work
+            try:
+                task(*args, **kwargs)
+            except Exception as err:
+                with self._errors_lock:
+                    self._errors.append(err)
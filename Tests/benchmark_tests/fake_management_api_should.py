@@ -0,0 +1,74 @@
+"""Unit tests for the FakeManagementApi class and the benchmark scenarios that run against it."""
+
+import pytest
+
+from Benchmarks.fake_management_api import FakeManagementApi
+from Benchmarks.scenarios import SCENARIOS
+from Benchmarks.scenarios import create_messages
+from Benchmarks.scenarios import run_scenario
+from RabbitHole.transports import HttpTransport
+from RabbitHole.transports import TransportError
+
+
+def create_transport(api):
+    return HttpTransport(api.url, api.port, '%2F', 'Basic Z3Vlc3Q6Z3Vlc3Q=')
+
+
+def test_leave_the_messages_on_the_queue_given_requeue():
+    with FakeManagementApi() as api:
+        api.fill_queue('source', create_messages(5, 10))
+
+        messages = create_transport(api).get_messages('source', 3, requeue=True)
+
+        assert len(messages) == 3
+        assert api.queue_depth('source') == 5
+
+
+def test_take_the_messages_off_the_queue_given_no_requeue():
+    with FakeManagementApi() as api:
+        api.fill_queue('source', create_messages(5, 10))
+
+        messages = create_transport(api).get_messages('source', 3, requeue=False)
+
+        assert [message['properties']['headers']['NServiceBus.MessageId'] for message in messages] == [
+            'benchmark-0', 'benchmark-1', 'benchmark-2']
+        assert api.queue_depth('source') == 2
+
+
+def test_deliver_published_messages_to_the_queue_with_the_exchange_name():
+    with FakeManagementApi() as api:
+        transport = create_transport(api)
+
+        for message in create_messages(2, 10):
+            transport.publish_message('destination', message)
+
+        assert api.published_count == 2
+        assert [message['payload'] for message in api.get_queue('destination')] == ['x' * 10, 'x' * 10]
+
+
+def test_list_the_queues_and_their_depths():
+    with FakeManagementApi() as api:
+        api.fill_queue('source', create_messages(5, 10))
+        api.fill_queue('source.error', create_messages(2, 10))
+
+        queues = create_transport(api).list_queues()
+
+        assert [(queue['name'], queue['messages']) for queue in queues] == [('source', 5), ('source.error', 2)]
+
+
+def test_fail_requests_given_an_error_rate():
+    with FakeManagementApi(error_rate=1.0) as api:
+        with pytest.raises(TransportError) as error:
+            create_transport(api).publish_message('destination', create_messages(1, 10)[0])
+
+        assert error.value.status_code == 500
+        assert api.error_count == 1
+
+
+@pytest.mark.parametrize('scenario', SCENARIOS)
+def test_move_every_message_in_each_scenario(scenario, capsys):
+    result = run_scenario(scenario, 20, 64)
+
+    assert result['error'] is None
+    assert result['moved_count'] == 20
+    assert result['request_count'] > 0
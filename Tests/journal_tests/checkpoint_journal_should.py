@@ -0,0 +1,131 @@
+"""Unit tests for the CheckpointJournal class."""
+
+import argparse
+import logging
+import os
+
+import pytest
+
+from Benchmarks.fake_management_api import FakeManagementApi
+from RabbitHole.configuration import Configuration
+from RabbitHole.console import Console
+from RabbitHole.replay_command import ReplayCommand
+from RabbitHole.checkpoint_journal import CheckpointJournal
+from RabbitHole.checkpoint_journal import get_message_key
+
+
+def test_remember_what_was_published_when_resuming(tmpdir):
+    journal_file = str(tmpdir.join('queue-Foo.journal'))
+    journal = CheckpointJournal(journal_file)
+    for number in (1, 2, 3, 5):
+        journal.commit(('messages.json', number))
+    journal.commit('message-1')
+    journal.close()
+
+    journal = CheckpointJournal(journal_file, resume=True)
+
+    assert journal.resumed_count == 5
+    assert [number for number in range(1, 7) if journal.is_committed(('messages.json', number))] == [1, 2, 3, 5]
+    assert not journal.is_committed(('other.json', 1))
+    assert journal.is_committed('message-1')
+    assert not journal.is_committed('message-2')
+
+
+def test_remember_the_messages_of_a_file_with_a_non_ascii_name_when_resuming(tmpdir):
+    message_file = os.path.join(str(tmpdir), u'r\u00e9sum\u00e9.json'.encode('utf-8'))
+    journal_file = str(tmpdir.join('queue-Foo.journal'))
+    journal = CheckpointJournal(journal_file)
+    journal.commit(get_message_key({}, message_file, 1))
+    journal.close()
+
+    journal = CheckpointJournal(journal_file, resume=True)
+
+    assert journal.is_committed(get_message_key({}, message_file, 1))
+    assert not journal.is_committed(get_message_key({}, message_file, 2))
+
+
+def test_only_skip_what_the_interrupted_run_published(tmpdir):
+    journal = CheckpointJournal(str(tmpdir.join('replay-Foo.journal')))
+
+    journal.commit('message-1')
+    journal.commit(('messages.json', 1))
+
+    assert not journal.is_committed('message-1')
+    assert not journal.is_committed(('messages.json', 1))
+
+
+def test_replay_every_message_that_shares_an_id_with_another(tmpdir):
+    messages = [{'routing_key': 'error',
+                 'properties': {'headers': {'NServiceBus.MessageId': 'message-{0}'.format(number % 100),
+                                            'NServiceBus.FailedQ': 'orders'}},
+                 'payload': u'{{"OrderId": {0}}}'.format(number)} for number in range(200)]
+
+    with FakeManagementApi() as api:
+        api.fill_queue('error', messages)
+        arguments = argparse.Namespace(rabbit_host_url=api.url,
+                                       rabbit_host_port=api.port,
+                                       rabbit_vhost='%2F',
+                                       rabbit_username='guest',
+                                       rabbit_password='guest',
+                                       transport='http',
+                                       simulate=False,
+                                       verbose=False,
+                                       silent=True,
+                                       debug=False,
+                                       command='replay',
+                                       message_count='1000',
+                                       message_source_queue='error',
+                                       journal_folder=str(tmpdir))
+        logger = logging.getLogger('Tests')
+        configuration = Configuration(logger, arguments)
+
+        ReplayCommand(configuration, Console(configuration), logger).execute()
+
+        assert api.queue_depth('orders') == 200
+
+
+def test_refuse_to_start_again_over_an_interrupted_run(tmpdir):
+    journal_file = str(tmpdir.join('replay-Foo.journal'))
+    CheckpointJournal(journal_file).close()
+
+    with pytest.raises(ValueError):
+        CheckpointJournal(journal_file)
+
+
+def test_delete_the_journal_once_the_run_completes(tmpdir):
+    journal_file = str(tmpdir.join('replay-Foo.journal'))
+    journal = CheckpointJournal(journal_file)
+    journal.commit('message-1')
+
+    journal.close(completed=True)
+
+    assert not os.path.exists(journal_file)
+
+
+def test_ignore_a_line_cut_short_by_a_killed_run(tmpdir):
+    journal_file = tmpdir.join('replay-Foo.journal')
+    journal_file.write('"message-1"\n"messa')
+
+    journal = CheckpointJournal(str(journal_file), resume=True)
+    journal.commit('message-2')
+    journal.close()
+
+    journal = CheckpointJournal(str(journal_file), resume=True)
+    assert journal.resumed_count == 2
+    assert journal.is_committed('message-2')
+
+
+def test_key_messages_by_position_or_id():
+    message = {'properties': {'headers': {'NServiceBus.MessageId': 'message-1'}}, 'payload': 'Foo'}
+
+    assert get_message_key(message, 'messages.json', 7) == ('messages.json', 7)
+    assert get_message_key(message) == 'message-1'
+    assert get_message_key({'payload': 'Foo'}) == get_message_key({'payload': 'Foo'})
+    assert get_message_key({'payload': 'Foo'}) != get_message_key({'payload': 'Bar'})
+
+
+def test_key_a_message_without_an_id_the_same_however_often_it_was_delivered():
+    message = {'properties': {'headers': {}}, 'payload': 'Foo', 'redelivered': False, 'message_count': 10}
+    redelivered_message = dict(message, redelivered=True, message_count=9)
+
+    assert get_message_key(message) == get_message_key(redelivered_message)
@@ -0,0 +1,57 @@
+"""Unit tests for the JsonCodec class."""
+
+import json
+
+import pytest
+
+from RabbitHole import json_codec
+from RabbitHole.json_codec import JsonCodec
+
+MESSAGE = {'payload': u'café / <tag> & "quotes"',
+           'payload_bytes': 1024,
+           'redelivered': False,
+           'properties': {'priority': None,
+                          'headers': {'NServiceBus.TimeToBeReceived': 0.30000000000000004,
+                                      'NServiceBus.Retries': [1, 2, 3],
+                                      'Really.Big.Number': 123456789012345678901234567890}}}
+
+INSTALLED_BACKENDS = [backend for backend in json_codec.BACKENDS
+                      if backend == 'json' or getattr(json_codec, backend) is not None]
+
+
+@pytest.mark.parametrize('backend', INSTALLED_BACKENDS)
+def test_encode_exactly_like_the_standard_library(backend):
+    codec = JsonCodec((backend,))
+
+    assert codec.dumps(MESSAGE) == json.dumps(MESSAGE, separators=(',', ':'))
+    assert codec.dumps(MESSAGE, indent=True) == json.dumps(MESSAGE, indent=2, separators=(',', ': '))
+
+
+@pytest.mark.parametrize('backend', INSTALLED_BACKENDS)
+def test_encode_to_bytes(backend):
+    assert isinstance(JsonCodec((backend,)).dumps(MESSAGE), str)
+
+
+@pytest.mark.parametrize('backend', INSTALLED_BACKENDS)
+def test_decode_exactly_like_the_standard_library(backend):
+    encoded = json.dumps(MESSAGE)
+
+    assert JsonCodec((backend,)).loads(encoded) == json.loads(encoded)
+
+
+@pytest.mark.parametrize('backend', INSTALLED_BACKENDS)
+def test_decode_the_value_at_an_index(backend):
+    message, end = JsonCodec((backend,)).raw_decode('[{"a": 1}, {"b": 2}]', 1)
+
+    assert message == {'a': 1}
+    assert end == 9
+
+
+@pytest.mark.parametrize('backend', INSTALLED_BACKENDS)
+def test_raise_a_value_error_given_invalid_json(backend):
+    with pytest.raises(ValueError):
+        JsonCodec((backend,)).loads('{"a": ')
+
+
+def test_only_use_the_standard_library_given_no_other_backends():
+    assert JsonCodec(('json',)).name == 'decode=json, indent=json, compact=json'
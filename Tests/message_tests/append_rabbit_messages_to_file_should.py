@@ -0,0 +1,97 @@
+"""Unit tests for the append_rabbit_messages_to_file function."""
+
+import argparse
+import json
+import logging
+
+import os
+import pytest
+from Benchmarks.fake_management_api import FakeManagementApi
+from Benchmarks.scenarios import create_messages
+from RabbitHole.configuration import Configuration
+from RabbitHole.console import Console
+from RabbitHole.rabbitmq import RabbitMQError
+from RabbitHole.rabbitmq_message_helper import RabbitMQMessageHelper
+from RabbitHole.snag_command import SnagCommand
+
+
+class FakeConsole(object):
+    def write_update(self, message):
+        pass
+
+    def write_error(self, message):
+        pass
+
+    def write_hint(self, message):
+        pass
+
+
+def test_leave_a_complete_json_array_after_every_chunk(tmpdir):
+    save_file = str(tmpdir.join('drained.json'))
+    helper = RabbitMQMessageHelper(None, FakeConsole(), None)
+
+    helper.append_rabbit_messages_to_file([{'ValueA': 1629}, {'ValueB': 1675}], save_file)
+    with open(save_file) as saved:
+        assert json.load(saved) == [{'ValueA': 1629}, {'ValueB': 1675}]
+
+    helper.append_rabbit_messages_to_file([{'ValueC': 2042}], save_file)
+    with open(save_file) as saved:
+        assert json.load(saved) == [{'ValueA': 1629}, {'ValueB': 1675}, {'ValueC': 2042}]
+
+
+def test_throw_exception_given_a_file_that_is_not_an_array(tmpdir):
+    save_file = str(tmpdir.join('single.json'))
+    with open(save_file, 'w') as single:
+        json.dump({'ValueA': 1629}, single)
+    helper = RabbitMQMessageHelper(None, FakeConsole(), None)
+
+    with pytest.raises(IOError):
+        helper.append_rabbit_messages_to_file([{'ValueB': 1675}], save_file)
+
+
+def test_refuse_a_file_with_messages_in_it_unless_told_to_append(tmpdir):
+    save_file = str(tmpdir.join('drained.json'))
+    helper = RabbitMQMessageHelper(None, FakeConsole(), None)
+    helper.check_rabbit_message_file_can_be_appended_to(save_file)
+    helper.append_rabbit_messages_to_file([{'ValueA': 1629}], save_file)
+
+    with pytest.raises(IOError):
+        helper.check_rabbit_message_file_can_be_appended_to(save_file)
+    helper.check_rabbit_message_file_can_be_appended_to(save_file, append=True)
+    with pytest.raises(IOError):
+        helper.check_rabbit_message_file_can_be_appended_to(save_file, append=True, archive_format='ndjson')
+    with pytest.raises(IOError):
+        helper.check_rabbit_message_file_can_be_appended_to(save_file, append=True, compression='gzip')
+
+
+@pytest.mark.parametrize('existing_messages, append', [([{'ValueA': 1629}], False), ({'ValueA': 1629}, True)])
+def test_leave_the_queue_alone_given_a_drain_to_a_file_it_cannot_use(tmpdir, existing_messages, append):
+    save_file = str(tmpdir.join('drained.json'))
+    with open(save_file, 'w') as existing:
+        json.dump(existing_messages, existing)
+
+    with FakeManagementApi() as api:
+        api.fill_queue('error', create_messages(10, 64))
+        arguments = argparse.Namespace(rabbit_host_url=api.url,
+                                       rabbit_host_port=api.port,
+                                       rabbit_vhost='%2F',
+                                       rabbit_username='guest',
+                                       rabbit_password='guest',
+                                       transport='http',
+                                       simulate=False,
+                                       verbose=False,
+                                       silent=True,
+                                       debug=False,
+                                       command='snag',
+                                       message_count='100',
+                                       message_source_queue='error',
+                                       save_file=save_file,
+                                       drain=True,
+                                       append=append)
+        logger = logging.getLogger('Tests')
+        configuration = Configuration(logger, arguments)
+
+        with pytest.raises(RabbitMQError):
+            SnagCommand(configuration, Console(configuration), logger).execute()
+
+        assert api.queue_depth('error') == 10
@@ -0,0 +1,125 @@
+"""Unit tests for the DeadLetterFile class."""
+
+import argparse
+import logging
+import re
+import sys
+import threading
+
+import pytest
+
+from Benchmarks.fake_management_api import FakeManagementApi
+from Benchmarks.scenarios import create_messages
+from RabbitHole.configuration import Configuration
+from RabbitHole.console import Console
+from RabbitHole.message_archive import MessageArchiveWriter
+from RabbitHole.queue_command import QueueCommand
+from RabbitHole.rabbitmq import RabbitMQError
+from RabbitHole.dead_letters import DeadLetterFile
+from RabbitHole.message_archive import MessageArchiveReader
+
+
+def test_only_create_the_file_when_a_message_fails(tmpdir):
+    dead_letters = DeadLetterFile(str(tmpdir.join('queue-Foo.dead-letters.ndjson')))
+    dead_letters.close()
+
+    assert not tmpdir.join('queue-Foo.dead-letters.ndjson').check()
+
+
+def test_save_every_failed_message_so_it_can_be_queued_again(tmpdir):
+    dead_letter_file = str(tmpdir.join('queue-Foo.dead-letters.ndjson'))
+    messages = [{'payload': 'Message {0}'.format(number)} for number in range(3)]
+    dead_letters = DeadLetterFile(dead_letter_file)
+
+    counts = [dead_letters.add(message) for message in messages]
+    dead_letters.close()
+
+    assert counts == [1, 2, 3]
+    assert list(MessageArchiveReader(dead_letter_file)) == messages
+
+
+def test_start_a_file_left_over_from_another_run_again_unless_adding_to_it(tmpdir):
+    dead_letter_file = str(tmpdir.join('queue-Foo.dead-letters.ndjson'))
+    for append in (False, False, True):
+        dead_letters = DeadLetterFile(dead_letter_file, append)
+        dead_letters.add({'payload': 'Foo'})
+        dead_letters.close()
+
+    assert len(list(MessageArchiveReader(dead_letter_file))) == 2
+
+
+def test_name_the_file_after_the_run():
+    arguments = argparse.Namespace(command='queue', silent=True, rabbit_destination_queue='Foo Queue')
+    configuration = Configuration(logging.getLogger('Tests'), arguments)
+
+    assert re.match(r'^queue-Foo_Queue\.\d{8}-\d{6}\.dead-letters\.ndjson$', configuration.dead_letter_file)
+
+
+def test_share_one_dead_letter_file_between_the_publishers_of_a_run(tmpdir):
+    arguments = argparse.Namespace(command='queue',
+                                   silent=True,
+                                   rabbit_destination_queue='Foo',
+                                   dead_letter_file=str(tmpdir.join('queue-Foo.dead-letters.ndjson')))
+    configuration = Configuration(logging.getLogger('Tests'), arguments)
+    counts = []
+    check_interval = sys.getcheckinterval()
+    sys.setcheckinterval(1)
+
+    try:
+        publishers = [threading.Thread(target=lambda: counts.append(configuration.dead_letters.add({'payload': 'Foo'})))
+                      for i in range(20)]
+        for publisher in publishers:
+            publisher.start()
+        for publisher in publishers:
+            publisher.join()
+    finally:
+        sys.setcheckinterval(check_interval)
+        configuration.dead_letters.close()
+
+    assert sorted(counts) == range(1, 21)
+    assert len(list(MessageArchiveReader(str(tmpdir.join('queue-Foo.dead-letters.ndjson'))))) == 20
+
+
+def queue_file(api, tmpdir, message_file, resume=False):
+    arguments = argparse.Namespace(rabbit_host_url=api.url,
+                                   rabbit_host_port=api.port,
+                                   rabbit_vhost='%2F',
+                                   rabbit_username='guest',
+                                   rabbit_password='guest',
+                                   transport='http',
+                                   simulate=False,
+                                   verbose=False,
+                                   silent=True,
+                                   debug=False,
+                                   command='queue',
+                                   message_source_file=message_file,
+                                   rabbit_destination_queue='orders',
+                                   journal_folder=str(tmpdir),
+                                   max_retries=0,
+                                   resume=resume,
+                                   dead_letter_file=str(tmpdir.join('queue-orders.dead-letters.ndjson')))
+    logger = logging.getLogger('Tests')
+    configuration = Configuration(logger, arguments)
+    try:
+        QueueCommand(configuration, Console(configuration), logger).queue_file()
+    finally:
+        configuration.dead_letters.close()
+
+
+def test_leave_the_dead_letters_out_of_a_resumed_run(tmpdir):
+    message_file = str(tmpdir.join('messages.ndjson'))
+    with MessageArchiveWriter(message_file, 'ndjson') as archive:
+        for message in create_messages(100, 64):
+            archive.write(message)
+
+    with FakeManagementApi(error_rate=0.2, seed=1) as api:
+        with pytest.raises(RabbitMQError):
+            queue_file(api, tmpdir, message_file)
+        published = api.queue_depth('orders')
+
+    with FakeManagementApi() as api:
+        queue_file(api, tmpdir, message_file, resume=True)
+        queue_file(api, tmpdir, str(tmpdir.join('queue-orders.dead-letters.ndjson')))
+
+        assert published < 100
+        assert published + api.queue_depth('orders') == 100
@@ -0,0 +1,100 @@
+"""Unit tests for the MessageDeduplicator and BloomFilter classes."""
+
+import argparse
+import hashlib
+import logging
+import sys
+import threading
+
+from Benchmarks.fake_management_api import FakeManagementApi
+from RabbitHole.configuration import Configuration
+from RabbitHole.console import Console
+from RabbitHole.deduplicator import BloomFilter
+from RabbitHole.deduplicator import MessageDeduplicator
+from RabbitHole.replay_command import ReplayCommand
+
+
+def create_message(payload, message_id='message-1', routing_key='error'):
+    return {'routing_key': routing_key,
+            'properties': {'headers': {'NServiceBus.MessageId': message_id, 'NServiceBus.FailedQ': 'orders'}},
+            'payload': payload}
+
+
+def test_suppress_copies_of_a_payload_whatever_their_headers():
+    deduplicator = MessageDeduplicator(1000)
+
+    assert not deduplicator.is_duplicate('orders', create_message(u'{"OrderId": 1}', 'message-1'))
+    assert deduplicator.is_duplicate('orders', create_message(u'{"OrderId": 1}', 'message-2'))
+    assert deduplicator.suppressed_count == 1
+
+
+def test_keep_messages_that_go_somewhere_else_or_differ():
+    deduplicator = MessageDeduplicator(1000)
+    deduplicator.is_duplicate('orders', create_message(u'{"OrderId": 1}'))
+
+    assert not deduplicator.is_duplicate('billing', create_message(u'{"OrderId": 1}'))
+    assert not deduplicator.is_duplicate('orders', create_message(u'{"OrderId": 1}', routing_key='other'))
+    assert not deduplicator.is_duplicate('orders', create_message(u'{"OrderId": 2}'))
+    assert deduplicator.suppressed_count == 0
+
+
+def test_stay_within_the_false_positive_rate_up_to_the_capacity():
+    bloom_filter = BloomFilter(20000, false_positive_rate=0.01)
+
+    for number in range(20000):
+        assert not bloom_filter.add(hashlib.md5('added-{0}'.format(number)).digest()) or number > 0
+
+    false_positives = sum(1 for number in range(1000) if bloom_filter.add(hashlib.md5(
+        'other-{0}'.format(number)).digest()))
+
+    assert false_positives < 1000 * 0.02
+    assert bloom_filter.size < 30000
+
+
+def test_share_one_deduplicator_between_the_workers_of_a_run():
+    arguments = argparse.Namespace(command='queue', silent=True, deduplicate=True, dedup_capacity=1000)
+    configuration = Configuration(logging.getLogger('Tests'), arguments)
+    deduplicators = []
+    check_interval = sys.getcheckinterval()
+    sys.setcheckinterval(1)
+
+    try:
+        workers = [threading.Thread(target=lambda: deduplicators.append(configuration.deduplicator))
+                   for i in range(20)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        sys.setcheckinterval(check_interval)
+
+    assert len(set(id(deduplicator) for deduplicator in deduplicators)) == 1
+
+
+def test_replay_a_retry_storm_once(tmpdir):
+    with FakeManagementApi() as api:
+        api.fill_queue('error', [create_message(u'{"OrderId": 1}', 'message-{0}'.format(number))
+                                 for number in range(100)] + [create_message(u'{"OrderId": 2}', 'message-100')])
+        arguments = argparse.Namespace(rabbit_host_url=api.url,
+                                       rabbit_host_port=api.port,
+                                       rabbit_vhost='%2F',
+                                       rabbit_username='guest',
+                                       rabbit_password='guest',
+                                       transport='http',
+                                       simulate=False,
+                                       verbose=False,
+                                       silent=True,
+                                       debug=False,
+                                       command='replay',
+                                       message_count='1000',
+                                       message_source_queue='error',
+                                       journal_folder=str(tmpdir),
+                                       deduplicate=True)
+        logger = logging.getLogger('Tests')
+        configuration = Configuration(logger, arguments)
+
+        ReplayCommand(configuration, Console(configuration), logger).execute()
+
+        assert sorted(message['payload'] for message in api.get_queue('orders')) == [u'{"OrderId": 1}',
+                                                                                     u'{"OrderId": 2}']
+        assert configuration.deduplicator.suppressed_count == 99
@@ -4,7 +4,24 @@ import json
 
 import os
 import pytest
-from RabbitHole.rabbitmq_message_helper import get_rabbit_messages_from_file
+from RabbitHole.rabbitmq_message_helper import RabbitMQMessageHelper
+
+
+class FakeConsole(object):
+    def write_update(self, message):
+        pass
+
+    def write_error(self, message):
+        pass
+
+
+class FakeLogger(object):
+    def debug(self, message, *args):
+        pass
+
+
+def get_rabbit_messages_from_file(message_file_name):
+    return RabbitMQMessageHelper(None, FakeConsole(), FakeLogger()).get_rabbit_messages_from_file(message_file_name)
 
 
 def test_throw_exception_given_file_not_found():
@@ -18,6 +35,6 @@ def test_load_valid_json_from_file():
     test_data = {'ValueA': 1629,  'ValueB': 1675, 'ValueC': 2042}
     with open(test_file_name, "w") as outfile:
         json.dump(test_data, outfile, indent=4)
-    result = get_rabbit_messages_from_file(test_file_name)
+    result = list(get_rabbit_messages_from_file(test_file_name))
     os.remove(test_file_name)
     assert result[0] == test_data
@@ -0,0 +1,68 @@
+"""Unit tests for the indexed message archives."""
+
+import pytest
+
+from RabbitHole.message_archive import MessageArchiveWriter
+from RabbitHole.message_archive_index import IndexedMessageArchiveReader
+
+MESSAGES = [{'routing_key': 'error',
+             'properties': {'headers': {'NServiceBus.MessageId': 'message-{0}'.format(number)}},
+             'payload': u'Message {0} \u2713\n'.format(number) * (number % 7)} for number in range(1, 101)]
+
+
+def write_archive(archive_file, messages, append=False):
+    with MessageArchiveWriter(archive_file, 'ndjson', append=append, index=True) as archive:
+        for message in messages:
+            archive.write(message)
+
+
+def test_read_back_a_range_of_messages(tmpdir):
+    archive_file = str(tmpdir.join('messages.ndjson'))
+    write_archive(archive_file, MESSAGES)
+
+    assert list(IndexedMessageArchiveReader(archive_file, 40, 45)) == MESSAGES[39:45]
+    assert list(IndexedMessageArchiveReader(archive_file, 96)) == MESSAGES[95:]
+    assert list(IndexedMessageArchiveReader(archive_file, last_message=3)) == MESSAGES[:3]
+
+
+def test_read_back_messages_by_id(tmpdir):
+    archive_file = str(tmpdir.join('messages.ndjson'))
+    write_archive(archive_file, MESSAGES)
+    reader = IndexedMessageArchiveReader(archive_file, message_ids=['message-7', 'message-70', 'message-700'])
+
+    assert list(reader) == [MESSAGES[6], MESSAGES[69]]
+    assert reader.missing_message_ids == ['message-700']
+
+
+def test_keep_the_index_up_to_date_when_adding_to_an_archive(tmpdir):
+    archive_file = str(tmpdir.join('messages.ndjson'))
+
+    for chunk in range(0, len(MESSAGES), 30):
+        write_archive(archive_file, MESSAGES[chunk:chunk + 30], append=True)
+
+    assert list(IndexedMessageArchiveReader(archive_file, 25, 65)) == MESSAGES[24:65]
+
+
+def test_refuse_to_read_an_archive_whose_index_is_out_of_date(tmpdir):
+    archive_file = str(tmpdir.join('messages.ndjson'))
+    write_archive(archive_file, MESSAGES)
+    with MessageArchiveWriter(archive_file, 'ndjson', append=True) as archive:
+        archive.write(MESSAGES[0])
+
+    with pytest.raises(IOError):
+        list(IndexedMessageArchiveReader(archive_file, 1, 2))
+
+
+def test_refuse_to_index_an_archive_that_has_no_index(tmpdir):
+    archive_file = str(tmpdir.join('messages.ndjson'))
+    with MessageArchiveWriter(archive_file, 'ndjson') as archive:
+        archive.write(MESSAGES[0])
+
+    with pytest.raises(ValueError):
+        write_archive(archive_file, MESSAGES, append=True)
+
+
+@pytest.mark.parametrize('archive_format, compression', [('json', 'none'), ('ndjson', 'gzip')])
+def test_refuse_to_index_an_archive_the_messages_cant_be_read_straight_from(tmpdir, archive_format, compression):
+    with pytest.raises(ValueError):
+        MessageArchiveWriter(str(tmpdir.join('messages')), archive_format, compression=compression, index=True)
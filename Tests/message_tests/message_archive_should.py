@@ -0,0 +1,163 @@
+"""Unit tests for the MessageArchiveReader and MessageArchiveWriter classes."""
+
+import io
+import json
+
+import pytest
+
+from RabbitHole import message_archive
+from RabbitHole.message_archive import MessageArchiveRangeReader
+from RabbitHole.message_archive import MessageArchiveReader
+from RabbitHole.message_archive import MessageArchiveWriter
+
+INSTALLED_COMPRESSIONS = [compression for compression in message_archive.COMPRESSIONS
+                          if compression != 'zstd' or message_archive.zstandard is not None]
+
+MESSAGES = [{'payload': 'A' * 100, 'properties': {'headers': {'Number': number}}} for number in range(50)]
+
+
+def test_write_one_compact_message_per_line_given_ndjson(tmpdir):
+    archive_file = str(tmpdir.join('messages.ndjson'))
+
+    with MessageArchiveWriter(archive_file, 'ndjson') as archive:
+        for message in MESSAGES:
+            archive.write(message)
+
+    with open(archive_file) as written:
+        lines = written.read().splitlines()
+    assert len(lines) == len(MESSAGES)
+    assert json.loads(lines[7]) == MESSAGES[7]
+    assert ', ' not in lines[0]
+
+
+def test_read_back_every_format(tmpdir):
+    for archive_format in ('json', 'ndjson'):
+        archive_file = str(tmpdir.join('messages.' + archive_format))
+        with MessageArchiveWriter(archive_file, archive_format) as archive:
+            for message in MESSAGES:
+                archive.write(message)
+
+        assert list(MessageArchiveReader(archive_file)) == MESSAGES
+
+
+def test_read_messages_spanning_many_reads(monkeypatch):
+    monkeypatch.setattr(message_archive, 'READ_SIZE', 7)
+    archive = io.BytesIO(json.dumps(MESSAGES, indent=2).encode('utf-8'))
+
+    assert list(MessageArchiveReader.iter_messages(archive)) == MESSAGES
+
+
+def test_yield_messages_before_reading_the_whole_archive(monkeypatch):
+    monkeypatch.setattr(message_archive, 'READ_SIZE', 1024)
+    archive = io.BytesIO(b'\n'.join(json.dumps(message).encode('utf-8') for message in MESSAGES))
+
+    messages = MessageArchiveReader.iter_messages(archive)
+
+    assert next(messages) == MESSAGES[0]
+    assert archive.tell() < len(archive.getvalue())
+
+
+@pytest.mark.parametrize('compression', INSTALLED_COMPRESSIONS)
+def test_read_back_every_format_whatever_the_compression(tmpdir, compression):
+    for archive_format in ('json', 'ndjson'):
+        # The compression is recognised from the contents rather than the name
+        archive_file = str(tmpdir.join('messages.' + archive_format))
+        with MessageArchiveWriter(archive_file, archive_format, compression=compression) as archive:
+            for message in MESSAGES:
+                archive.write(message)
+
+        assert list(MessageArchiveReader(archive_file)) == MESSAGES
+
+
+@pytest.mark.parametrize('compression', INSTALLED_COMPRESSIONS)
+def test_read_back_every_chunk_added_to_a_compressed_ndjson_archive(tmpdir, compression):
+    archive_file = str(tmpdir.join('drained.ndjson'))
+
+    for chunk in range(0, len(MESSAGES), 20):
+        with MessageArchiveWriter(archive_file, 'ndjson', append=True, compression=compression) as archive:
+            for message in MESSAGES[chunk:chunk + 20]:
+                archive.write(message)
+            archive.flush(durable=True)
+
+    assert list(MessageArchiveReader(archive_file)) == MESSAGES
+
+
+def test_write_a_much_smaller_file_given_compression(tmpdir):
+    plain_file = str(tmpdir.join('messages.json'))
+    compressed_file = str(tmpdir.join('messages.json.gz'))
+
+    for archive_file, compression in ((plain_file, 'none'), (compressed_file, 'gzip')):
+        with MessageArchiveWriter(archive_file, compression=compression) as archive:
+            for message in MESSAGES:
+                archive.write(message)
+
+    assert tmpdir.join('messages.json.gz').size() * 10 < tmpdir.join('messages.json').size()
+
+
+def test_refuse_to_add_to_a_compressed_json_archive(tmpdir):
+    with pytest.raises(ValueError):
+        MessageArchiveWriter(str(tmpdir.join('messages.json.gz')), 'json', append=True, compression='gzip')
+
+
+@pytest.mark.skipif(message_archive.zstandard is None, reason='requires the zstandard package')
+def test_read_back_an_archive_compressed_with_a_trained_dictionary(tmpdir):
+    archive_file = str(tmpdir.join('messages.ndjson.zst'))
+    dictionary_file = str(tmpdir.join('messages.dictionary'))
+    samples = [{'properties': {'headers': {'NServiceBus.MessageId': str(number), 'NServiceBus.FailedQ': 'Foo'}},
+                'payload': 'Message {0}'.format(number)} for number in range(2000)]
+    message_archive.train_compression_dictionary(samples, dictionary_file, 4096)
+
+    with MessageArchiveWriter(archive_file, 'ndjson', compression='zstd', compression_dictionary=dictionary_file) as archive:
+        for message in MESSAGES:
+            archive.write(message)
+
+    assert list(MessageArchiveReader(archive_file, dictionary_file)) == MESSAGES
+
+
+def test_raise_an_io_error_given_a_damaged_compressed_archive(tmpdir):
+    archive_file = str(tmpdir.join('messages.json.gz'))
+    with MessageArchiveWriter(archive_file, compression='gzip') as archive:
+        for message in MESSAGES:
+            archive.write(message)
+    with open(archive_file, 'r+b') as damaged:
+        damaged.seek(30)
+        damaged.write(b'\xff' * 50)
+
+    with pytest.raises(IOError):
+        list(MessageArchiveReader(archive_file))
+
+
+def test_split_an_ndjson_archive_into_ranges_that_hold_every_message_once(tmpdir):
+    archive_file = str(tmpdir.join('messages.ndjson'))
+    with MessageArchiveWriter(archive_file, 'ndjson') as archive:
+        for message in MESSAGES:
+            archive.write(message)
+
+    file_ranges = message_archive.split_message_archive(archive_file, 1000)
+
+    assert len(file_ranges) > 1
+    assert [message for start, end in file_ranges
+            for message in MessageArchiveRangeReader(archive_file, start, end)] == MESSAGES
+
+
+def test_start_each_range_on_a_whole_message_given_pretty_printed_lines(tmpdir):
+    archive_file = str(tmpdir.join('messages.ndjson'))
+    with open(archive_file, 'wb') as archive:
+        archive.write(json.dumps(MESSAGES[0]) + '\n')
+        archive.write(json.dumps(MESSAGES[1], indent=2) + '\n')
+        archive.write(json.dumps(MESSAGES[2]) + '\n')
+
+    file_ranges = message_archive.split_message_archive(archive_file, 200)
+
+    assert [message for start, end in file_ranges
+            for message in MessageArchiveRangeReader(archive_file, start, end)] == MESSAGES[:3]
+
+
+@pytest.mark.parametrize('archive_format, compression', [('json', 'none'), ('ndjson', 'gzip')])
+def test_leave_json_arrays_and_compressed_archives_whole(tmpdir, archive_format, compression):
+    archive_file = str(tmpdir.join('messages'))
+    with MessageArchiveWriter(archive_file, archive_format, compression=compression) as archive:
+        for message in MESSAGES:
+            archive.write(message)
+
+    assert message_archive.split_message_archive(archive_file, 1000) is None
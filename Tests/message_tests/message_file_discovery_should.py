@@ -0,0 +1,158 @@
+"""Unit tests for finding the message files in a folder and queueing them largest first."""
+
+import argparse
+import logging
+import threading
+
+from Benchmarks.fake_management_api import FakeManagementApi
+from Benchmarks.scenarios import create_messages
+from Benchmarks.scenarios import _write_archive
+from RabbitHole.configuration import Configuration
+from RabbitHole.console import Console
+from RabbitHole.message_file_discovery import MessageFileQueue
+from RabbitHole.message_file_discovery import find_message_files
+from RabbitHole.queue_command import QueueCommand
+
+
+def create_folder(tmpdir):
+    tmpdir.join('orders.json').write('x' * 30)
+    tmpdir.join('orders.ndjson.gz').write('x' * 10)
+    tmpdir.join('notes.txt').write('x')
+    tmpdir.join('orders.dead-letters.ndjson').write('x')
+    tmpdir.join('2019').mkdir().join('old.json').write('x' * 20)
+    tmpdir.join('archive').mkdir().join('older.json').write('x')
+
+
+def find_names(tmpdir, **arguments):
+    return sorted(file_name[len(str(tmpdir)) + 1:].replace('\\', '/')
+                  for file_name, size in find_message_files(str(tmpdir), **arguments))
+
+
+def test_find_only_message_files_in_the_folder_itself(tmpdir):
+    create_folder(tmpdir)
+
+    assert find_names(tmpdir) == ['orders.dead-letters.ndjson', 'orders.json', 'orders.ndjson.gz']
+
+
+def test_search_the_folders_in_the_folder_given_recursive(tmpdir):
+    create_folder(tmpdir)
+
+    assert find_names(tmpdir, recursive=True, exclude_files=('*.dead-letters.ndjson', 'archive')) == [
+        '2019/old.json', 'orders.json', 'orders.ndjson.gz']
+
+
+def test_match_patterns_with_a_slash_against_the_path_from_the_folder(tmpdir):
+    create_folder(tmpdir)
+
+    assert find_names(tmpdir, recursive=True, include_files=('2019/*',)) == ['2019/old.json']
+    assert find_names(tmpdir, include_files=('*',), exclude_files=('*json*',)) == ['notes.txt']
+
+
+def test_find_the_size_of_each_file(tmpdir):
+    create_folder(tmpdir)
+
+    assert dict(find_message_files(str(tmpdir.join('2019')))) == {str(tmpdir.join('2019', 'old.json')): 20}
+
+
+def test_hand_out_the_largest_file_found_so_far_first():
+    message_files = MessageFileQueue()
+    message_files.put('small.json', 10)
+    message_files.put('large.json', 1000)
+    message_files.put('medium.json', 100)
+    message_files.finish()
+
+    assert [message_files.get() for i in range(4)] == ['large.json', 'medium.json', 'small.json', None]
+
+
+def test_wait_for_files_while_the_folder_is_still_being_searched():
+    message_files = MessageFileQueue()
+    taken = []
+    taker = threading.Thread(target=lambda: taken.extend([message_files.get(), message_files.get()]))
+    taker.start()
+
+    message_files.put('first.json', 10)
+    message_files.finish()
+    taker.join(5)
+
+    assert taken == ['first.json', None]
+
+
+def test_queue_every_file_found_in_a_folder_and_the_folders_in_it(tmpdir):
+    messages = create_messages(9, 64)
+    _write_archive(str(tmpdir.join('first.json')), messages[:2])
+    _write_archive(str(tmpdir.mkdir('2019').join('second.ndjson')), messages[2:7])
+    _write_archive(str(tmpdir.mkdir('archive').join('third.json')), messages[7:])
+    tmpdir.join('README.txt').write('Not a message file')
+
+    with FakeManagementApi() as api:
+        namespace = argparse.Namespace(rabbit_host_url=api.url,
+                                       rabbit_host_port=api.port,
+                                       rabbit_vhost='%2F',
+                                       rabbit_username='guest',
+                                       rabbit_password='guest',
+                                       transport='http',
+                                       simulate=False,
+                                       verbose=False,
+                                       silent=True,
+                                       debug=False,
+                                       command='queue',
+                                       message_source_file=str(tmpdir),
+                                       rabbit_destination_queue='orders',
+                                       journal_folder=str(tmpdir.mkdir('journals')),
+                                       recursive=True,
+                                       exclude_files=['archive'])
+        logger = logging.getLogger('Tests')
+        configuration = Configuration(logger, namespace)
+        QueueCommand(configuration, Console(configuration), logger).queue_folder()
+
+        assert api.queue_depth('orders') == 7
+
+
+def test_let_a_bigger_file_found_later_go_before_smaller_ones_already_found(tmpdir):
+    message_files = MessageFileQueue()
+    busy = threading.Semaphore(0)
+    carry_on = threading.Event()
+    queued_files = []
+
+    def queue_folder_file(message_file, *arguments):
+        queued_files.append(message_file)
+        if message_file.startswith('first'):
+            busy.release()
+            carry_on.wait(5)
+
+    namespace = argparse.Namespace(command='queue', silent=True, rabbit_destination_queue='orders')
+    logger = logging.getLogger('Tests')
+    configuration = Configuration(logger, namespace)
+    queue_command = QueueCommand(configuration, Console(configuration), logger)
+    queue_command._queue_folder_file = queue_folder_file
+
+    workers = [threading.Thread(target=queue_command._queue_folder_files,
+                                args=(message_files, None, None, None, None, [], [], threading.Lock()))
+               for i in range(2)]
+    for worker in workers:
+        worker.start()
+
+    message_files.put('first-1.json', 10)
+    message_files.put('first-2.json', 10)
+    busy.acquire()
+    busy.acquire()
+
+    message_files.put('small-1.json', 10)
+    message_files.put('small-2.json', 10)
+    message_files.put('large.json', 1000)
+    message_files.finish()
+    carry_on.set()
+    for worker in workers:
+        worker.join(5)
+
+    # The two workers each take one of the files that were found while they were busy, so the large one is among them
+    assert 'large.json' in queued_files[2:4]
+    assert sorted(queued_files[2:]) == ['large.json', 'small-1.json', 'small-2.json']
+
+
+def test_leave_the_dead_letter_files_out_by_default(tmpdir):
+    create_folder(tmpdir)
+    namespace = argparse.Namespace(command='queue', silent=True, rabbit_destination_queue='orders')
+    configuration = Configuration(logging.getLogger('Tests'), namespace)
+
+    assert find_names(tmpdir, exclude_files=configuration.exclude_files) == ['orders.json', 'orders.ndjson.gz']
@@ -0,0 +1,117 @@
+"""Unit tests for the MessageFilter class (and the --where conditions it's made of)."""
+
+import argparse
+import logging
+
+import pytest
+
+from Benchmarks.fake_management_api import FakeManagementApi
+from RabbitHole.configuration import Configuration
+from RabbitHole.console import Console
+from RabbitHole.message_archive import MessageArchiveReader
+from RabbitHole.message_filter import MessageFilter
+from RabbitHole.snag_command import SnagCommand
+
+MESSAGE = {'routing_key': 'error',
+           'payload_bytes': 2048,
+           'redelivered': False,
+           'properties': {'priority': 5,
+                          'headers': {'NServiceBus.EnclosedMessageTypes': 'Billing.Messages.ChargeCard',
+                                      'NServiceBus.ExceptionInfo.ExceptionType': 'System.TimeoutException',
+                                      'NServiceBus.Retries': '3',
+                                      'Tags': ['urgent', 'retry']}},
+           'payload': u'{"Amount": 12.5, "Currency": "\u20ac"}'}
+
+
+def matches(*expressions):
+    return MessageFilter(expressions).matches(MESSAGE)
+
+
+@pytest.mark.parametrize('expression, expected', [
+    ('routing_key == error', True),
+    ('routing_key == "error"', True),
+    ('routing_key != error', False),
+    ('properties.headers.NServiceBus.EnclosedMessageTypes == Billing.Messages.ChargeCard', True),
+    ('properties.priority == 5', True),
+    ('properties.priority == 5.0', True),
+    ('redelivered == false', True),
+    ('properties.headers.Tags.0 == urgent', True),
+    ('properties.headers.Tags.-1 == retry', True),
+    ('properties.missing == anything', False),
+    ('properties.missing != anything', True),
+])
+def test_compare_values(expression, expected):
+    assert matches(expression) is expected
+
+
+@pytest.mark.parametrize('expression, expected', [
+    ('properties.headers.NServiceBus.ExceptionInfo.ExceptionType ~ Timeout', True),
+    ('properties.headers.NServiceBus.ExceptionInfo.ExceptionType ~ ^Timeout', False),
+    ('properties.headers.NServiceBus.ExceptionInfo.ExceptionType !~ "SqlException|IOException"', True),
+    ('payload ~ \xe2\x82\xac', True),
+    ('properties.headers ~ Timeout', False),
+])
+def test_match_regular_expressions(expression, expected):
+    assert matches(expression) is expected
+
+
+@pytest.mark.parametrize('expression, expected', [
+    ('payload_bytes > 1024', True),
+    ('payload_bytes <= 1024', False),
+    ('properties.headers.NServiceBus.Retries >= 3', True),
+    ('properties.headers.NServiceBus.Retries < 3', False),
+    ('routing_key > 3', False),
+    ('exists properties.headers.NServiceBus.Retries', True),
+    ('not exists properties.headers.NServiceBus.Retries', False),
+    ('not exists properties.message_id', True),
+])
+def test_compare_numbers_and_check_paths_exist(expression, expected):
+    assert matches(expression) is expected
+
+
+def test_require_every_condition():
+    assert matches('routing_key == error', 'payload_bytes > 1024')
+    assert not matches('routing_key == error', 'payload_bytes > 4096')
+
+
+@pytest.mark.parametrize('expression', ['routing_key', 'routing_key > big', 'payload ~ (', 'exists', '.. == 1'])
+def test_refuse_conditions_that_are_not_valid(expression):
+    with pytest.raises(ValueError):
+        MessageFilter([expression])
+
+
+def test_put_the_messages_that_do_not_match_back_when_draining(tmpdir):
+    messages = [{'routing_key': 'error',
+                 'properties': {'message_id': 'message-{0}'.format(number),
+                                'headers': {'Type': 'Match' if number % 3 == 0 else 'Other'}},
+                 'payload': 'Message {0}'.format(number)} for number in range(10)]
+
+    with FakeManagementApi() as api:
+        api.fill_queue('error', messages)
+        arguments = argparse.Namespace(rabbit_host_url=api.url,
+                                       rabbit_host_port=api.port,
+                                       rabbit_vhost='%2F',
+                                       rabbit_username='guest',
+                                       rabbit_password='guest',
+                                       transport='http',
+                                       simulate=False,
+                                       verbose=False,
+                                       silent=True,
+                                       debug=False,
+                                       command='snag',
+                                       message_count='100',
+                                       message_source_queue='error',
+                                       save_file=str(tmpdir.join('snagged.ndjson')),
+                                       archive_format='ndjson',
+                                       drain=True,
+                                       chunk_size=4,
+                                       where=['properties.headers.Type == Match'])
+        logger = logging.getLogger('Tests')
+        configuration = Configuration(logger, arguments)
+
+        SnagCommand(configuration, Console(configuration), logger).execute()
+
+        snagged = list(MessageArchiveReader(str(tmpdir.join('snagged.ndjson'))))
+        assert [message['payload'] for message in snagged] == ['Message 0', 'Message 3', 'Message 6', 'Message 9']
+        assert sorted(message['payload'] for message in api.get_queue('error')) == [
+            'Message 1', 'Message 2', 'Message 4', 'Message 5', 'Message 7', 'Message 8']
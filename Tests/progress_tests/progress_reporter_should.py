@@ -0,0 +1,115 @@
+"""Unit tests for the ProgressReporter class."""
+
+import argparse
+import logging
+import threading
+
+import pytest
+
+from Benchmarks.fake_management_api import FakeManagementApi
+from Benchmarks.scenarios import create_messages
+from RabbitHole.configuration import Configuration
+from RabbitHole.console import Console
+from RabbitHole.progress_reporter import ProgressReporter
+from RabbitHole.rabbitmq import RabbitMQ
+from RabbitHole.rabbitmq import RabbitMQError
+
+
+class FakeConsole(object):
+    def __init__(self):
+        self.progress = []
+
+    def write_progress(self, message, final=False, simulated=False):
+        self.progress.append((message, final))
+
+
+def test_only_show_the_final_progress_given_the_interval_has_not_passed():
+    console = FakeConsole()
+
+    with ProgressReporter(console, 'Publishing to Foo', 10000, interval=60) as progress:
+        for _ in range(10000):
+            progress.add()
+
+    assert len(console.progress) == 1
+    message, final = console.progress[0]
+    assert final
+    assert message.startswith('Publishing to Foo: 10000 of 10000 (100%)')
+
+
+def test_show_the_progress_every_time_the_interval_passes():
+    console = FakeConsole()
+    progress = ProgressReporter(console, 'Publishing to Foo', 3, interval=0)
+
+    progress.add()
+    progress.add()
+
+    assert [message.split(' - ')[0] for message, final in console.progress] == [
+        'Publishing to Foo: 1 of 3 (33%)', 'Publishing to Foo: 2 of 3 (67%)']
+    assert 'ETA' in console.progress[0][0]
+
+
+def test_leave_out_the_total_and_eta_given_no_total():
+    console = FakeConsole()
+
+    with ProgressReporter(console, 'Shuttling', interval=60) as progress:
+        progress.add(5)
+
+    message, final = console.progress[0]
+    assert message.startswith('Shuttling: 5 - ')
+    assert 'ETA' not in message
+
+
+def test_only_finish_once():
+    console = FakeConsole()
+    progress = ProgressReporter(console, 'Saving', 1, interval=0)
+
+    progress.finish()
+    progress.finish()
+    progress.add()
+
+    assert len(console.progress) == 1
+
+
+def test_count_what_every_thread_adds():
+    console = FakeConsole()
+    progress = ProgressReporter(console, 'Publishing', interval=60)
+
+    def add():
+        for _ in range(1000):
+            progress.add()
+
+    threads = [threading.Thread(target=add) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert progress.count == 8000
+
+
+def test_count_the_messages_that_failed_as_dealt_with(tmpdir):
+    with FakeManagementApi(error_rate=0.5, seed=1) as api:
+        arguments = argparse.Namespace(rabbit_host_url=api.url,
+                                       rabbit_host_port=api.port,
+                                       rabbit_vhost='%2F',
+                                       rabbit_username='guest',
+                                       rabbit_password='guest',
+                                       transport='http',
+                                       silent=True,
+                                       command='queue',
+                                       rabbit_destination_queue='orders',
+                                       max_retries=0,
+                                       dead_letter_file=str(tmpdir.join('queue-orders.dead-letters.ndjson')))
+        logger = logging.getLogger('Tests')
+        configuration = Configuration(logger, arguments)
+        rabbitmq = RabbitMQ(configuration, Console(configuration), logger)
+
+        with ProgressReporter(FakeConsole(), 'Publishing to orders', 40) as progress:
+            with pytest.raises(RabbitMQError):
+                rabbitmq.publish_messages(create_messages(40, 64), api.url, api.port, '%2F',
+                                          configuration.rabbit_authorization_string, 'orders', progress=progress)
+        rabbitmq.close()
+        configuration.dead_letters.close()
+
+        assert api.error_count > 0
+        assert progress.count == 40
@@ -0,0 +1,87 @@
+"""Unit tests for picking out queues by pattern and snagging or replaying them in a single run."""
+
+import argparse
+import logging
+import os
+
+import pytest
+
+from Benchmarks.fake_management_api import FakeManagementApi
+from Benchmarks.scenarios import create_messages
+from RabbitHole.configuration import Configuration
+from RabbitHole.console import Console
+from RabbitHole.message_archive import MessageArchiveReader
+from RabbitHole.queue_sweep import QueueSelector
+from RabbitHole.rabbitmq import RabbitMQError
+from RabbitHole.snag_command import SnagCommand
+
+QUEUES = [{'name': 'orders.error', 'messages': 3},
+          {'name': 'billing.error', 'messages': 1},
+          {'name': 'audit.error', 'messages': 0},
+          {'name': 'orders', 'messages': 7}]
+
+
+def create_snag_command(api, save_file, **arguments):
+    namespace = argparse.Namespace(rabbit_host_url=api.url,
+                                   rabbit_host_port=api.port,
+                                   rabbit_vhost='%2F',
+                                   rabbit_username='guest',
+                                   rabbit_password='guest',
+                                   transport='http',
+                                   simulate=False,
+                                   verbose=False,
+                                   silent=True,
+                                   debug=False,
+                                   command='snag',
+                                   message_count='100',
+                                   message_source_queue=None,
+                                   save_file=save_file,
+                                   **arguments)
+    logger = logging.getLogger('Tests')
+    configuration = Configuration(logger, namespace)
+    return SnagCommand(configuration, Console(configuration), logger)
+
+
+def test_pick_out_the_queues_with_messages_that_match_a_glob_pattern():
+    assert QueueSelector('*.error').select(QUEUES) == ['billing.error', 'orders.error']
+    assert QueueSelector('*.error').select(QUEUES, include_empty=True) == ['audit.error', 'billing.error',
+                                                                           'orders.error']
+
+
+def test_pick_out_the_queues_that_match_a_regular_expression_anywhere_in_their_name():
+    assert QueueSelector('^orders', regex=True).select(QUEUES) == ['orders', 'orders.error']
+    assert QueueSelector('ing', regex=True).select(QUEUES) == ['billing.error']
+
+
+def test_snag_each_matching_queue_to_a_file_of_its_own(tmpdir):
+    with FakeManagementApi() as api:
+        api.fill_queue('orders.error', create_messages(3, 10))
+        api.fill_queue('billing.error', create_messages(2, 10))
+        api.fill_queue('orders', create_messages(4, 10))
+
+        create_snag_command(api, str(tmpdir.join('snagged')), queue_pattern='*.error').execute()
+
+        assert sorted(os.listdir(str(tmpdir.join('snagged')))) == ['billing.error.json', 'orders.error.json']
+        assert len(list(MessageArchiveReader(str(tmpdir.join('snagged', 'orders.error.json'))))) == 3
+        assert api.queue_depth('orders.error') == 3
+
+
+def test_name_the_files_after_the_queues_given_a_queue_placeholder(tmpdir):
+    with FakeManagementApi() as api:
+        api.fill_queue('orders.error', create_messages(3, 10))
+
+        create_snag_command(api, str(tmpdir.join('{queue}-snagged.json')), queue_regex=r'\.error$').execute()
+
+        assert os.listdir(str(tmpdir)) == ['orders.error-snagged.json']
+
+
+def test_fail_the_run_after_the_other_queues_given_a_queue_fails(tmpdir):
+    with FakeManagementApi() as api:
+        api.fill_queue('orders.error', create_messages(3, 10))
+        api.fill_queue('billing.error', create_messages(2, 10))
+        tmpdir.join('billing.error').mkdir()
+
+        with pytest.raises(RabbitMQError):
+            create_snag_command(api, str(tmpdir.join('{queue}')), queue_pattern='*.error').execute()
+
+        assert tmpdir.join('orders.error').check(file=1)
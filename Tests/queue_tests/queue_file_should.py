@@ -0,0 +1,85 @@
+"""Unit tests for queueing a message file (in ranges at the same time when it is big)."""
+
+import argparse
+import logging
+
+import pytest
+
+from Benchmarks.fake_management_api import FakeManagementApi
+from Benchmarks.scenarios import create_messages
+from RabbitHole.configuration import Configuration
+from RabbitHole.console import Console
+from RabbitHole.message_archive import MessageArchiveWriter
+from RabbitHole.queue_command import QueueCommand
+from RabbitHole.rabbitmq import RabbitMQError
+
+
+def create_queue_command(api, tmpdir, **arguments):
+    namespace = argparse.Namespace(rabbit_host_url=api.url,
+                                   rabbit_host_port=api.port,
+                                   rabbit_vhost='%2F',
+                                   rabbit_username='guest',
+                                   rabbit_password='guest',
+                                   transport='http',
+                                   simulate=False,
+                                   verbose=False,
+                                   silent=True,
+                                   debug=False,
+                                   command='queue',
+                                   message_source_file=str(tmpdir.join('messages.ndjson')),
+                                   rabbit_destination_queue='orders',
+                                   journal_folder=str(tmpdir),
+                                   **arguments)
+    logger = logging.getLogger('Tests')
+    configuration = Configuration(logger, namespace)
+    return QueueCommand(configuration, Console(configuration), logger)
+
+
+def write_messages(tmpdir, message_count):
+    messages = create_messages(message_count, 64)
+    with MessageArchiveWriter(str(tmpdir.join('messages.ndjson')), 'ndjson') as archive:
+        for message in messages:
+            archive.write(message)
+    return messages
+
+
+def get_message_ids(messages):
+    return [message['properties']['headers']['NServiceBus.MessageId'] for message in messages]
+
+
+def test_queue_every_message_in_a_split_file_once(tmpdir):
+    messages = write_messages(tmpdir, 200)
+
+    with FakeManagementApi() as api:
+        queue_command = create_queue_command(api, tmpdir, split_size=0.005)
+        assert len(queue_command._get_file_ranges()) > 1
+
+        queue_command.queue_file()
+
+        assert sorted(get_message_ids(api.get_queue('orders'))) == sorted(get_message_ids(messages))
+
+
+def test_queue_a_file_in_order_given_preserve_order(tmpdir):
+    messages = write_messages(tmpdir, 50)
+
+    with FakeManagementApi() as api:
+        queue_command = create_queue_command(api, tmpdir, split_size=0.005, preserve_order=True)
+        assert queue_command._get_file_ranges() is None
+
+        queue_command.queue_file()
+
+        assert get_message_ids(api.get_queue('orders')) == get_message_ids(messages)
+
+
+def test_close_the_connections_given_the_file_fails(tmpdir):
+    tmpdir.join('messages.ndjson').write('Not a message\n')
+
+    with FakeManagementApi() as api:
+        queue_command = create_queue_command(api, tmpdir)
+        closed = []
+        queue_command._rabbitmq.close = lambda: closed.append(True)
+
+        with pytest.raises(RabbitMQError):
+            queue_command.queue_file()
+
+        assert closed
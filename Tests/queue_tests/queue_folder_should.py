@@ -0,0 +1,69 @@
+"""Unit tests for queueing every message file in a folder."""
+
+import argparse
+import logging
+
+import pytest
+
+from Benchmarks.fake_management_api import FakeManagementApi
+from Benchmarks.scenarios import create_messages
+from Benchmarks.scenarios import _write_archive
+from RabbitHole.configuration import Configuration
+from RabbitHole.console import Console
+from RabbitHole.queue_command import QueueCommand
+from RabbitHole.rabbitmq import RabbitMQ
+from RabbitHole.rabbitmq import RabbitMQError
+
+
+def create_queue_command(api, tmpdir):
+    namespace = argparse.Namespace(rabbit_host_url=api.url,
+                                   rabbit_host_port=api.port,
+                                   rabbit_vhost='%2F',
+                                   rabbit_username='guest',
+                                   rabbit_password='guest',
+                                   transport='http',
+                                   simulate=False,
+                                   verbose=False,
+                                   silent=False,
+                                   debug=False,
+                                   command='queue',
+                                   message_source_file=str(tmpdir.join('messages')),
+                                   rabbit_destination_queue='orders',
+                                   journal_folder=str(tmpdir))
+    logger = logging.getLogger('Tests')
+    configuration = Configuration(logger, namespace)
+    return QueueCommand(configuration, Console(configuration), logger)
+
+
+def get_message_ids(messages):
+    return [message['properties']['headers']['NServiceBus.MessageId'] for message in messages]
+
+
+def test_publish_the_other_files_and_report_the_one_that_failed(tmpdir, monkeypatch, capsys):
+    messages = create_messages(9, 64)
+    folder = tmpdir.mkdir('messages')
+    _write_archive(str(folder.join('first.json')), messages[:3])
+    folder.join('broken.json').write('Not a message\n')
+    _write_archive(str(folder.join('second.json')), messages[3:])
+
+    closed = []
+    close = RabbitMQ.close
+
+    def record_close(rabbitmq):
+        closed.append(rabbitmq)
+        close(rabbitmq)
+
+    monkeypatch.setattr(RabbitMQ, 'close', record_close)
+
+    with FakeManagementApi() as api:
+        with pytest.raises(RabbitMQError) as error:
+            create_queue_command(api, tmpdir).queue_folder()
+
+        assert str(error.value) == '1 of 3 files failed'
+        assert sorted(get_message_ids(api.get_queue('orders'))) == sorted(get_message_ids(messages))
+
+    output = capsys.readouterr()[0]
+    assert 'Files Failed:\x1b[0m \x1b[0;37;40m1' in output
+    assert '{0} was not queued'.format(folder.join('broken.json')) in output
+    # The RabbitMQ the workers share and the command's own
+    assert len(set(closed)) == 2
@@ -0,0 +1,71 @@
+"""Unit tests for returning messages to the queues they came from."""
+
+import argparse
+import logging
+
+import pytest
+
+from Benchmarks.fake_management_api import FakeManagementApi
+from Benchmarks.scenarios import create_message
+from RabbitHole.configuration import Configuration
+from RabbitHole.console import Console
+from RabbitHole.rabbitmq import RabbitMQError
+from RabbitHole.replay_command import ReplayCommand
+
+
+def create_replay_command(api, tmpdir, message_count):
+    namespace = argparse.Namespace(rabbit_host_url=api.url,
+                                   rabbit_host_port=api.port,
+                                   rabbit_vhost='%2F',
+                                   rabbit_username='guest',
+                                   rabbit_password='guest',
+                                   transport='http',
+                                   simulate=False,
+                                   verbose=False,
+                                   silent=True,
+                                   debug=False,
+                                   command='replay',
+                                   message_count=message_count,
+                                   message_source_queue='errors',
+                                   journal_folder=str(tmpdir))
+    logger = logging.getLogger('Tests')
+    configuration = Configuration(logger, namespace)
+    return ReplayCommand(configuration, Console(configuration), logger)
+
+
+def create_messages(source_queues):
+    return [create_message(number, 64, source_queue) for number, source_queue in enumerate(source_queues)]
+
+
+def get_message_ids(messages):
+    return [message['properties']['headers']['NServiceBus.MessageId'] for message in messages]
+
+
+def test_replay_each_message_to_its_own_source_queue(tmpdir):
+    messages = create_messages(['orders', 'invoices', 'orders', 'shipping', 'invoices', 'orders'])
+
+    with FakeManagementApi() as api:
+        api.fill_queue('errors', messages)
+
+        create_replay_command(api, tmpdir, len(messages)).execute()
+
+        for source_queue in ('orders', 'invoices', 'shipping'):
+            assert sorted(get_message_ids(api.get_queue(source_queue))) == sorted(get_message_ids(
+                [message for message in messages
+                 if message['properties']['headers']['NServiceBus.FailedQ'] == source_queue]))
+        assert api.published_count == len(messages)
+
+
+def test_replay_nothing_given_a_message_without_a_source_queue(tmpdir):
+    messages = create_messages(['orders', 'invoices', 'orders'])
+    for header in ('NServiceBus.FailedQ', 'NServiceBus.ProcessingEndpoint'):
+        del messages[1]['properties']['headers'][header]
+
+    with FakeManagementApi() as api:
+        api.fill_queue('errors', messages)
+
+        with pytest.raises(RabbitMQError):
+            create_replay_command(api, tmpdir, len(messages)).execute()
+
+        assert api.published_count == 0
+        assert get_message_ids(api.get_queue('errors')) == get_message_ids(messages)
@@ -0,0 +1,72 @@
+"""Unit tests for the RetryPolicy class."""
+
+import random
+
+import pytest
+
+from RabbitHole.retry_policy import RetryPolicy
+from RabbitHole.retry_policy import can_carry_on
+from RabbitHole.transports import TransportError
+
+
+class FlakyRequest(object):
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.attempts = 0
+
+    def __call__(self, value):
+        self.attempts += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return value
+
+
+def create_retry_policy(max_retries=3):
+    return RetryPolicy(max_retries, 0.1, sleep=lambda seconds: None, random_generator=random.Random(1))
+
+
+def test_try_again_until_the_request_succeeds():
+    request = FlakyRequest(TransportError(503, 'Unavailable'), TransportError(None, 'Connection reset'))
+
+    assert create_retry_policy().call(request, ('Foo',)) == 'Foo'
+    assert request.attempts == 3
+
+
+def test_give_up_after_the_last_retry():
+    request = FlakyRequest(*[TransportError(500, 'Internal error')] * 4)
+
+    with pytest.raises(TransportError):
+        create_retry_policy().call(request, ('Foo',))
+    assert request.attempts == 4
+
+
+@pytest.mark.parametrize('status_code', [400, 401, 404])
+def test_not_try_again_given_a_status_code_that_will_not_change(status_code):
+    request = FlakyRequest(TransportError(status_code, 'No'))
+
+    with pytest.raises(TransportError):
+        create_retry_policy().call(request, ('Foo',))
+    assert request.attempts == 1
+
+
+def test_not_try_again_given_no_answer_to_a_request_that_cannot_be_made_twice():
+    request = FlakyRequest(TransportError(None, 'Connection reset'))
+
+    with pytest.raises(TransportError):
+        create_retry_policy().call(request, ('Foo',), retry_unanswered=False)
+    assert request.attempts == 1
+
+
+def test_back_off_exponentially_up_to_the_limit():
+    retry_policy = RetryPolicy(10, 0.1, max_backoff=1.0, random_generator=random.Random(1))
+
+    for attempt in range(10):
+        assert 0 <= retry_policy.get_backoff(attempt) <= min(1.0, 0.1 * 2 ** attempt)
+
+
+def test_only_carry_on_after_failures_that_are_down_to_the_message_or_a_hiccup():
+    assert can_carry_on(TransportError(None, 'Connection reset'))
+    assert can_carry_on(TransportError(503, 'Unavailable'))
+    assert can_carry_on(TransportError(400, 'Bad message'))
+    assert not can_carry_on(TransportError(401, 'Unauthorized'))
+    assert not can_carry_on(TransportError(404, 'Not found'))
@@ -0,0 +1,43 @@
+"""Unit tests for the ScrubPlan class."""
+
+from RabbitHole.scrub_plan import ScrubPlan
+
+
+def build_message():
+    return {'routing_key': 'Orders',
+            'payload': '{"OrderId": 1}',
+            'properties': {'message_id': 'abc',
+                           'headers': {'NServiceBus.Retries': '3',
+                                       'NServiceBus.FailedQ': 'Orders',
+                                       'NServiceBus.MessageId': 'abc',
+                                       'Nested': {'NServiceBus.Retries': '1'}}}}
+
+
+def test_remove_fields_wherever_they_are():
+    message = ScrubPlan(['NServiceBus.Retries', 'NServiceBus.FailedQ']).scrub(build_message())
+
+    assert message['properties']['headers'] == {'NServiceBus.MessageId': 'abc', 'Nested': {}}
+
+
+def test_remove_only_the_field_at_an_exact_path():
+    message = ScrubPlan(['properties.headers.NServiceBus.Retries']).scrub(build_message())
+
+    assert 'NServiceBus.Retries' not in message['properties']['headers']
+    assert message['properties']['headers']['Nested'] == {'NServiceBus.Retries': '1'}
+    assert message['properties']['headers']['NServiceBus.FailedQ'] == 'Orders'
+
+
+def test_remove_nested_fields_at_an_exact_path():
+    message = ScrubPlan(['properties.headers.Nested.NServiceBus.Retries', 'properties.message_id']).scrub(
+        build_message())
+
+    assert message['properties']['headers']['Nested'] == {}
+    assert message['properties']['headers']['NServiceBus.Retries'] == '3'
+    assert 'message_id' not in message['properties']
+
+
+def test_ignore_paths_that_are_not_there():
+    message = ScrubPlan(['properties.missing.NServiceBus.Retries', 'properties.headers.Missing']).scrub(
+        build_message())
+
+    assert message == build_message()
@@ -0,0 +1,87 @@
+"""Unit tests for shuttling messages from one queue to another."""
+
+import argparse
+import logging
+
+import pytest
+
+from Benchmarks.fake_management_api import FakeManagementApi
+from Benchmarks.scenarios import create_messages
+from RabbitHole.configuration import Configuration
+from RabbitHole.console import Console
+from RabbitHole.message_archive import MessageArchiveReader
+from RabbitHole.rabbitmq import RabbitMQError
+from RabbitHole.shuttle_command import ShuttleCommand
+
+
+def create_shuttle_command(api, tmpdir, message_count, **arguments):
+    namespace = argparse.Namespace(rabbit_host_url=api.url,
+                                   rabbit_host_port=api.port,
+                                   rabbit_vhost='%2F',
+                                   rabbit_username='guest',
+                                   rabbit_password='guest',
+                                   transport='http',
+                                   simulate=False,
+                                   verbose=False,
+                                   silent=True,
+                                   debug=False,
+                                   command='shuttle',
+                                   message_count=message_count,
+                                   message_source_queue='errors',
+                                   rabbit_destination_queue='orders',
+                                   chunk_size=10,
+                                   buffer_chunks=2,
+                                   dead_letter_file=str(tmpdir.join('shuttle.dead-letters.ndjson')),
+                                   **arguments)
+    logger = logging.getLogger('Tests')
+    configuration = Configuration(logger, namespace)
+    return ShuttleCommand(configuration, Console(configuration), logger)
+
+
+def get_message_ids(messages):
+    return [message['properties']['headers']['NServiceBus.MessageId'] for message in messages]
+
+
+def read_message_ids(file_name):
+    return get_message_ids(MessageArchiveReader(str(file_name))) if file_name.check() else []
+
+
+def test_move_the_messages_to_the_destination_queue(tmpdir):
+    messages = create_messages(100, 64)
+
+    with FakeManagementApi() as api:
+        api.fill_queue('errors', messages)
+
+        create_shuttle_command(api, tmpdir, 60).execute()
+
+        assert api.queue_depth('errors') == 40
+        assert api.published_count == 60
+        assert sorted(get_message_ids(api.get_queue('orders'))) == sorted(get_message_ids(messages[:60]))
+
+
+def test_save_the_messages_that_were_not_published_given_publishing_fails(tmpdir, monkeypatch):
+    # The rescue file is written to the working folder
+    monkeypatch.chdir(tmpdir)
+    messages = create_messages(100, 64)
+
+    with FakeManagementApi() as api:
+        api.fill_queue('errors', messages)
+        handle = api.handle
+
+        def refuse_publishes_after_the_first_ones(path, body):
+            if path.endswith('/publish') and api.published_count >= 15:
+                return 401, {'error': 'not_authorised', 'reason': 'Access refused'}
+            return handle(path, body)
+
+        api.handle = refuse_publishes_after_the_first_ones
+
+        with pytest.raises(RabbitMQError):
+            create_shuttle_command(api, tmpdir, 100).execute()
+
+        rescued_ids = read_message_ids(tmpdir.join('shuttle-errors.rescued.json'))
+        dead_letter_ids = read_message_ids(tmpdir.join('shuttle.dead-letters.ndjson'))
+        published_ids = get_message_ids(api.get_queue('orders'))
+        left_ids = get_message_ids(api.get_queue('errors'))
+
+        assert rescued_ids
+        assert sorted(published_ids + dead_letter_ids + rescued_ids + left_ids) == sorted(get_message_ids(messages))
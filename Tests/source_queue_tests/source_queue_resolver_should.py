@@ -0,0 +1,46 @@
+"""Unit tests for the SourceQueueResolver class."""
+
+from RabbitHole.source_queue_resolver import SourceQueueResolver
+
+FIELDS = ('NServiceBus.FailedQ', 'NServiceBus.ProcessingEndpoint')
+
+
+def build_message(headers):
+    return {'routing_key': 'Orders', 'payload': '{}', 'properties': {'headers': headers}}
+
+
+def test_prefer_the_first_field():
+    resolver = SourceQueueResolver(FIELDS)
+
+    message = build_message({'NServiceBus.ProcessingEndpoint': 'Endpoint', 'NServiceBus.FailedQ': 'Orders'})
+
+    assert resolver.resolve(message) == 'Orders'
+
+
+def test_fall_back_to_a_lower_priority_field():
+    resolver = SourceQueueResolver(FIELDS)
+
+    assert resolver.resolve(build_message({'NServiceBus.ProcessingEndpoint': 'Endpoint'})) == 'Endpoint'
+
+
+def test_find_fields_outside_the_headers():
+    resolver = SourceQueueResolver(FIELDS)
+
+    message = {'properties': {'headers': {}}, 'extra': [{'NServiceBus.FailedQ': 'Orders'}]}
+
+    assert resolver.resolve(message) == 'Orders'
+
+
+def test_return_none_given_no_fields():
+    resolver = SourceQueueResolver(FIELDS)
+
+    assert resolver.resolve(build_message({'Other': 'Value'})) is None
+
+
+def test_resolve_messages_with_the_same_headers_from_the_cache():
+    resolver = SourceQueueResolver(FIELDS)
+    resolver.resolve(build_message({'NServiceBus.FailedQ': 'Orders', 'Other': 'Value'}))
+
+    resolver._search = None  # Any search would fail now
+
+    assert resolver.resolve(build_message({'NServiceBus.FailedQ': 'Invoices', 'Other': 'Value'})) == 'Invoices'
@@ -0,0 +1,85 @@
+"""Unit tests for the RunStatistics class."""
+
+import json
+import threading
+
+from RabbitHole.run_statistics import STAGES
+from RabbitHole.run_statistics import RunStatistics
+
+
+def test_count_the_work_done_in_each_stage():
+    statistics = RunStatistics()
+
+    statistics.record('publish', 0.002, 100)
+    statistics.record('publish', 0.004, 300)
+
+    publish = statistics.to_dictionary()['stages']['publish']
+    assert publish['count'] == 2
+    assert publish['bytes'] == 400
+    assert abs(publish['total_seconds'] - 0.006) < 1e-9
+    assert abs(publish['mean_ms'] - 3.0) < 1e-9
+
+
+def test_record_nothing_given_it_is_not_enabled():
+    statistics = RunStatistics(enabled=False)
+
+    statistics.record('get', 1.0, 100)
+
+    assert statistics.get_stage('get').count == 0
+
+
+def test_add_bytes_without_counting_them_as_work_given_a_count_of_zero():
+    statistics = RunStatistics()
+
+    statistics.record('file_read', 0.001)
+    statistics.record('file_read', 0.0, 5000, 0)
+
+    file_read = statistics.to_dictionary()['stages']['file_read']
+    assert file_read['count'] == 1
+    assert file_read['bytes'] == 5000
+    assert sum(bucket['count'] for bucket in file_read['histogram']) == 1
+
+
+def test_report_percentiles_from_the_histogram():
+    statistics = RunStatistics()
+
+    for _ in range(98):
+        statistics.record('get', 0.0001)
+    statistics.record('get', 0.5)
+    statistics.record('get', 0.5)
+
+    get = statistics.to_dictionary()['stages']['get']
+    assert get['p50_ms'] < 0.2
+    assert get['p99_ms'] == 500.0
+    assert get['max_ms'] == 500.0
+
+
+def test_count_the_work_done_on_every_thread():
+    statistics = RunStatistics()
+
+    def record():
+        for _ in range(1000):
+            statistics.record('scrub', 0.00001, 1)
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statistics.get_stage('scrub').count == 8000
+    assert statistics.get_stage('scrub').bytes == 8000
+
+
+def test_write_every_stage_to_a_json_file(tmpdir):
+    statistics_file = str(tmpdir.join('stats.json'))
+    statistics = RunStatistics()
+    statistics.record('encode', 0.001, 10)
+
+    statistics.write_json(statistics_file, 1.5)
+
+    with open(statistics_file) as written:
+        written_statistics = json.load(written)
+    assert written_statistics['elapsed_seconds'] == 1.5
+    assert sorted(written_statistics['stages']) == sorted(STAGES)
+    assert written_statistics['stages']['encode']['count'] == 1
@@ -0,0 +1,177 @@
+"""Unit tests for the AmqpTransport class (using an in-process stand-in for the broker)."""
+
+import collections
+
+import pytest
+
+from RabbitHole.transports import AmqpTransport
+from RabbitHole.transports import TransportError
+
+Delivery = collections.namedtuple('Delivery', 'delivery_tag redelivered exchange routing_key message_count')
+
+
+class FakeProperties(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeBroker(object):
+    """An in-process stand-in for an AMQP broker where every exchange delivers to the queue with the same name."""
+
+    def __init__(self):
+        self.queues = collections.defaultdict(collections.deque)
+        self.connections = 0
+        self.opened_connections = []
+
+    def connect(self):
+        self.connections += 1
+        connection = FakeConnection(self)
+        self.opened_connections.append(connection)
+        return connection
+
+
+class FakeConnection(object):
+    def __init__(self, broker):
+        self.broker = broker
+        self.closed = False
+
+    def channel(self):
+        return FakeChannel(self.broker)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeChannel(object):
+    def __init__(self, broker):
+        self.broker = broker
+        self.confirming = False
+        self.prefetch_count = None
+        self.unacknowledged = collections.OrderedDict()
+        self.next_delivery_tag = 1
+        self.broken = False
+
+    def confirm_delivery(self):
+        self.confirming = True
+
+    def basic_qos(self, prefetch_count):
+        self.prefetch_count = prefetch_count
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        assert self.confirming
+        if self.broken:
+            raise IOError('Connection reset by peer')
+        self.broker.queues[exchange].append((routing_key, body, properties))
+
+    def _deliver(self, queue):
+        routing_key, body, properties = self.broker.queues[queue].popleft()
+        delivery_tag = self.next_delivery_tag
+        self.next_delivery_tag += 1
+        self.unacknowledged[delivery_tag] = (queue, (routing_key, body, properties))
+        return Delivery(delivery_tag, False, queue, routing_key, len(self.broker.queues[queue])), properties, body
+
+    def basic_get(self, queue, auto_ack=False):
+        if self.broken:
+            raise IOError('Connection reset by peer')
+        if not self.broker.queues[queue]:
+            return None, None, None
+        return self._deliver(queue)
+
+    def consume(self, queue, inactivity_timeout=None):
+        while True:
+            assert len(self.unacknowledged) <= self.prefetch_count
+            if not self.broker.queues[queue]:
+                yield None, None, None
+                continue
+            yield self._deliver(queue)
+
+    def cancel(self):
+        self.basic_nack(max(self.unacknowledged) if self.unacknowledged else 0, multiple=True, requeue=True)
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        for tag in [tag for tag in self.unacknowledged if tag <= delivery_tag]:
+            del self.unacknowledged[tag]
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        for tag in reversed([tag for tag in self.unacknowledged if tag <= delivery_tag]):
+            queue, delivery = self.unacknowledged.pop(tag)
+            self.broker.queues[queue].appendleft(delivery)
+
+
+def build_transport(broker, prefetch_count=100):
+    return AmqpTransport('localhost', 5672, '/', 'guest', 'guest', prefetch_count,
+                         connection_factory=broker.connect, properties_factory=FakeProperties)
+
+
+def build_message(number):
+    return {'routing_key': 'Test',
+            'payload': '{{"Number": {0}}}'.format(number),
+            'payload_encoding': 'string',
+            'properties': {'message_id': str(number), 'headers': {'NServiceBus.FailedQ': 'Test'}}}
+
+
+def test_publish_messages_to_the_exchange_queue():
+    broker = FakeBroker()
+    transport = build_transport(broker)
+
+    for number in range(3):
+        transport.publish_message('Test', build_message(number))
+
+    assert [body for routing_key, body, properties in broker.queues['Test']] == [
+        '{"Number": 0}', '{"Number": 1}', '{"Number": 2}']
+
+
+def test_leave_messages_on_the_queue_given_requeue():
+    broker = FakeBroker()
+    transport = build_transport(broker)
+    for number in range(5):
+        transport.publish_message('Test', build_message(number))
+
+    messages = transport.get_messages('Test', 3, requeue=True)
+
+    assert [message['properties']['message_id'] for message in messages] == ['0', '1', '2']
+    assert messages[0]['properties']['headers'] == {'NServiceBus.FailedQ': 'Test'}
+    assert len(broker.queues['Test']) == 5
+    assert [body for routing_key, body, properties in broker.queues['Test']][0] == '{"Number": 0}'
+
+
+def test_consume_messages_under_the_prefetch_window_given_no_requeue():
+    broker = FakeBroker()
+    transport = build_transport(broker, prefetch_count=2)
+    for number in range(5):
+        transport.publish_message('Test', build_message(number))
+
+    messages = transport.get_messages('Test', 4, requeue=False)
+
+    assert [message['payload'] for message in messages] == [
+        '{"Number": 0}', '{"Number": 1}', '{"Number": 2}', '{"Number": 3}']
+    assert len(broker.queues['Test']) == 1
+
+
+def test_reuse_one_channel_per_thread():
+    broker = FakeBroker()
+    transport = build_transport(broker)
+
+    transport.publish_message('Test', build_message(1))
+    transport.get_messages('Test', 1, requeue=True)
+    transport.close()
+
+    assert broker.connections == 1
+
+
+@pytest.mark.parametrize('request_messages', [
+    lambda transport: transport.publish_message('Test', build_message(1)),
+    lambda transport: transport.get_messages('Test', 1, requeue=True)])
+def test_open_a_new_connection_after_the_channel_breaks(request_messages):
+    broker = FakeBroker()
+    transport = build_transport(broker)
+    transport.publish_message('Test', build_message(0))
+    transport.channel.broken = True
+
+    with pytest.raises(TransportError):
+        request_messages(transport)
+    request_messages(transport)
+
+    assert broker.connections == 2
+    assert broker.opened_connections[0].closed
+    assert not broker.opened_connections[1].closed
@@ -0,0 +1,119 @@
+"""Unit tests for the ClusterTransport class (using stand-ins for the nodes and the clock)."""
+
+import pytest
+
+from RabbitHole.transports import ClusterTransport
+from RabbitHole.transports import HttpTransport
+from RabbitHole.transports import NODE_COOLDOWN
+from RabbitHole.transports import TransportError
+from RabbitHole.transports import create_http_transport
+from RabbitHole.transports import split_host_urls
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeNode(object):
+    """A stand-in for a node's transport that takes a set time to answer (or fails with a set status code)."""
+
+    def __init__(self, clock, latency=0.25):
+        self.clock = clock
+        self.latency = latency
+        self.status_code = 200
+        self.published = []
+
+    def publish_message(self, rabbit_destination_queue, message):
+        self.clock.now += self.latency
+        if self.status_code != 200:
+            raise TransportError(self.status_code, 'The node failed')
+        self.published.append(message)
+        return 200
+
+    def close(self):
+        pass
+
+
+def publish(transport, count):
+    for number in range(count):
+        try:
+            transport.publish_message('destination', number)
+        except TransportError:
+            pass
+
+
+def test_spread_the_requests_across_nodes_that_are_equally_fast():
+    clock = FakeClock()
+    nodes = [FakeNode(clock), FakeNode(clock), FakeNode(clock)]
+    transport = ClusterTransport(nodes, clock)
+
+    publish(transport, 30)
+
+    assert transport.request_counts == [10, 10, 10]
+
+
+def test_send_less_work_to_a_node_that_slows_down():
+    clock = FakeClock()
+    nodes = [FakeNode(clock, latency=0.25), FakeNode(clock, latency=4.0)]
+    transport = ClusterTransport(nodes, clock)
+
+    publish(transport, 20)
+
+    assert len(nodes[1].published) == 1
+    assert len(nodes[0].published) == 19
+
+
+def test_leave_a_failed_node_alone_until_its_cooldown_is_over():
+    clock = FakeClock()
+    nodes = [FakeNode(clock, latency=0.0625), FakeNode(clock, latency=0.0625)]
+    nodes[0].status_code = None
+    transport = ClusterTransport(nodes, clock)
+
+    publish(transport, 10)
+
+    assert transport.request_counts == [1, 9]
+
+    nodes[0].status_code = 200
+    clock.now += NODE_COOLDOWN
+    publish(transport, 10)
+
+    assert len(nodes[0].published) > 0
+
+
+def test_keep_sending_to_a_node_that_rejects_a_message():
+    clock = FakeClock()
+    nodes = [FakeNode(clock), FakeNode(clock)]
+    nodes[0].status_code = 400
+    transport = ClusterTransport(nodes, clock)
+
+    publish(transport, 10)
+
+    assert transport.request_counts == [5, 5]
+
+
+def test_try_the_node_that_is_ready_first_given_every_node_has_failed():
+    clock = FakeClock()
+    nodes = [FakeNode(clock), FakeNode(clock)]
+    for node in nodes:
+        node.status_code = 503
+    transport = ClusterTransport(nodes, clock)
+
+    publish(transport, 3)
+
+    with pytest.raises(TransportError):
+        transport.publish_message('destination', 'message')
+    assert sum(transport.request_counts) == 4
+
+
+def test_split_a_host_url_list_into_nodes():
+    assert split_host_urls('http://node1, http://node2:15673/,,', 15672) == [('http://node1', 15672),
+                                                                           ('http://node2', 15673)]
+
+
+def test_only_create_a_cluster_transport_for_more_than_one_node():
+    assert isinstance(create_http_transport('http://node1', 15672, '%2F', 'Basic'), HttpTransport)
+    assert isinstance(create_http_transport('http://node1,http://node2', 15672, '%2F', 'Basic'), ClusterTransport)
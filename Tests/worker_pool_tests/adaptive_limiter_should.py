@@ -0,0 +1,103 @@
+"""Unit tests for the AdaptiveLimiter class."""
+
+import random
+import threading
+import time
+
+from RabbitHole.adaptive_limiter import AdaptiveLimiter
+
+
+def complete_requests(limiter, count, latency=0.01, overloaded=False, kind=None):
+    for _ in range(count):
+        limiter.acquire()
+        limiter.release(latency, overloaded, kind)
+
+
+def test_grow_the_window_while_the_broker_keeps_up():
+    limiter = AdaptiveLimiter(4, 2, 16)
+
+    complete_requests(limiter, 5)
+    assert limiter.limit == 5
+
+    complete_requests(limiter, 1000)
+    assert limiter.limit == 16
+
+
+def test_halve_the_window_when_the_broker_is_overloaded():
+    limiter = AdaptiveLimiter(16, 2, 32)
+
+    complete_requests(limiter, 1, overloaded=True)
+
+    assert limiter.limit == 8
+
+
+def test_only_shrink_the_window_once_per_window():
+    limiter = AdaptiveLimiter(16, 2, 32)
+
+    complete_requests(limiter, 8, overloaded=True)
+    assert limiter.limit == 8
+
+    complete_requests(limiter, 1, overloaded=True)
+    assert limiter.limit == 4
+
+
+def test_shrink_the_window_when_requests_slow_down():
+    limiter = AdaptiveLimiter(16, 2, 32)
+    complete_requests(limiter, 10, latency=0.01)
+
+    complete_requests(limiter, 1, latency=0.5)
+
+    assert limiter.limit == 8
+
+
+def test_keep_the_window_at_the_ceiling_while_latency_only_jitters():
+    limiter = AdaptiveLimiter(32, 2, 32)
+    jitter = random.Random(42)
+
+    for _ in range(500):
+        complete_requests(limiter, 1, latency=0.05 * jitter.uniform(0.5, 2), kind='get_messages')
+        complete_requests(limiter, 4, latency=0.01 * jitter.uniform(0.5, 2), kind='publish_message')
+        assert limiter.limit == 32
+
+
+def test_measure_each_kind_of_request_against_its_own_latency():
+    limiter = AdaptiveLimiter(16, 2, 32)
+    complete_requests(limiter, 10, latency=0.01, kind='publish_message')
+    complete_requests(limiter, 10, latency=0.01, kind='get_messages')
+
+    complete_requests(limiter, 1, latency=0.5, kind='get_messages')
+
+    assert limiter.limit == 8
+
+
+def test_never_leave_the_floor_and_the_ceiling():
+    limiter = AdaptiveLimiter(100, 3, 6)
+    assert limiter.limit == 6
+
+    complete_requests(limiter, 100, overloaded=True)
+    assert limiter.limit == 3
+
+
+def test_keep_requests_beyond_the_window_waiting():
+    limiter = AdaptiveLimiter(2, 2, 2)
+    running = []
+    most_running = []
+    lock = threading.Lock()
+
+    def request():
+        limiter.acquire()
+        with lock:
+            running.append(1)
+            most_running.append(len(running))
+        time.sleep(0.005)
+        with lock:
+            running.pop()
+        limiter.release(0.005)
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(most_running) == 2
@@ -0,0 +1,56 @@
+"""Unit tests for the ExecutionEngine class."""
+
+import threading
+import time
+
+from RabbitHole.engine import ExecutionEngine
+from RabbitHole.engine import TaskGroup
+
+
+def test_share_one_bounded_pool_between_publishing_threads():
+    engine = ExecutionEngine(3)
+    running = []
+    most_running = []
+    lock = threading.Lock()
+
+    def publish():
+        with lock:
+            running.append(1)
+            most_running.append(len(running))
+        time.sleep(0.005)
+        with lock:
+            running.pop()
+
+    def publish_messages():
+        group = TaskGroup()
+        for i in range(10):
+            engine.submit_publish(group, publish)
+        group.wait()
+
+    callers = [threading.Thread(target=publish_messages) for i in range(8)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+    engine.close()
+
+    assert len(most_running) == 80
+    assert max(most_running) <= 3
+
+
+def test_keep_the_errors_of_each_group_apart():
+    engine = ExecutionEngine(2)
+    failing_group = TaskGroup()
+    working_group = TaskGroup()
+
+    def fail():
+        raise ValueError('Boom')
+
+    engine.submit_publish(failing_group, fail)
+    engine.submit_publish(working_group, lambda: None)
+    failing_group.wait()
+    working_group.wait()
+    engine.close()
+
+    assert [str(error) for error in failing_group.errors] == ['Boom']
+    assert working_group.errors == []
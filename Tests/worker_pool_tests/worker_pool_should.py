@@ -0,0 +1,56 @@
+"""Unit tests for the WorkerPool class."""
+
+import threading
+import time
+
+from RabbitHole.worker_pool import WorkerPool
+
+
+def test_keep_the_order_of_each_lane_given_an_ordered_pool():
+    published = []
+    lock = threading.Lock()
+
+    def publish(destination, number):
+        time.sleep(0.001 * (number % 3))
+        with lock:
+            published.append((destination, number))
+
+    with WorkerPool(4, ordered=True) as pool:
+        for number in range(60):
+            destination = 'Queue{0}'.format(number % 5)
+            pool.submit(publish, destination, number, lane=destination)
+
+    assert len(published) == 60
+    for destination in set(destination for destination, number in published):
+        numbers = [number for lane, number in published if lane == destination]
+        assert numbers == sorted(numbers)
+
+
+def test_run_tasks_at_the_same_time():
+    running = []
+    most_running = []
+    lock = threading.Lock()
+
+    def work():
+        with lock:
+            running.append(1)
+            most_running.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.pop()
+
+    with WorkerPool(5) as pool:
+        for i in range(20):
+            pool.submit(work)
+
+    assert max(most_running) == 5
+
+
+def test_collect_unexpected_errors():
+    def fail():
+        raise ValueError('Boom')
+
+    with WorkerPool(2) as pool:
+        pool.submit(fail)
+
+    assert [str(error) for error in pool.errors] == ['Boom']